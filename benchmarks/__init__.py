@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks
+    ~~~~~~~~~~
+
+    Offline benchmarks for the hot paths of the Siilo storages. Run them
+    with ``python -m benchmarks.run --help``.
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
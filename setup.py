@@ -31,6 +31,9 @@ setup(
     package_data={
         '': ['LICENSE']
     },
+    install_requires=[
+        'futures; python_version < "3.2"',
+    ],
     license=open('LICENSE').read(),
     platforms='any',
     classifiers=[
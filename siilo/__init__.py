@@ -8,3 +8,5 @@
 """
 
 __version__ = '0.1.0'
+
+from ._sync import SyncReport, sync  # noqa
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo._cache
+    ~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe, bounded cache that evicts the least recently used
+    entries first.
+
+    :param maxsize: the maximum number of entries in the cache
+    :param ttl: if given, the number of seconds after which an entry
+        expires
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        #: The number of lookups that found an entry.
+        self.hits = 0
+
+        #: The number of lookups that didn't find an entry.
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_ratio(self):
+        """The ratio of lookups that found an entry, or ``None`` if
+        there have been no lookups."""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return float(self.hits) / lookups
+
+    def get(self, key, default=None):
+        """Return the value for ``key``, or ``default`` if the key is
+        not in the cache or its entry has expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.time():
+                self.misses += 1
+                return default
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Set the value for ``key``, evicting the least recently used
+        entry if the cache is full."""
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Remove the entry for ``key`` if it is in the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<LRUCache maxsize={maxsize!r}, size={size!r}>'.format(
+            maxsize=self.maxsize,
+            size=len(self)
+        )
@@ -7,7 +7,19 @@
     :license: MIT, see LICENSE for more details.
 """
 
+import os
 import sys
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # noqa
+
+try:
+    import http.client as http_client
+except ImportError:
+    import httplib as http_client  # noqa
+
 try:
     from urlparse import urljoin, urlunparse
     from urllib import quote
@@ -24,6 +36,53 @@ else:
     text_type = unicode
 
 
+try:
+    from os import replace
+except ImportError:
+    # Python 2 has no os.replace(), but os.rename() replaces the
+    # destination atomically on POSIX systems.
+    from os import rename as replace  # noqa
+
+
+try:
+    from time import perf_counter
+except ImportError:
+    # Python 2 has no monotonic high-resolution clock in the standard
+    # library.
+    perf_counter = time.time
+
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # noqa
+    except ImportError:
+        scandir = None
+
+if scandir is None:
+    class _DirEntry(object):
+        def __init__(self, directory, name):
+            self.name = name
+            self.path = os.path.join(directory, name)
+
+        def is_dir(self):
+            return os.path.isdir(self.path)
+
+        def is_file(self):
+            return os.path.isfile(self.path)
+
+        def stat(self):
+            return os.stat(self.path)
+
+    def scandir(path):  # noqa
+        """
+        A minimal fallback for :func:`os.scandir` for Python versions
+        older than 3.5, when the ``scandir`` backport is not installed.
+        """
+        return iter([_DirEntry(path, name) for name in os.listdir(path)])
+
+
 def force_text(s, encoding='utf-8'):
     if isinstance(s, text_type):
         return s
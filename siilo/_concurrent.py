@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo._concurrent
+    ~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import collections
+
+
+def map_bounded(function, items, max_workers):
+    """
+    Call ``function`` for each item of ``items`` in a pool of
+    ``max_workers`` threads, and yield ``(item, future)`` pairs in the
+    order of ``items``.
+
+    Unlike :meth:`concurrent.futures.Executor.map`, the items are
+    submitted lazily, and at most twice ``max_workers`` items are in
+    flight at a time. ``items`` can therefore be a generator of any
+    length.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers) as executor:
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
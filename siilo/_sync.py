@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo._sync
+    ~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+from collections import namedtuple
+import hashlib
+import re
+import time
+
+from ._concurrent import map_bounded
+from .transfer import TransferManager, _is_thread_safe
+
+
+class SyncReport(namedtuple(
+    'SyncReport',
+    ['transferred', 'skipped', 'deleted', 'bytes', 'seconds', 'failures']
+)):
+    """A summary of a synchronization, as returned by :func:`sync`.
+
+    .. attribute:: transferred
+
+       the number of files transferred to the destination
+
+    .. attribute:: skipped
+
+       the number of files that were already up to date
+
+    .. attribute:: deleted
+
+       the number of extraneous files deleted from the destination
+
+    .. attribute:: bytes
+
+       the number of bytes transferred
+
+    .. attribute:: seconds
+
+       the duration of the synchronization in seconds
+
+    .. attribute:: failures
+
+       a dictionary that maps the name of each file that couldn't be
+       compared, transferred or deleted to the exception raised
+    """
+    __slots__ = ()
+
+
+def sync(source, destination, prefix='', checksum=False, delete=False,
+         max_workers=16, progress=None):
+    """Make the files in ``destination`` whose names start with
+    ``prefix`` the same as in ``source``, transferring only the files
+    that are missing or have changed, and return a :class:`SyncReport`.
+
+    Example::
+
+        import siilo
+
+        report = siilo.sync(
+            FileSystemStorage(base_directory='/var/backups'),
+            AmazonS3Storage(..., connection_pool_size=16),
+            delete=True
+        )
+
+    The listings of both storages are read with :meth:`.Storage.walk`
+    and merged as they are streamed, so the files are never all kept in
+    memory. By default, a file is considered changed if its size
+    differs, if it has been modified in the source after it was
+    modified in the destination, or if the modification times are not
+    known but the ETags of the files differ. If ``checksum`` is `True`,
+    files of the same size are compared by the MD5 digests of their
+    contents instead. A digest is taken from the ETag of the file where
+    it is a plain MD5 digest, as for files uploaded to S3 without
+    multipart uploads, and computed by reading the file otherwise.
+
+    The changed files are transferred with a :class:`.TransferManager`
+    in ``max_workers`` threads. In checksum mode, the files are also
+    compared in ``max_workers`` threads, unless either storage is an
+    :class:`.ApacheLibcloudStorage` without a connection pool, in which
+    case the files are listed, compared and transferred one at a time
+    in the calling thread.
+
+    :param source: the :class:`.Storage` to copy the files from
+    :param destination: the :class:`.Storage` to copy the files to
+    :param prefix: only synchronize the files whose names start with
+        this prefix
+    :param checksum: compare the contents of files of the same size
+        instead of their modification times. Defaults to `False`.
+    :param delete: delete the files in ``destination`` that are not in
+        ``source``. Defaults to `False`.
+    :param max_workers: the maximum number of files compared or
+        transferred at the same time. Defaults to 16.
+    :param progress: passed to :meth:`.TransferManager.transfer`
+    """
+    start = time.time()
+    thread_safe = _is_thread_safe(source) and _is_thread_safe(destination)
+    counts = {'skipped': 0}
+    failures = {}
+    extraneous = []
+
+    def changed_names():
+        pairs = _merge(source.walk(prefix), destination.walk(prefix))
+        if checksum and thread_safe:
+            results = (
+                (pair, future.exception() or future.result())
+                for pair, future in map_bounded(
+                    lambda pair: _has_changed_contents(
+                        source,
+                        destination,
+                        *pair
+                    ),
+                    pairs,
+                    max_workers
+                )
+            )
+        elif checksum:
+            # The transfer manager uses the storages from this thread
+            # only, so the files are compared in it too.
+            results = (
+                (pair, _compare_contents(source, destination, *pair))
+                for pair in pairs
+            )
+        else:
+            results = (
+                (pair, _has_changed(*pair))
+                for pair in pairs
+            )
+        for (source_info, destination_info), result in results:
+            if source_info is None:
+                if delete:
+                    extraneous.append(destination_info.name)
+            elif isinstance(result, Exception):
+                failures[source_info.name] = result
+            elif result:
+                yield source_info.name
+            else:
+                counts['skipped'] += 1
+
+    manager = TransferManager(source, destination, max_workers=max_workers)
+    report = manager.transfer(changed_names(), progress=progress)
+    failures.update(report.failures)
+
+    deleted = 0
+    if extraneous:
+        for name, exc in destination.delete_many(extraneous).items():
+            if exc is None:
+                deleted += 1
+            else:
+                failures[name] = exc
+
+    return SyncReport(
+        transferred=report.files,
+        skipped=counts['skipped'],
+        deleted=deleted,
+        bytes=report.bytes,
+        seconds=time.time() - start,
+        failures=failures
+    )
+
+
+def _merge(source_infos, destination_infos):
+    """
+    Merge two listings sorted by name, and yield ``(source_info,
+    destination_info)`` pairs, where either one is ``None`` if the file
+    is only in the other listing.
+    """
+    source_infos = iter(source_infos)
+    destination_infos = iter(destination_infos)
+    source_info = next(source_infos, None)
+    destination_info = next(destination_infos, None)
+    while source_info is not None or destination_info is not None:
+        if destination_info is None or (
+            source_info is not None and
+            source_info.name < destination_info.name
+        ):
+            yield source_info, None
+            source_info = next(source_infos, None)
+        elif source_info is None or source_info.name > destination_info.name:
+            yield None, destination_info
+            destination_info = next(destination_infos, None)
+        else:
+            yield source_info, destination_info
+            source_info = next(source_infos, None)
+            destination_info = next(destination_infos, None)
+
+
+def _has_changed(source_info, destination_info):
+    if source_info is None or destination_info is None:
+        return True
+    if source_info.size is None or destination_info.size is None:
+        return True
+    if source_info.size != destination_info.size:
+        return True
+    if source_info.modified is not None and \
+            destination_info.modified is not None:
+        return source_info.modified > destination_info.modified
+    if source_info.etag is not None and destination_info.etag is not None:
+        return source_info.etag != destination_info.etag
+    return False
+
+
+def _has_changed_contents(source, destination, source_info,
+                          destination_info):
+    if source_info is None or destination_info is None:
+        return True
+    if source_info.size != destination_info.size:
+        return True
+    return _md5(source, source_info) != _md5(destination, destination_info)
+
+
+def _compare_contents(source, destination, source_info,
+                      destination_info):
+    """
+    Return the result of :func:`_has_changed_contents`, or the
+    exception it raises.
+    """
+    try:
+        return _has_changed_contents(
+            source,
+            destination,
+            source_info,
+            destination_info
+        )
+    except Exception as exc:
+        return exc
+
+
+_MD5_ETAG_RE = re.compile(r'^"?([0-9a-fA-F]{32})"?$')
+
+
+def _md5(storage, info):
+    match = _MD5_ETAG_RE.match(info.etag or '')
+    if match:
+        return match.group(1).lower()
+    md5 = hashlib.md5()
+    with storage.open(info.name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
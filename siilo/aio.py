@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.aio
+    ~~~~~~~~~
+
+    An :mod:`asyncio` interface for Siilo storages. This module requires
+    Python 3.5 or newer.
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import asyncio
+import functools
+import tempfile
+
+from .exceptions import ArgumentError, FileNotFoundError, SiiloError
+
+
+class AsyncStorage(object):
+    """An abstract :mod:`asyncio` interface for storage drivers.
+
+    The methods are coroutine versions of the methods of
+    :class:`.Storage`. Use :func:`to_async` to get an
+    :class:`AsyncStorage` for an existing storage::
+
+        from siilo.aio import to_async
+
+        async with to_async(storage) as async_storage:
+            async with await async_storage.open('hello.txt', 'wb') as f:
+                await f.write(b'Hello World!')
+            assert await async_storage.exists('hello.txt')
+    """
+
+    async def delete(self, name):
+        """Delete the file referenced by ``name``. See
+        :meth:`.Storage.delete`.
+        """
+        raise NotImplementedError
+
+    async def exists(self, name):
+        """Return ``True`` if the file referenced by ``name`` exists.
+        See :meth:`.Storage.exists`.
+        """
+        raise NotImplementedError
+
+    async def open(self, name, mode='rb'):
+        """Open the file referenced by ``name`` and return an
+        :class:`AsyncFile`. See :meth:`.Storage.open`.
+        """
+        raise NotImplementedError
+
+    async def size(self, name):
+        """Return the size of the file referenced by ``name`` in bytes.
+        See :meth:`.Storage.size`.
+        """
+        raise NotImplementedError
+
+    async def url(self, name):
+        """Return the URL of the file referenced by ``name``. See
+        :meth:`.Storage.url`.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Release the resources, such as threads and connections, held
+        by this storage.
+        """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncFile(object):
+    """An abstract :mod:`asyncio` file object returned by
+    :meth:`AsyncStorage.open`.
+
+    The methods are coroutine versions of the methods of regular file
+    objects. The file can be used as an asynchronous context manager,
+    which closes the file on exit.
+    """
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.closed = False
+
+    async def read(self, size=-1):
+        raise NotImplementedError
+
+    async def write(self, data):
+        raise NotImplementedError
+
+    async def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __repr__(self):
+        return '<{cls} name={name!r} mode={mode!r}>'.format(
+            cls=self.__class__.__name__,
+            name=self.name,
+            mode=self.mode
+        )
+
+
+class ThreadedAsyncStorage(AsyncStorage):
+    """An :class:`AsyncStorage` that runs the blocking methods of the
+    given storage in its own pool of threads.
+
+    Unlike :meth:`asyncio.loop.run_in_executor` with the default
+    executor, the pool is not shared with the rest of the application,
+    and at most ``max_workers`` calls are run at a time; the rest wait
+    in the pool's queue without blocking the event loop.
+
+    The wrapped storage must be safe to use from many threads. For
+    :class:`.ApacheLibcloudStorage` this means enabling its
+    ``connection_pool_size``.
+
+    :param storage: the :class:`.Storage` to wrap
+    :param max_workers: the maximum number of threads. Defaults to 16.
+    """
+
+    def __init__(self, storage, max_workers=16):
+        self.storage = storage
+        self.max_workers = max_workers
+        self._executor = None
+
+    async def _run(self, function, *args, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(function, *args, **kwargs)
+        )
+
+    async def delete(self, name):
+        await self._run(self.storage.delete, name)
+
+    async def exists(self, name):
+        return await self._run(self.storage.exists, name)
+
+    async def open(self, name, mode='rb'):
+        f = await self._run(self.storage.open, name, mode)
+        return _ThreadedAsyncFile(self, f, name, mode)
+
+    async def size(self, name):
+        return await self._run(self.storage.size, name)
+
+    async def url(self, name):
+        return await self._run(self.storage.url, name)
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_event_loop().run_in_executor(
+                None,
+                executor.shutdown
+            )
+
+    def __repr__(self):
+        return '<ThreadedAsyncStorage storage={storage!r}>'.format(
+            storage=self.storage
+        )
+
+
+class AsyncFileSystemStorage(ThreadedAsyncStorage):
+    """An :class:`AsyncStorage` for a :class:`.FileSystemStorage`.
+
+    Local disk I/O can't be done without blocking in :mod:`asyncio`, so
+    the file operations run in a pool of ``max_workers`` threads, like
+    in :class:`ThreadedAsyncStorage`. :meth:`url` doesn't touch the
+    disk and is computed directly in the event loop.
+    """
+
+    async def url(self, name):
+        return self.storage.url(name)
+
+
+class _ThreadedAsyncFile(AsyncFile):
+    def __init__(self, storage, file, name, mode):
+        super(_ThreadedAsyncFile, self).__init__(name, mode)
+        self._storage = storage
+        self._file = file
+
+    async def read(self, size=-1):
+        return await self._storage._run(self._file.read, size)
+
+    async def readline(self, size=-1):
+        return await self._storage._run(self._file.readline, size)
+
+    async def write(self, data):
+        return await self._storage._run(self._file.write, data)
+
+    async def seek(self, offset, whence=0):
+        return await self._storage._run(self._file.seek, offset, whence)
+
+    async def tell(self):
+        return await self._storage._run(self._file.tell)
+
+    async def close(self):
+        if not self.closed:
+            await self._storage._run(self._file.close)
+        await super(_ThreadedAsyncFile, self).close()
+
+
+class AsyncAmazonS3Storage(AsyncStorage):
+    """An :class:`AsyncStorage` for an :class:`.AmazonS3Storage` that
+    talks to S3 with non-blocking HTTP requests using `aiohttp`_::
+
+        pip install aiohttp
+
+    .. _aiohttp: https://docs.aiohttp.org/
+
+    The requests are authenticated with presigned URLs created with the
+    signer of the given storage, so no threads are needed and thousands
+    of operations can be in flight at the same time over at most
+    ``limit`` connections.
+
+    Files can be opened in ``'rb'`` mode, in which case the file is
+    streamed from S3 as it is read, and in ``'wb'`` mode, in which case
+    the written data is spooled to a temporary file and uploaded with a
+    single ``PUT`` request when the file is closed.
+
+    :param storage: the :class:`.AmazonS3Storage` to use
+    :param session: an :class:`aiohttp.ClientSession` to make the
+        requests with. By default a new session is created, and closed
+        in :meth:`close`.
+    :param limit: the maximum number of simultaneous connections of the
+        session created by default. Defaults to 100.
+    """
+
+    #: The number of seconds the presigned URLs for the requests are
+    #: valid for.
+    REQUEST_EXPIRES = 900
+
+    #: The maximum size of the written data kept in memory before it is
+    #: spooled to disk.
+    SPOOL_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, storage, session=None, limit=100):
+        self.storage = storage
+        self.limit = limit
+        self._session = session
+        self._owns_session = session is None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit)
+            )
+        return self._session
+
+    async def _request(self, method, name, **kwargs):
+        request = self.storage._build_unsigned_request(name)
+        request.method = method
+        self.storage._presigner.presign(request, self.REQUEST_EXPIRES)
+        return await self.session.request(method, request.uri, **kwargs)
+
+    async def _head(self, name):
+        response = await self._request('HEAD', name)
+        response.release()
+        if response.status == 404:
+            raise FileNotFoundError(name)
+        _raise_for_status(response, name)
+        return response
+
+    async def delete(self, name):
+        await self._head(name)
+        try:
+            response = await self._request('DELETE', name)
+            response.release()
+            _raise_for_status(response, name)
+        finally:
+            self.storage._invalidate_object(name)
+
+    async def exists(self, name):
+        try:
+            await self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def open(self, name, mode='rb'):
+        if mode == 'rb':
+            response = await self._request('GET', name)
+            if response.status == 404:
+                response.release()
+                raise FileNotFoundError(name)
+            try:
+                _raise_for_status(response, name)
+            except SiiloError:
+                response.release()
+                raise
+            return _S3AsyncReader(name, mode, response)
+        if mode == 'wb':
+            return _S3AsyncWriter(self, name, mode)
+        raise ArgumentError(
+            'Invalid mode {mode!r}. AsyncAmazonS3Storage supports only '
+            "'rb' and 'wb' modes.".format(mode=mode)
+        )
+
+    async def size(self, name):
+        response = await self._head(name)
+        return int(response.headers['Content-Length'])
+
+    async def url(self, name):
+        return self.storage.url(name)
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    def __repr__(self):
+        return '<AsyncAmazonS3Storage storage={storage!r}>'.format(
+            storage=self.storage
+        )
+
+
+class _S3AsyncReader(AsyncFile):
+    def __init__(self, name, mode, response):
+        super(_S3AsyncReader, self).__init__(name, mode)
+        self._response = response
+
+    async def read(self, size=-1):
+        return await self._response.content.read(size)
+
+    async def close(self):
+        if not self.closed:
+            self._response.release()
+        await super(_S3AsyncReader, self).close()
+
+
+class _S3AsyncWriter(AsyncFile):
+    def __init__(self, storage, name, mode):
+        super(_S3AsyncWriter, self).__init__(name, mode)
+        self._storage = storage
+        self._file = tempfile.SpooledTemporaryFile(storage.SPOOL_SIZE)
+        self._size = 0
+
+    async def write(self, data):
+        self._size += len(data)
+        await self._call(self._file.write, data)
+        return len(data)
+
+    async def close(self):
+        if self.closed:
+            return
+        try:
+            await self._call(self._file.seek, 0)
+            response = await self._storage._request(
+                'PUT',
+                self.name,
+                data=_iter_chunks(
+                    functools.partial(self._call, self._file.read)
+                ),
+                headers={'Content-Length': str(self._size)}
+            )
+            response.release()
+            _raise_for_status(response, self.name)
+        finally:
+            await self._call(self._file.close)
+            self._storage.storage._invalidate_object(self.name)
+            await super(_S3AsyncWriter, self).close()
+
+    async def _call(self, function, *args):
+        """
+        Call a method of the spooled file. Once the data has been
+        spooled to disk, the method is run in a thread, so that the disk
+        I/O doesn't block the event loop.
+        """
+        if self._size <= self._storage.SPOOL_SIZE:
+            return function(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(function, *args)
+        )
+
+
+async def _iter_chunks(read, chunk_size=64 * 1024):
+    while True:
+        chunk = await read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _raise_for_status(response, name):
+    if not 200 <= response.status < 300:
+        raise SiiloError(
+            'Unexpected status code {status} for {name!r}'.format(
+                status=response.status,
+                name=name
+            )
+        )
+
+
+def to_async(storage, **kwargs):
+    """Return an :class:`AsyncStorage` for the given storage.
+
+    :class:`.AmazonS3Storage` gets an :class:`AsyncAmazonS3Storage`,
+    :class:`.FileSystemStorage` gets an :class:`AsyncFileSystemStorage`
+    and the other storages get a :class:`ThreadedAsyncStorage`. The
+    keyword arguments are passed to the constructor of the class.
+    """
+    from .storages.amazon_s3 import AmazonS3Storage
+    from .storages.filesystem import FileSystemStorage
+    if isinstance(storage, AmazonS3Storage):
+        return AsyncAmazonS3Storage(storage, **kwargs)
+    if isinstance(storage, FileSystemStorage):
+        return AsyncFileSystemStorage(storage, **kwargs)
+    return ThreadedAsyncStorage(storage, **kwargs)
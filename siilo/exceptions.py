@@ -92,3 +92,36 @@ class FileNotAccessibleViaURLError(SiiloError):
         return 'The file "{name}" is not accessible via a URL.'.format(
             name=self.name
         )
+
+
+@unicode_compatible
+class ReplicationError(SiiloError):
+    """
+    Raised by :class:`.ReplicatedStorage` when a change to a file
+    succeeds in fewer replicas than the write quorum.
+
+    :param name: name of the file
+    :type name: str
+    :param succeeded: the number of replicas where the change succeeded
+    :type succeeded: int
+    :param quorum: the write quorum
+    :type quorum: int
+    :param errors: ``(storage, exception)`` pairs of the replicas where
+        the change failed
+    :type errors: list
+    """
+    def __init__(self, name, succeeded, quorum, errors):
+        self.name = force_text(name, 'utf-8')
+        self.succeeded = succeeded
+        self.quorum = quorum
+        self.errors = errors
+
+    def __str__(self):
+        return (
+            'The file "{name}" was changed in {succeeded} replicas, '
+            'fewer than the write quorum of {quorum}.'
+        ).format(
+            name=self.name,
+            succeeded=self.succeeded,
+            quorum=self.quorum
+        )
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.hedging
+    ~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import collections
+import math
+import threading
+
+from ._compat import perf_counter
+
+
+class HedgePolicy(object):
+    """Sends a duplicate request when the response to a read takes
+    longer than usual, and uses whichever response arrives first.
+
+    Example::
+
+        from siilo.hedging import HedgePolicy
+
+        policy = HedgePolicy(percentile=95, budget_ratio=0.05)
+        storage = AmazonS3Storage(..., hedge_policy=policy)
+        ...
+        print(policy.hedged, policy.hedges_won)
+
+    Most of the tail latency of reading small objects from a cloud
+    storage comes from the occasional request that is slow for reasons
+    that have nothing to do with the object, such as a slow server.
+    A second request for the same object is then likely to be faster.
+
+    The time it takes for the first byte of each response to arrive is
+    measured, and if it is longer than the ``percentile`` of the recent
+    measurements, the request is hedged: a duplicate request is sent,
+    the first of the two responses to arrive is used, and the other one
+    is discarded. Until ``min_samples`` measurements have been made,
+    requests are hedged after ``initial_delay`` seconds.
+
+    The duplicate requests are limited by a budget shared by all the
+    requests made with the policy, like the retries of
+    :class:`.RetryPolicy`: every request earns ``budget_ratio`` hedges,
+    and at most ``budget_reserve`` unused hedges are saved up. This
+    keeps the extra load on the storage at most ``budget_ratio`` in the
+    long run, even if the storage is slow for every request.
+
+    Each request waits for its first byte in a thread of its own, and
+    the two requests of a hedged read are made at the same time, so the
+    storage must be safe to use from many threads.
+
+    :param percentile: the percentile of the recent first byte latencies
+        after which a request is hedged. Defaults to 95.
+    :param initial_delay: the number of seconds after which a request is
+        hedged until enough latencies have been measured. Defaults to
+        0.05.
+    :param min_delay: the minimum number of seconds to wait before
+        hedging a request. Defaults to 0.005.
+    :param min_samples: the number of latencies measured before
+        ``percentile`` is used. Defaults to 20.
+    :param window: the number of recent latencies the percentile is
+        computed from. Defaults to 1000.
+    :param budget_ratio: the number of hedged requests each request
+        adds to the budget. Defaults to 0.05.
+    :param budget_reserve: the maximum number of hedged requests saved
+        up in the budget, which is also its initial size. Defaults to 10.
+    :param max_size: the size in bytes of the largest object whose reads
+        are hedged, so that large downloads aren't duplicated. Defaults
+        to 1 MiB.
+    """
+
+    #: The number of new latencies measured before the delay is computed
+    #: again.
+    RECOMPUTE_INTERVAL = 16
+
+    def __init__(self, percentile=95, initial_delay=0.05, min_delay=0.005,
+                 min_samples=20, window=1000, budget_ratio=0.05,
+                 budget_reserve=10, max_size=1024 * 1024):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.budget_reserve = budget_reserve
+        self.max_size = max_size
+
+        #: The number of requests made.
+        self.requests = 0
+
+        #: The number of requests that were hedged.
+        self.hedged = 0
+
+        #: The number of hedged requests where the duplicate request
+        #: responded first.
+        self.hedges_won = 0
+
+        #: The number of slow requests that weren't hedged because the
+        #: budget was used up.
+        self.budget_exhausted = 0
+
+        self._latencies = collections.deque(maxlen=window)
+        self._new_latencies = 0
+        self._delay = max(initial_delay, min_delay)
+        self._tokens = float(budget_reserve)
+        self._lock = threading.Lock()
+
+    @property
+    def delay(self):
+        """The number of seconds after which a request is hedged."""
+        return self._delay
+
+    def call(self, function, *args):
+        """Call ``function`` with the given arguments in a thread, call
+        it again in another thread if it hasn't returned within
+        :attr:`delay`, and return the result of the call that returns
+        first.
+
+        The function should return when the first byte of the response
+        has arrived. If its result has a ``close()`` method, it is
+        called for the result that isn't used. If both calls raise an
+        exception, the exception of the first call is raised.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(
+                self._tokens + self.budget_ratio,
+                self.budget_reserve
+            )
+        start = perf_counter()
+        primary = _spawn(function, *args)
+        primary.add_done_callback(
+            lambda future: self._measure(future, perf_counter() - start)
+        )
+        if wait([primary], timeout=self._delay).done:
+            return primary.result()
+        if not self._withdraw():
+            return primary.result()
+        hedge = _spawn(function, *args)
+        with self._lock:
+            self.hedged += 1
+
+        pending = set([primary, hedge])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (primary, hedge):
+                if future in done and future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges_won += 1
+                    for other in (primary, hedge):
+                        if other is not future:
+                            other.add_done_callback(_discard)
+                    return future.result()
+        return primary.result()
+
+    def _measure(self, future, seconds):
+        if future.exception() is not None:
+            return
+        with self._lock:
+            self._latencies.append(seconds)
+            self._new_latencies += 1
+            if len(self._latencies) >= self.min_samples and \
+                    self._new_latencies >= self.RECOMPUTE_INTERVAL:
+                self._new_latencies = 0
+                self._delay = max(
+                    _percentile(sorted(self._latencies), self.percentile),
+                    self.min_delay
+                )
+
+    def _withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def __repr__(self):
+        return (
+            '<HedgePolicy delay={delay:.3f}, requests={requests!r}, '
+            'hedged={hedged!r}, hedges_won={hedges_won!r}>'
+        ).format(
+            delay=self._delay,
+            requests=self.requests,
+            hedged=self.hedged,
+            hedges_won=self.hedges_won
+        )
+
+
+def _spawn(function, *args):
+    """
+    Call ``function`` in a new daemon thread and return a
+    :class:`~concurrent.futures.Future` of its result.
+
+    A thread is used for each call instead of a pool, so that a request
+    never waits in a queue behind slow requests.
+    """
+    from concurrent.futures import Future
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = function(*args)
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    thread = threading.Thread(target=run, name='siilo-hedge')
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def _discard(future):
+    if future.exception() is None:
+        close = getattr(future.result(), 'close', None)
+        if close is not None:
+            close()
+
+
+def _percentile(sorted_values, percent):
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.instrumentation
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+from collections import namedtuple
+import logging
+import math
+import threading
+
+from ._compat import perf_counter
+from .storages.base import Storage
+
+
+class Event(namedtuple(
+    'Event',
+    ['backend', 'operation', 'name', 'seconds', 'bytes', 'error']
+)):
+    """A storage operation, as passed to the sinks of an
+    :class:`InstrumentedStorage`.
+
+    .. attribute:: backend
+
+       the label of the storage the operation was done on
+
+    .. attribute:: operation
+
+       the name of the operation, e.g. ``'open'``, ``'read'`` or
+       ``'exists'``
+
+    .. attribute:: name
+
+       the name of the file the operation was done on, or ``None`` for
+       operations on many files
+
+    .. attribute:: seconds
+
+       the duration of the operation in seconds
+
+    .. attribute:: bytes
+
+       the number of bytes read or written by the operation
+
+    .. attribute:: error
+
+       the class of the exception raised by the operation, or ``None``
+       if it succeeded
+    """
+    __slots__ = ()
+
+
+class InstrumentedStorage(Storage):
+    """A storage that measures the operations on another storage and
+    passes them to sinks as :class:`Event` objects.
+
+    Example::
+
+        from siilo.instrumentation import (
+            HistogramSink,
+            InstrumentedStorage,
+            LoggingSink
+        )
+
+        histogram = HistogramSink()
+        storage = InstrumentedStorage(
+            AmazonS3Storage(...),
+            sinks=[LoggingSink(), histogram],
+            backend='s3-eu-west-1'
+        )
+        ...
+        for (backend, operation), stats in histogram.summary().items():
+            print(backend, operation, stats.p99)
+
+    A sink is any callable that accepts an :class:`Event`, so a plain
+    function can be used as a callback. The sinks are called in the
+    thread that did the operation, so they must be thread-safe.
+
+    The operations :meth:`~.Storage.copy`, :meth:`~.Storage.delete`,
+    :meth:`~.Storage.delete_many`, :meth:`~.Storage.exists`,
+    :meth:`~.Storage.move`, :meth:`~.Storage.open`,
+    :meth:`~.Storage.size` and :meth:`~.Storage.url` each emit an event.
+    :meth:`~.Storage.iter_urls` and :meth:`~.Storage.urls` emit an
+    ``'iter_urls'`` event once all the URLs have been generated, with
+    the total time spent generating them.
+    The files returned by :meth:`open` emit a ``'read'`` and a
+    ``'write'`` event when they are closed, with the total time spent in
+    and the number of bytes returned by or passed to their read and
+    write methods, followed by a ``'close'`` event. For text files, the
+    byte counts are counts of characters.
+
+    For an :class:`.ApacheLibcloudStorage`, this separates the time
+    spent in the different requests: ``'exists'``, ``'size'`` and
+    ``'open'`` in read mode measure fetching the object's metadata with
+    a ``HEAD`` request, ``'read'`` measures downloading the object, and
+    ``'close'`` in write mode measures completing the upload.
+
+    The list of sinks can be changed at any time. While it is empty,
+    the operations are passed directly to the wrapped storage, and files
+    are returned without wrapping them. Any other attribute is looked up
+    from the wrapped storage.
+
+    :param storage: the :class:`.Storage` to measure
+    :param sinks: a list of callables that are called with each
+        :class:`Event`
+    :param backend: the label of the storage in the events. Defaults to
+        the ``repr()`` of ``storage``.
+    """
+
+    def __init__(self, storage, sinks, backend=None):
+        self.storage = storage
+        self.sinks = sinks
+        self.backend = repr(storage) if backend is None else backend
+
+    def copy(self, src, dst):
+        self._call('copy', src, self.storage.copy, src, dst)
+
+    def delete(self, name):
+        self._call('delete', name, self.storage.delete, name)
+
+    def delete_many(self, names):
+        return self._call('delete_many', None, self.storage.delete_many,
+                          names)
+
+    def exists(self, name):
+        return self._call('exists', name, self.storage.exists, name)
+
+    def iterdir(self, prefix=''):
+        return self.storage.iterdir(prefix)
+
+    def walk(self, prefix=''):
+        return self.storage.walk(prefix)
+
+    def move(self, src, dst):
+        self._call('move', src, self.storage.move, src, dst)
+
+    def open(self, name, *args, **kwargs):
+        # The arguments are passed on as they are, since the storages
+        # differ in their default modes and in supporting encodings.
+        f = self._call('open', name, self.storage.open, name, *args,
+                       **kwargs)
+        if not self.sinks:
+            return f
+        return _InstrumentedFile(self, f, name)
+
+    def size(self, name):
+        return self._call('size', name, self.storage.size, name)
+
+    def url(self, name, *args, **kwargs):
+        return self._call('url', name, self.storage.url, name, *args,
+                          **kwargs)
+
+    def urls(self, names, *args, **kwargs):
+        return list(self.iter_urls(names, *args, **kwargs))
+
+    def iter_urls(self, names, *args, **kwargs):
+        urls = self.storage.iter_urls(names, *args, **kwargs)
+        if not self.sinks:
+            return urls
+        return self._iter_urls(urls)
+
+    def _iter_urls(self, urls):
+        """
+        Yield the given URLs, and emit an ``'iter_urls'`` event with the
+        time spent generating them when they are exhausted.
+        """
+        urls = iter(urls)
+        seconds = 0.0
+        while True:
+            start = perf_counter()
+            try:
+                url = next(urls)
+            except StopIteration:
+                seconds += perf_counter() - start
+                break
+            except Exception as exc:
+                self.emit('iter_urls', None, seconds + perf_counter() - start,
+                          error=exc.__class__)
+                raise
+            seconds += perf_counter() - start
+            yield url
+        self.emit('iter_urls', None, seconds)
+
+    def _call(self, operation, name, function, *args, **kwargs):
+        if not self.sinks:
+            return function(*args, **kwargs)
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as exc:
+            self.emit(operation, name, perf_counter() - start,
+                      error=exc.__class__)
+            raise
+        self.emit(operation, name, perf_counter() - start)
+        return result
+
+    def emit(self, operation, name, seconds, bytes=0, error=None):
+        """Pass an :class:`Event` for this storage to each sink."""
+        event = Event(
+            backend=self.backend,
+            operation=operation,
+            name=name,
+            seconds=seconds,
+            bytes=bytes,
+            error=error
+        )
+        for sink in self.sinks:
+            sink(event)
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def __repr__(self):
+        return '<InstrumentedStorage storage={storage!r}>'.format(
+            storage=self.storage
+        )
+
+
+class _InstrumentedFile(object):
+    """
+    A file object that measures the time spent in the read and write
+    methods of another file object, and reports the totals when closed.
+    """
+
+    def __init__(self, storage, file, name):
+        self._storage = storage
+        self._file = file
+        self._name = name
+        self._reads = _Counter()
+        self._writes = _Counter()
+
+    def read(self, *args):
+        return self._reads.measure(self._file.read, len, *args)
+
+    def read1(self, *args):
+        return self._reads.measure(self._file.read1, len, *args)
+
+    def readinto(self, b):
+        return self._reads.measure(self._file.readinto, _identity, b)
+
+    def readinto1(self, b):
+        return self._reads.measure(self._file.readinto1, _identity, b)
+
+    def readline(self, *args):
+        return self._reads.measure(self._file.readline, len, *args)
+
+    def readlines(self, *args):
+        return self._reads.measure(self._file.readlines, _total_length,
+                                   *args)
+
+    def write(self, data):
+        written = self._writes.measure(self._file.write, _identity, data)
+        if written is None:
+            # Not every file object reports the number of bytes written.
+            self._writes.bytes += len(data)
+        return written
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        if self._file.closed:
+            return
+        storage = self._storage
+        start = perf_counter()
+        try:
+            self._file.close()
+        except Exception as exc:
+            error = exc.__class__
+            raise
+        else:
+            error = None
+        finally:
+            seconds = perf_counter() - start
+            for operation, counter in (('read', self._reads),
+                                       ('write', self._writes)):
+                if counter.calls:
+                    storage.emit(operation, self._name, counter.seconds,
+                                 bytes=counter.bytes, error=counter.error)
+            storage.emit('close', self._name, seconds,
+                         bytes=self._writes.bytes, error=error)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    next = __next__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __repr__(self):
+        return '<_InstrumentedFile file={file!r}>'.format(file=self._file)
+
+
+class _Counter(object):
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.error = None
+
+    def measure(self, function, count, *args):
+        self.calls += 1
+        start = perf_counter()
+        try:
+            result = function(*args)
+        except Exception as exc:
+            self.error = exc.__class__
+            raise
+        finally:
+            self.seconds += perf_counter() - start
+        if result is not None:
+            self.bytes += count(result)
+        return result
+
+
+def _identity(value):
+    return value
+
+
+def _total_length(lines):
+    return sum(len(line) for line in lines)
+
+
+class LoggingSink(object):
+    """A sink that logs each :class:`Event` to a :mod:`logging` logger.
+
+    :param logger: the :class:`logging.Logger` to log to. Defaults to
+        the ``'siilo'`` logger.
+    :param level: the level of the log records. Defaults to
+        ``logging.DEBUG``. Events with errors are logged with
+        ``logging.WARNING`` if that is higher.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logging.getLogger('siilo') if logger is None else logger
+        self.level = level
+
+    def __call__(self, event):
+        level = self.level
+        if event.error is not None:
+            level = max(level, logging.WARNING)
+        if not self.logger.isEnabledFor(level):
+            return
+        if event.error is None:
+            self.logger.log(
+                level,
+                '%s %s %r: %.3f ms, %d bytes',
+                event.backend, event.operation, event.name,
+                event.seconds * 1000, event.bytes
+            )
+        else:
+            self.logger.log(
+                level,
+                '%s %s %r: %.3f ms, %d bytes, failed with %s',
+                event.backend, event.operation, event.name,
+                event.seconds * 1000, event.bytes, event.error.__name__
+            )
+
+    def __repr__(self):
+        return '<LoggingSink logger={name!r}>'.format(name=self.logger.name)
+
+
+class OperationStats(namedtuple(
+    'OperationStats',
+    ['count', 'errors', 'bytes', 'seconds', 'p50', 'p90', 'p99']
+)):
+    """Aggregated statistics of an operation, as returned by
+    :meth:`HistogramSink.summary`.
+
+    .. attribute:: count
+
+       the number of operations
+
+    .. attribute:: errors
+
+       the number of operations that raised an exception
+
+    .. attribute:: bytes
+
+       the total number of bytes read or written
+
+    .. attribute:: seconds
+
+       the total duration of the operations in seconds
+
+    .. attribute:: p50
+    .. attribute:: p90
+    .. attribute:: p99
+
+       the 50th, 90th and 99th percentiles of the duration of an
+       operation in seconds. They are estimated from a histogram, and
+       are at most twice the exact values.
+    """
+    __slots__ = ()
+
+
+class HistogramSink(object):
+    """A sink that aggregates the events in memory into a histogram of
+    durations for each backend and operation.
+
+    The durations are counted in buckets whose bounds are powers of two
+    microseconds, so the memory used doesn't grow with the number of
+    events.
+    """
+
+    #: The number of buckets. The last bucket counts all the durations
+    #: longer than about 36 minutes.
+    BUCKETS = 32
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, event):
+        microseconds = event.seconds * 1e6
+        if microseconds < 1:
+            bucket = 0
+        else:
+            bucket = min(
+                int(math.log(microseconds, 2)) + 1,
+                self.BUCKETS - 1
+            )
+        key = (event.backend, event.operation)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Histogram(self.BUCKETS)
+            stats.count += 1
+            stats.errors += event.error is not None
+            stats.bytes += event.bytes
+            stats.seconds += event.seconds
+            stats.buckets[bucket] += 1
+
+    def summary(self):
+        """Return a dictionary that maps ``(backend, operation)`` pairs
+        to :class:`OperationStats`.
+        """
+        with self._lock:
+            return dict(
+                (key, stats.summary())
+                for key, stats in self._stats.items()
+            )
+
+    def reset(self):
+        """Forget all the events aggregated so far."""
+        with self._lock:
+            self._stats.clear()
+
+    def __repr__(self):
+        return '<HistogramSink operations={count}>'.format(
+            count=len(self._stats)
+        )
+
+
+class _Histogram(object):
+    def __init__(self, size):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * size
+
+    def percentile(self, percent):
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                # The upper bound of the bucket.
+                return 2 ** bucket / 1e6
+        return 0.0
+
+    def summary(self):
+        return OperationStats(
+            count=self.count,
+            errors=self.errors,
+            bytes=self.bytes,
+            seconds=self.seconds,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99)
+        )
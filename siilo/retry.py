@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.retry
+    ~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import errno
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+
+from ._compat import http_client, perf_counter
+from .exceptions import SiiloError
+
+
+class RetryPolicy(object):
+    """Decides whether and when a failed request to a cloud storage is
+    retried.
+
+    Example::
+
+        from siilo.retry import RetryPolicy
+
+        policy = RetryPolicy(max_retries=4, backoff=0.1, max_backoff=5)
+        storage = AmazonS3Storage(..., retry_policy=policy)
+        ...
+        print(policy.retries, policy.seconds_lost)
+
+    A request that fails with a transient error, see
+    :func:`is_transient`, is retried up to ``max_retries`` times. Before
+    each retry, the policy waits for an exponentially growing delay of
+    ``backoff * 2 ** attempt`` seconds, capped at ``max_backoff``. With
+    ``jitter``, a random delay between zero and that value is used
+    instead, so that clients that failed at the same time don't retry at
+    the same time.
+
+    The retries are limited by a budget shared by all the requests made
+    with the policy: every request earns ``budget_ratio`` retries, and
+    at most ``budget_reserve`` unused retries are saved up. This allows
+    short bursts of retries, but when a storage is failing most of its
+    requests, retrying them can't multiply the load on it by more than
+    ``1 + budget_ratio``.
+
+    Storages only use the policy for requests that are idempotent and
+    whose body can be sent again.
+
+    The policy can be shared between storages and threads. The retries
+    are counted in :attr:`retries` and :attr:`seconds_lost`, and passed
+    to ``sinks`` as :class:`.Event` objects whose operation is
+    ``'retry:'`` followed by the operation retried, e.g.
+    ``'retry:download'``, whose duration is the time lost to the failed attempt
+    and the delay before the next one, and whose error is the class of
+    the exception that caused the retry.
+
+    :param max_retries: the maximum number of retries of a single
+        request. Defaults to 3.
+    :param backoff: the delay before the first retry in seconds.
+        Defaults to 0.1.
+    :param max_backoff: the maximum delay before a retry in seconds.
+        Defaults to 10.
+    :param jitter: whether to randomize the delays. Defaults to `True`.
+    :param budget_ratio: the number of retries each request adds to the
+        retry budget. Defaults to 0.2.
+    :param budget_reserve: the maximum number of retries saved up in the
+        retry budget, which is also its initial size. Defaults to 10.
+    :param is_retryable: a function that is called with an exception
+        and returns whether the request that raised it may be retried.
+        Defaults to :func:`is_transient`.
+    :param sinks: a list of callables that are called with an
+        :class:`.Event` for each retry, such as the sinks of an
+        :class:`.InstrumentedStorage`. Defaults to no sinks.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.1, max_backoff=10,
+                 jitter=True, budget_ratio=0.2, budget_reserve=10,
+                 is_retryable=None, sinks=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_reserve = budget_reserve
+        self.is_retryable = is_transient if is_retryable is None \
+            else is_retryable
+        self.sinks = [] if sinks is None else sinks
+
+        #: The number of retries made.
+        self.retries = 0
+
+        #: The number of seconds spent in failed attempts and waiting
+        #: before retries.
+        self.seconds_lost = 0.0
+
+        #: The number of requests that failed with a retryable error but
+        #: weren't retried because the retry budget was used up.
+        self.budget_exhausted = 0
+
+        self._tokens = float(budget_reserve)
+        self._lock = threading.Lock()
+
+    def call(self, operation, name, backend, function, *args, **kwargs):
+        """Call ``function`` with the given arguments, retrying it
+        according to this policy, and return its result.
+
+        :param operation: the name of the operation, e.g. ``'upload'``
+        :param name: the name of the file the operation is done on
+        :param backend: the storage the operation is done on
+        """
+        attempt = self.begin(operation, name, backend)
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as exc:
+                if not attempt.retry(exc):
+                    raise
+
+    def begin(self, operation, name, backend):
+        """Start an operation that is retried manually, and return an
+        object whose ``retry(exc)`` method is called with each exception
+        raised by an attempt. It returns `True` after waiting for the
+        delay if the operation should be attempted again, or `False` if
+        the exception should be raised.
+
+        This is used for operations like downloads that resume from
+        where the failed attempt stopped instead of starting over.
+        """
+        with self._lock:
+            self._tokens = min(
+                self._tokens + self.budget_ratio,
+                self.budget_reserve
+            )
+        return _Attempt(self, operation, name, backend)
+
+    def delay(self, attempt):
+        """Return the number of seconds to wait before the retry number
+        ``attempt``, starting from zero.
+        """
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def _withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def _record(self, operation, name, backend, seconds, error):
+        with self._lock:
+            self.retries += 1
+            self.seconds_lost += seconds
+        if self.sinks:
+            from .instrumentation import Event
+            event = Event(
+                backend=repr(backend),
+                operation='retry:' + operation,
+                name=name,
+                seconds=seconds,
+                bytes=0,
+                error=error
+            )
+            for sink in self.sinks:
+                sink(event)
+
+    def __repr__(self):
+        return (
+            '<RetryPolicy retries={retries!r}, '
+            'seconds_lost={seconds_lost:.3f}>'
+        ).format(retries=self.retries, seconds_lost=self.seconds_lost)
+
+
+class _Attempt(object):
+    def __init__(self, policy, operation, name, backend):
+        self.policy = policy
+        self.operation = operation
+        self.name = name
+        self.backend = backend
+        self.count = 0
+        self.started = perf_counter()
+
+    def retry(self, exc):
+        policy = self.policy
+        if self.count >= policy.max_retries or not policy.is_retryable(exc):
+            return False
+        if not policy._withdraw():
+            return False
+        delay = policy.delay(self.count)
+        time.sleep(delay)
+        now = perf_counter()
+        policy._record(
+            self.operation,
+            self.name,
+            self.backend,
+            now - self.started,
+            exc.__class__
+        )
+        self.count += 1
+        self.started = now
+        return True
+
+    def reset(self):
+        """Start counting the retries from zero again, e.g. after a
+        resumed download has made progress.
+        """
+        self.count = 0
+        self.started = perf_counter()
+
+
+#: The error numbers of network errors that may be caused by a temporary
+#: condition.
+_TRANSIENT_ERRNOS = frozenset(
+    getattr(errno, name) for name in (
+        'ECONNABORTED',
+        'ECONNREFUSED',
+        'ECONNRESET',
+        'EHOSTDOWN',
+        'EHOSTUNREACH',
+        'ENETDOWN',
+        'ENETRESET',
+        'ENETUNREACH',
+        'EPIPE',
+        'ETIMEDOUT',
+    )
+    if hasattr(errno, name)
+)
+
+#: Matches the status code in the messages of the errors Libcloud raises
+#: for unexpected responses, e.g. ``'Unknown error. Status code: 503'``.
+_LIBCLOUD_STATUS_PATTERN = re.compile(r'status[ _]code\W*(\d{3})\b', re.I)
+
+try:
+    _CONNECTION_ERRORS = (ConnectionError, TimeoutError)
+except NameError:
+    # Python 2 has no exception classes for connection errors.
+    _CONNECTION_ERRORS = ()
+
+
+def is_transient(exc):
+    """Return whether the given exception, raised by a request to a cloud
+    storage, may be caused by a temporary condition.
+
+    HTTP errors are transient if their status code is 408, 429 or 5xx,
+    including the Libcloud errors whose message reports the status code.
+    Network errors are transient: connection failures and resets,
+    timeouts, TLS errors other than failed certificate checks, and
+    responses cut short. Other errors, e.g. a local file that doesn't
+    exist or a malformed response, are not, and neither are Siilo's own
+    errors, such as :exc:`.FileNotFoundError`.
+    """
+    if isinstance(exc, SiiloError):
+        return False
+    status = _status(exc)
+    if status is not None and 100 <= status < 600:
+        return status >= 500 or status in (408, 429)
+    if isinstance(exc, getattr(ssl, 'CertificateError', ())):
+        return False
+    if isinstance(exc, _CONNECTION_ERRORS + (
+        socket.timeout,
+        ssl.SSLError,
+        http_client.IncompleteRead,
+    )):
+        return True
+    try:
+        from requests.exceptions import (
+            ChunkedEncodingError,
+            ConnectionError as RequestsConnectionError,
+            Timeout
+        )
+    except ImportError:
+        pass
+    else:
+        if isinstance(exc, (ChunkedEncodingError, RequestsConnectionError,
+                            Timeout)):
+            return True
+    return getattr(exc, 'errno', None) in _TRANSIENT_ERRNOS
+
+
+def _status(exc):
+    """Return the HTTP status code of the response that caused the given
+    exception, or ``None`` if it is not known.
+    """
+    status = getattr(exc, 'http_code', None) or getattr(exc, 'code', None)
+    if isinstance(status, int):
+        return status
+    try:
+        from libcloud.common.types import LibcloudError
+    except ImportError:
+        return None
+    # Libcloud reports most unexpected responses with a LibcloudError
+    # that only mentions the status code in its message.
+    if isinstance(exc, LibcloudError):
+        match = _LIBCLOUD_STATUS_PATTERN.search(
+            str(getattr(exc, 'value', exc))
+        )
+        if match is not None:
+            return int(match.group(1))
+    return None
@@ -7,10 +7,14 @@
     :license: MIT, see LICENSE for more details.
 """
 from datetime import date, datetime, timedelta
+from xml.etree import ElementTree
+import base64
 import hashlib
 import hmac
+import itertools
 
 from .._compat import force_bytes, quote, urlunparse
+from .._concurrent import map_bounded
 from ..exceptions import ArgumentError
 from .apache_libcloud import ApacheLibcloudStorage
 
@@ -103,8 +107,34 @@ class AmazonS3Storage(ApacheLibcloudStorage):
         query string authentication or not. This is useful for enabling
         direct access to a private file without proxying the request.
         Defaults to `False`.
+
+    :param connection_pool_size:
+        The maximum number of idle keep-alive connections to S3 kept in
+        the storage's :class:`.ConnectionPool`. The pool makes the
+        storage safe to share between threads. Defaults to 10.
+
+    :param connection_idle_timeout:
+        The number of seconds after which an idle connection is
+        discarded from the connection pool. Defaults to 60.
+
+    Files opened in write-only mode are uploaded to S3 using native
+    multipart uploads. The remaining keyword arguments
+    ``upload_part_size``, ``upload_concurrency`` and
+    ``upload_part_retries`` control them, see
+    :class:`.ApacheLibcloudStorage`.
     """
 
+    #: The maximum number of files deleted with a single Multi-Object
+    #: Delete request.
+    MAX_DELETE_OBJECTS = 1000
+
+    #: The size in bytes of the largest file that is copied with a
+    #: single request. Larger files are copied with a multipart copy.
+    MAX_SINGLE_COPY_SIZE = 5 * 1024 ** 3
+
+    #: The size in bytes of the parts in multipart copies.
+    COPY_PART_SIZE = 512 * 1024 ** 2
+
     LIBCLOUD_S3_PROVIDERS_BY_REGION = {
         'ap-northeast-1': 'S3_AP_NORTHEAST',
         'ap-southeast-1': 'S3_AP_SOUTHEAST',
@@ -117,7 +147,8 @@ class AmazonS3Storage(ApacheLibcloudStorage):
     def __init__(self, access_key_id, secret_access_key, bucket,
                  region='us-east-1', url_expires=timedelta(hours=1),
                  use_https=True, use_path_style=False,
-                 use_query_string_auth=False):
+                 use_query_string_auth=False, connection_pool_size=10,
+                 connection_idle_timeout=60, **kwargs):
         self._access_key_id = access_key_id
         self._secret_access_key = secret_access_key
         self._region = region
@@ -127,11 +158,24 @@ class AmazonS3Storage(ApacheLibcloudStorage):
         self.use_path_style = use_path_style
         self.use_query_string_auth = use_query_string_auth
 
+        self._driver = self._create_driver()
         container = self._driver.get_container(bucket)
-        super(AmazonS3Storage, self).__init__(container)
+        super(AmazonS3Storage, self).__init__(
+            container,
+            connection_pool_size=connection_pool_size,
+            connection_idle_timeout=connection_idle_timeout,
+            **kwargs
+        )
 
-    @property
-    def _driver(self):
+        self._signer = _SignerV4(
+            access_key_id=self._access_key_id,
+            secret_access_key=self._secret_access_key,
+            region=self._region,
+            service_name='s3'
+        )
+        self._presigner = _PresignerV4(self._signer)
+
+    def _create_driver(self):
         from libcloud.storage.providers import get_driver
         driver_cls = get_driver(self._provider)
         return driver_cls(self._access_key_id, self._secret_access_key)
@@ -153,18 +197,232 @@ class AmazonS3Storage(ApacheLibcloudStorage):
                 )
             )
 
-    def url(self, name):
-        return self._build_request(key=name).uri
+    def copy(self, src, dst):
+        """Copy the file referenced by ``src`` to ``dst``. See
+        :meth:`.Storage.copy`.
+
+        The file is copied within S3 without downloading it. Files larger
+        than 5 GiB are copied in parts of 512 MiB, ``upload_concurrency``
+        parts at a time if the storage uses a :class:`.ConnectionPool`,
+        and one at a time otherwise.
+        """
+        obj = self._get_object(src)
+        try:
+            if obj.size > self.MAX_SINGLE_COPY_SIZE:
+                self._copy_multipart(src, dst, obj.size)
+            else:
+                self._copy_request(dst, self._copy_source_headers(src))
+        finally:
+            self._invalidate_object(dst)
+
+    def move(self, src, dst):
+        """Move the file referenced by ``src`` to ``dst``. See
+        :meth:`.Storage.move`.
+
+        The file is copied within S3 with :meth:`copy`, and then
+        ``src`` is deleted.
+        """
+        self.copy(src, dst)
+        self._delete(src)
+
+    def _copy_source_headers(self, src):
+        source = u'/{bucket}/{key}'.format(bucket=self.container.name, key=src)
+        return {
+            'x-amz-copy-source': _uri_encode(
+                force_bytes(source),
+                encode_slash=False
+            )
+        }
+
+    def _copy_request(self, dst, headers, params=None):
+        from libcloud.common.types import LibcloudError
+        driver = self.container.driver
+        response = driver.connection.request(
+            driver._get_object_path(self.container, dst),
+            method='PUT',
+            headers=headers,
+            params=params
+        )
+        # S3 may report an error with 200 OK status after the copy has
+        # started, so the body has to be checked too.
+        if response.status != 200 or response.object.tag.endswith('Error'):
+            raise LibcloudError(
+                'Error copying to {dst!r}: status code {status}'.format(
+                    dst=dst,
+                    status=response.status
+                ),
+                driver=driver
+            )
+        return response
+
+    def _copy_multipart(self, src, dst, size):
+        from libcloud.utils.xml import findtext
+        driver = self.container.driver
+        upload_id = driver._initiate_multipart(
+            container=self.container,
+            object_name=dst
+        )
+
+        def copy_part(part):
+            number, start = part
+            end = min(start + self.COPY_PART_SIZE, size) - 1
+            headers = self._copy_source_headers(src)
+            headers['x-amz-copy-source-range'] = 'bytes={0}-{1}'.format(
+                start,
+                end
+            )
+            response = self._copy_request(
+                dst,
+                headers,
+                params={'uploadId': upload_id, 'partNumber': number}
+            )
+            etag = findtext(response.object, 'ETag', driver.namespace)
+            return number, etag.replace('"', '')
+
+        parts = enumerate(range(0, size, self.COPY_PART_SIZE), 1)
+        concurrency = self.upload_concurrency
+        if self.connection_pool is None:
+            concurrency = 1
+        try:
+            chunks = [
+                future.result()
+                for _, future in map_bounded(copy_part, parts, concurrency)
+            ]
+            driver._commit_multipart(
+                container=self.container,
+                object_name=dst,
+                upload_id=upload_id,
+                chunks=chunks
+            )
+        except BaseException:
+            driver._abort_multipart(
+                container=self.container,
+                object_name=dst,
+                upload_id=upload_id
+            )
+            raise
+
+    def delete_many(self, names, max_workers=8):
+        """Delete the files referenced by ``names``. See
+        :meth:`.Storage.delete_many`.
+
+        The files are deleted with S3 Multi-Object Delete requests of up
+        to 1000 files each, and ``max_workers`` requests are made
+        concurrently if the storage uses a :class:`.ConnectionPool`, and
+        one at a time otherwise.
+
+        .. note::
+
+           S3 doesn't report an error when deleting a file that does not
+           exist, so the names of such files are mapped to ``None``
+           too.
+        """
+        if self.connection_pool is None:
+            max_workers = 1
+        results = {}
+        batches = _batches(names, self.MAX_DELETE_OBJECTS)
+        for batch, future in map_bounded(
+            self._delete_objects,
+            batches,
+            max_workers
+        ):
+            exc = future.exception()
+            if exc is None:
+                results.update(future.result())
+            else:
+                results.update(dict.fromkeys(batch, exc))
+        return results
+
+    def _delete_objects(self, names):
+        from libcloud.common.types import LibcloudError
+        from libcloud.utils.xml import findall, findtext
+        driver = self.container.driver
+        data = _delete_objects_request_body(names)
+        try:
+            response = driver.connection.request(
+                driver._get_container_path(self.container),
+                method='POST',
+                params={'delete': ''},
+                data=data,
+                headers={
+                    'Content-Type': 'application/xml',
+                    'Content-MD5': base64.b64encode(
+                        hashlib.md5(data).digest()
+                    ).decode('ascii'),
+                }
+            )
+        finally:
+            for name in names:
+                self._invalidate_object(name)
+        if response.status != 200:
+            raise LibcloudError(
+                'Unexpected status code: {0}'.format(response.status),
+                driver=driver
+            )
+
+        results = dict.fromkeys(names)
+        errors = findall(response.object, 'Error', driver.namespace)
+        for error in errors:
+            name = findtext(error, 'Key', driver.namespace)
+            results[name] = LibcloudError(
+                '{code}: {message}'.format(
+                    code=findtext(error, 'Code', driver.namespace),
+                    message=findtext(error, 'Message', driver.namespace)
+                ),
+                driver=driver
+            )
+        return results
+
+    def url(self, name, expires=None):
+        """Return a URL for the file referenced by ``name``.
+
+        :param expires:
+            overrides ``url_expires`` for this URL. Has effect only if
+            ``use_query_string_auth`` is `True`.
+        """
+        return self._build_request(key=name, expires=expires).uri
+
+    def iter_urls(self, names, expires=None):
+        """Return a generator of URLs for the files referenced by
+        ``names``, in the same order.
+
+        If ``use_query_string_auth`` is `True`, all the URLs share the
+        same timestamp, expiration time and signing key, which are
+        computed only once. This makes generating a large number of
+        presigned URLs much faster than calling :meth:`url` for each
+        file.
+
+        :param expires:
+            overrides ``url_expires`` for these URLs. Has effect only if
+            ``use_query_string_auth`` is `True`.
+        """
+        requests = (self._build_unsigned_request(name) for name in names)
+        if self.use_query_string_auth:
+            requests = self._presigner.presign_all(
+                requests,
+                expires=self.url_expires if expires is None else expires
+            )
+        for request in requests:
+            yield request.uri
+
+    def urls(self, names, expires=None):
+        """Return a list of URLs for the files referenced by ``names``,
+        in the same order. See :meth:`iter_urls`.
+        """
+        return list(self.iter_urls(names, expires=expires))
 
-    def _build_request(self, key):
+    def _build_request(self, key, expires=None):
         if self.use_query_string_auth:
-            return self._build_presigned_request(key)
+            return self._build_presigned_request(key, expires)
         else:
             return self._build_unsigned_request(key)
 
-    def _build_presigned_request(self, key):
+    def _build_presigned_request(self, key, expires=None):
         request = self._build_unsigned_request(key)
-        self._presigner.presign(request, expires=self.url_expires)
+        self._presigner.presign(
+            request,
+            expires=self.url_expires if expires is None else expires
+        )
         return request
 
     def _build_unsigned_request(self, key):
@@ -177,19 +435,6 @@ class AmazonS3Storage(ApacheLibcloudStorage):
             use_path_style=self.use_path_style,
         )
 
-    @property
-    def _presigner(self):
-        return _PresignerV4(self._signer)
-
-    @property
-    def _signer(self):
-        return _SignerV4(
-            access_key_id=self._access_key_id,
-            secret_access_key=self._secret_access_key,
-            region=self._region,
-            service_name='s3'
-        )
-
     def __repr__(self):
         return '<AmazonS3Storage bucket={bucket!r}>'.format(
             bucket=self.container.name
@@ -208,6 +453,11 @@ class _S3Request(object):
         self.use_https = use_https
         self.use_path_style = use_path_style
 
+        #: The URI encoded and sorted ``(param, value)`` pairs of
+        #: :attr:`params`, if they have been precomputed. This must be
+        #: reset to ``None`` when :attr:`params` is changed.
+        self.encoded_params = None
+
     @property
     def scheme(self):
         return 'https' if self.use_https else 'http'
@@ -238,12 +488,12 @@ class _S3Request(object):
 
     @property
     def canonical_query_string(self):
+        encoded_params = self.encoded_params
+        if encoded_params is None:
+            encoded_params = _encode_params(self.params)
         return '&'.join(
-            '{param}={value}'.format(
-                param=_uri_encode(param),
-                value=_uri_encode(value)
-            )
-            for param, value in sorted(self.params.items())
+            '{param}={value}'.format(param=param, value=value)
+            for param, value in encoded_params
         )
 
     @property
@@ -279,6 +529,31 @@ def _uri_encode(string, encode_slash=True):
     return quote(string, safe)
 
 
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _delete_objects_request_body(names):
+    root = ElementTree.Element('Delete')
+    ElementTree.SubElement(root, 'Quiet').text = 'true'
+    for name in names:
+        obj = ElementTree.SubElement(root, 'Object')
+        ElementTree.SubElement(obj, 'Key').text = name
+    return ElementTree.tostring(root, encoding='utf-8')
+
+
+def _encode_params(params):
+    return sorted(
+        (_uri_encode(param), _uri_encode(value))
+        for param, value in params.items()
+    )
+
+
 def _expires_in_seconds(input_):
     if isinstance(input_, date):
         if not isinstance(input_, datetime):
@@ -296,6 +571,7 @@ class _SignerV4(object):
         self.secret_access_key = secret_access_key
         self.region = region
         self.service_name = service_name
+        self._signing_key_cache = (None, None)
 
     def get_credential(self, timestamp):
         return '/'.join([
@@ -348,17 +624,32 @@ class _SignerV4(object):
         ])
 
     def _get_signing_key(self, timestamp):
+        """
+        Return the signing key for the date of the given timestamp.
+
+        Deriving the key takes four chained HMACs, but the key only
+        changes when the date, the region or the service changes, so
+        the most recently derived key is cached.
+        """
+        scope = (timestamp[:8], self.region, self.service_name)
+        cached_scope, signing_key = self._signing_key_cache
+        if cached_scope != scope:
+            signing_key = self._derive_signing_key(*scope)
+            self._signing_key_cache = (scope, signing_key)
+        return signing_key
+
+    def _derive_signing_key(self, date, region, service_name):
         date_key = self._hmac(
             b'AWS4' + force_bytes(self.secret_access_key, 'ascii'),
-            force_bytes(timestamp[:8], 'ascii')
+            force_bytes(date, 'ascii')
         )
         date_region_key = self._hmac(
             date_key,
-            force_bytes(self.region, 'ascii')
+            force_bytes(region, 'ascii')
         )
         date_region_service_key = self._hmac(
             date_region_key,
-            force_bytes(self.service_name, 'ascii')
+            force_bytes(service_name, 'ascii')
         )
         signing_key = self._hmac(date_region_service_key, b'aws4_request')
         return signing_key
@@ -377,18 +668,44 @@ class _PresignerV4(object):
         self.signer = signer
 
     def presign(self, request, expires):
+        for _ in self.presign_all([request], expires):
+            pass
+
+    def presign_all(self, requests, expires):
+        """
+        Presign the given requests, and yield each request once it has
+        been presigned.
+
+        The timestamp, the expiration time and the credential are
+        computed once for all the requests. The query parameters are
+        also URI encoded only once for all requests with the same
+        signed headers.
+        """
         timestamp = self._get_timestamp()
-
-        request.headers['Host'] = request.host
-        request.params = {
-            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
-            'X-Amz-Date': timestamp,
-            'X-Amz-SignedHeaders': request.signed_headers,
-            'X-Amz-Expires': str(_expires_in_seconds(expires)),
-            'X-Amz-Credential': self.signer.get_credential(timestamp),
-        }
-        signature = self._get_signature(request, timestamp)
-        request.params['X-Amz-Signature'] = signature
+        expires = str(_expires_in_seconds(expires))
+        credential = self.signer.get_credential(timestamp)
+        signed_headers = encoded_params = None
+
+        for request in requests:
+            request.headers['Host'] = request.host
+            request.params = {
+                'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+                'X-Amz-Date': timestamp,
+                'X-Amz-SignedHeaders': request.signed_headers,
+                'X-Amz-Expires': expires,
+                'X-Amz-Credential': credential,
+            }
+            if request.signed_headers != signed_headers:
+                signed_headers = request.signed_headers
+                encoded_params = _encode_params(request.params)
+            request.encoded_params = encoded_params
+
+            signature = self._get_signature(request, timestamp)
+            request.params['X-Amz-Signature'] = signature
+            request.encoded_params = sorted(
+                encoded_params + [('X-Amz-Signature', signature)]
+            )
+            yield request
 
     def _get_timestamp(self):
         return datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
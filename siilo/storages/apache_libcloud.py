@@ -6,13 +6,25 @@
     :copyright: (c) 2014 by Janne Vanhala.
     :license: MIT, see LICENSE for more details.
 """
+from contextlib import contextmanager
+from datetime import datetime
+import base64
+import collections
+import copy
+import errno
+import hashlib
 import io
 import os
 import shutil
 import tempfile
+import threading
+import time
 
-from siilo.exceptions import FileNotFoundError
-from .base import Storage
+from .._cache import LRUCache
+from .._compat import queue
+from .._concurrent import map_bounded
+from siilo.exceptions import ArgumentError, FileNotFoundError
+from .base import FileInfo, Storage
 
 
 class ApacheLibcloudStorage(Storage):
@@ -46,6 +58,27 @@ class ApacheLibcloudStorage(Storage):
     file. Likewise, when you write to a file and close it,
     :class:`ApacheLibcloudStorage` will upload it the the cloud storage.
 
+    Files opened in binary read-only mode (``'rb'``) are an exception:
+    they are not downloaded to a temporary file, but streamed from the
+    cloud storage instead. The returned file is seekable, and only the
+    bytes that are actually read are fetched, using ranged downloads if
+    the storage provider supports them.
+
+    Files opened in write-only mode (``'w'`` or ``'wb'``) on a storage
+    provider that supports S3 compatible multipart uploads, such as
+    Amazon S3, are not written to a temporary file either. Instead, the
+    written data is split into parts of ``upload_part_size`` bytes that
+    are uploaded concurrently while you are still writing. A part whose
+    upload fails is retried, according to the ``retry_policy`` if given
+    and otherwise ``upload_part_retries`` times, before the whole upload
+    is aborted, without resending the parts that were already uploaded.
+
+    On other storage providers, files opened in write-only mode are
+    buffered in memory up to ``upload_spool_size`` bytes and uploaded
+    when they are closed. If more data is written, the upload is started
+    right away and the data is streamed into it as it is written, so
+    the file is never written to disk.
+
     Example::
 
         from libcloud.storage.types import Provider
@@ -68,24 +101,206 @@ class ApacheLibcloudStorage(Storage):
     :param container:
         the :class:`~libcloud.storage.base.Container` used by this
         storage for file operations
+
+    :param upload_part_size:
+        the size of the parts in bytes in multipart uploads. Defaults to
+        8 MiB. Note that Amazon S3 requires all parts except the last
+        one to be at least 5 MiB.
+
+    :param upload_concurrency:
+        the maximum number of parts of a single file uploaded
+        concurrently in multipart uploads. Defaults to 4.
+
+    :param upload_part_retries:
+        how many times the upload of a single part is retried in
+        multipart uploads before giving up, if no ``retry_policy`` is
+        given. Defaults to 2.
+
+    :param read_buffer_size:
+        the size in bytes of the read buffer of files streamed in
+        ``'rb'`` mode, which is also the largest size that
+        :meth:`~io.BufferedReader.peek` can return. Defaults to 64 KiB.
+
+    :param upload_spool_size:
+        the maximum size in bytes of a file opened in write-only mode
+        that is buffered in memory before its upload is started, on
+        storage providers that don't support multipart uploads. Defaults
+        to 1 MiB.
+
+    :param connection_pool_size:
+        if given, the connection of the container's driver is replaced
+        with a thread-safe :class:`ConnectionPool` that keeps at most
+        this many idle keep-alive connections. This allows sharing the
+        storage between threads. Defaults to ``None`` (no pooling).
+
+    :param connection_idle_timeout:
+        the number of seconds after which an idle connection in the
+        connection pool is discarded. Defaults to 60.
+
+    :param metadata_cache_size:
+        if given, the metadata of at most this many recently accessed
+        files is cached, so that e.g. calling :meth:`exists`,
+        :meth:`size` and :meth:`url` for the same file makes only one
+        request to the cloud storage. The least recently used entries
+        are evicted first. The cache entry of a file is invalidated when
+        the file is deleted or written to through this storage. Defaults
+        to ``None`` (no caching).
+
+    :param metadata_cache_ttl:
+        the number of seconds the metadata of a file is cached. Note
+        that changes made to the file outside of this storage are not
+        seen until its cache entry expires. Defaults to 5.
+
+    :param retry_policy:
+        if given, a :class:`~siilo.retry.RetryPolicy` that decides when
+        failed requests are retried. It applies to fetching the metadata
+        of files, downloads, deletes, uploads that can be sent again
+        from the start: files buffered in a temporary file or in memory,
+        and the requests of multipart uploads, including each part.
+        Downloads that fail midway are resumed from where they stopped
+        with ranged requests. A file opened in a mode that writes to a
+        temporary file keeps its temporary file if its upload fails, and
+        calling :meth:`~LibcloudFile.close` again retries the upload.
+        Defaults to ``None`` (no retries).
+
+    :param hedge_policy:
+        if given, a :class:`~siilo.hedging.HedgePolicy` for hedging the
+        downloads of files streamed in ``'rb'`` mode: if the first byte
+        of a download is slower to arrive than usual, a duplicate
+        request is sent, and the first response to arrive is used.
+        Requires ``connection_pool_size``. Defaults to ``None`` (no
+        hedging).
     """
-    def __init__(self, container):
+    def __init__(self, container, upload_part_size=8 * 1024 * 1024,
+                 upload_concurrency=4, upload_part_retries=2,
+                 connection_pool_size=None, connection_idle_timeout=60,
+                 metadata_cache_size=None, metadata_cache_ttl=5,
+                 upload_spool_size=1024 * 1024, read_buffer_size=64 * 1024,
+                 retry_policy=None, hedge_policy=None):
+        if hedge_policy is not None and connection_pool_size is None:
+            raise ArgumentError(
+                'Hedged downloads require connection_pool_size, as they '
+                'make requests from many threads.'
+            )
         self.container = container
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.read_buffer_size = read_buffer_size
+        self.upload_part_size = upload_part_size
+        self.upload_concurrency = upload_concurrency
+        self.upload_part_retries = upload_part_retries
+        self.upload_spool_size = upload_spool_size
+
+        #: The :class:`ConnectionPool` used by the container's driver, or
+        #: ``None`` if connection pooling is not enabled.
+        self.connection_pool = None
+        if connection_pool_size is not None:
+            driver = container.driver
+            self.connection_pool = ConnectionPool(
+                connection=driver.connection,
+                size=connection_pool_size,
+                idle_timeout=connection_idle_timeout
+            )
+            driver.connection = _PooledConnection(self.connection_pool)
+
+        #: The :class:`~siilo._cache.LRUCache` of file metadata, or
+        #: ``None`` if metadata caching is not enabled. Its ``hits``,
+        #: ``misses`` and ``hit_ratio`` attributes can be used to
+        #: monitor the effectiveness of the cache.
+        self.metadata_cache = None
+        if metadata_cache_size is not None:
+            self.metadata_cache = LRUCache(
+                maxsize=metadata_cache_size,
+                ttl=metadata_cache_ttl
+            )
 
     def _get_object(self, name):
         from libcloud.storage.types import ObjectDoesNotExistError
+        if self.metadata_cache is not None:
+            obj = self.metadata_cache.get(name)
+            if obj is not None:
+                return obj
         try:
-            return self.container.get_object(name)
+            obj = self._retry('head', name, self.container.get_object, name)
         except ObjectDoesNotExistError:
             raise FileNotFoundError(name)
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(name, obj)
+        return obj
 
-    def delete(self, name):
+    def _invalidate_object(self, name):
+        if self.metadata_cache is not None:
+            self.metadata_cache.discard(name)
+
+    def _retry(self, operation, name, function, *args, **kwargs):
+        """
+        Call ``function`` with the given arguments, retrying it
+        according to the retry policy of the storage, if any.
+        """
+        if self.retry_policy is None:
+            return function(*args, **kwargs)
+        return self.retry_policy.call(
+            operation, name, self, function, *args, **kwargs
+        )
+
+    def _retry_delete(self, name, delete):
+        """
+        Call ``delete`` with retries. If a retry finds that the file
+        doesn't exist, it was deleted by an attempt whose response was
+        lost, so that is not an error.
+        """
         from libcloud.storage.types import ObjectDoesNotExistError
+        attempts = []
+
+        def attempt():
+            attempts.append(None)
+            try:
+                delete()
+            except ObjectDoesNotExistError:
+                if len(attempts) == 1:
+                    raise FileNotFoundError(name)
+
+        self._retry('delete', name, attempt)
+
+    def delete(self, name):
         obj = self._get_object(name)
         try:
-            obj.delete()
-        except ObjectDoesNotExistError:
-            raise FileNotFoundError(name)
+            self._retry_delete(name, obj.delete)
+        finally:
+            self._invalidate_object(name)
+
+    def delete_many(self, names, max_workers=8):
+        """Delete the files referenced by ``names``. See
+        :meth:`.Storage.delete_many`.
+
+        Unlike :meth:`delete`, this doesn't fetch the object before
+        deleting it. The files are deleted concurrently in a pool of
+        ``max_workers`` threads, if the storage uses a
+        :class:`ConnectionPool`, and one at a time otherwise.
+        """
+        if self.connection_pool is None:
+            max_workers = 1
+        results = {}
+        for name, future in map_bounded(self._delete, names, max_workers):
+            results[name] = future.exception()
+        return results
+
+    def _delete(self, name):
+        from libcloud.storage.base import Object
+        driver = self.container.driver
+        obj = Object(
+            name=name,
+            size=None,
+            hash=None,
+            extra={},
+            meta_data={},
+            container=self.container,
+            driver=driver
+        )
+        try:
+            self._retry_delete(name, lambda: driver.delete_object(obj))
+        finally:
+            self._invalidate_object(name)
 
     def exists(self, name):
         try:
@@ -94,6 +309,12 @@ class ApacheLibcloudStorage(Storage):
             return False
         return True
 
+    def walk(self, prefix=''):
+        objects = self.container.iterate_objects(prefix=prefix or None)
+        for obj in objects:
+            if obj.name.startswith(prefix) and not obj.name.endswith('/'):
+                yield self._file_info(obj)
+
     def open(self, name, mode='r', encoding=None):
         return LibcloudFile(
             storage=self,
@@ -110,23 +331,98 @@ class ApacheLibcloudStorage(Storage):
         obj = self._get_object(name)
         return obj.get_cdn_url()
 
+    @staticmethod
+    def _file_info(obj):
+        return FileInfo(
+            name=obj.name,
+            size=obj.size,
+            modified=_parse_last_modified(obj.extra or {}),
+            etag=obj.hash
+        )
+
+    def _create_multipart_upload(self, name):
+        """
+        Return a new multipart upload for the file referenced by
+        ``name``, or ``None`` if the storage provider does not support
+        multipart uploads.
+        """
+        driver = getattr(self.container, 'driver', None)
+        if getattr(driver, 'supports_s3_multipart_upload', False) is True:
+            return _S3MultipartUpload(self.container, name, retry=self._retry)
+        return None
+
     def __repr__(self):
         return '<ApacheLibcloudStorage container={container!r}>'.format(
             container=self.container
         )
 
 
+_LAST_MODIFIED_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%fZ',
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%a, %d %b %Y %H:%M:%S GMT',
+]
+
+
+def _parse_last_modified(extra):
+    """
+    Return the last modification time from the ``extra`` dictionary of
+    a Libcloud object as a naive UTC datetime, or ``None`` if the
+    storage provider doesn't return it in a known format.
+    """
+    if 'modify_time' in extra:
+        return datetime.utcfromtimestamp(extra['modify_time'])
+    value = extra.get('last_modified')
+    for format_ in _LAST_MODIFIED_FORMATS:
+        try:
+            return datetime.strptime(value, format_)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
 class LibcloudFile(object):
     def __init__(self, storage, name, mode='r', encoding=None):
         self.storage = storage
         self._name = name
 
+        self._should_stream = set(mode) == set('rb')
+        self._should_stream_upload = set(mode) <= set('wb')
         self._should_download = 'r' in mode or 'a' in mode
         self._has_changed = 'w' in mode
+        self._upload_pending = False
+        self._writer = None
 
         self._open(mode, encoding)
 
     def _open(self, mode, encoding):
+        self._temporary_directory = None
+
+        if self._should_stream:
+            self._open_stream()
+            return
+
+        if self._should_stream_upload:
+            upload = self.storage._create_multipart_upload(self.name)
+            if upload is not None:
+                writer = _MultipartUploadWriter(
+                    upload=upload,
+                    part_size=self.storage.upload_part_size,
+                    concurrency=self.storage.upload_concurrency,
+                    part_retries=self.storage.upload_part_retries,
+                    retry_policy=self.storage.retry_policy,
+                    backend=self.storage
+                )
+            else:
+                writer = _StreamingUploadWriter(
+                    container=self.storage.container,
+                    name=self.name,
+                    spool_size=self.storage.upload_spool_size,
+                    retry=self.storage._retry
+                )
+            self._open_upload_stream(writer, mode, encoding)
+            return
+
         self._make_temporary_directory()
 
         if self._should_download:
@@ -138,39 +434,79 @@ class LibcloudFile(object):
             encoding=encoding
         )
 
+    def _open_stream(self):
+        obj = self.storage._get_object(self.name)
+        self._stream = io.BufferedReader(
+            _LibcloudObjectReader(obj, self.storage),
+            buffer_size=self.storage.read_buffer_size
+        )
+
+    def _open_upload_stream(self, writer, mode, encoding):
+        self._writer = writer
+        self._stream = io.BufferedWriter(writer)
+        if 'b' not in mode:
+            self._stream = io.TextIOWrapper(self._stream, encoding=encoding)
+            self._stream.mode = mode
+
     def close(self):
         if not self.closed:
-            self._stream.close()
-            if self._has_changed:
-                self._upload()
+            try:
+                self._stream.close()
+                if self._has_changed and self._temporary_directory:
+                    # If the upload fails, the temporary file is kept so
+                    # that the upload can be retried by closing again.
+                    self._upload_pending = True
+                    self._upload()
+                    self._upload_pending = False
+            finally:
+                if self._has_changed:
+                    self.storage._invalidate_object(self.name)
             self._remove_temporary_directory()
 
+    def discard(self):
+        """Close the file without writing the changes made to it to the
+        storage. A streamed upload is aborted."""
+        if self.closed:
+            return
+        self._has_changed = False
+        self._upload_pending = False
+        if self._writer is not None:
+            self._writer.discard()
+        self.close()
+
+    @property
+    def closed(self):
+        if self._upload_pending:
+            return False
+        return self._stream.closed
+
     @property
     def name(self):
         return self._name
 
-    def read(self):
-        return self._stream.read()
-
     def write(self, data):
         self._has_changed = True
-        self._stream.write(data)
+        return self._stream.write(data)
 
     def writelines(self, lines):
         self._has_changed = True
         self._stream.writelines(lines)
 
-    closed = property(lambda self: self._stream.closed)
     encoding = property(lambda self: self._stream.encoding)
     fileno = property(lambda self: self._stream.fileno)
     flush = property(lambda self: self._stream.flush)
     isatty = property(lambda self: self._stream.isatty)
     mode = property(lambda self: self._stream.mode)
+    peek = property(lambda self: self._stream.peek)
+    read = property(lambda self: self._stream.read)
+    read1 = property(lambda self: self._stream.read1)
     readable = property(lambda self: self._stream.readable)
     readall = property(lambda self: self._stream.readall)
     readinto = property(lambda self: self._stream.readinto)
+    readinto1 = property(lambda self: self._stream.readinto1)
     readline = property(lambda self: self._stream.readline)
     readlines = property(lambda self: self._stream.readlines)
+    seek = property(lambda self: self._stream.seek)
     seekable = property(lambda self: self._stream.seekable)
     tell = property(lambda self: self._stream.tell)
     writable = property(lambda self: self._stream.writable)
@@ -202,7 +538,8 @@ class LibcloudFile(object):
         self._temporary_directory = tempfile.mkdtemp()
 
     def _remove_temporary_directory(self):
-        shutil.rmtree(self._temporary_directory)
+        if self._temporary_directory is not None:
+            shutil.rmtree(self._temporary_directory)
 
     @property
     def _temporary_filename(self):
@@ -223,12 +560,755 @@ class LibcloudFile(object):
     def _download(self):
         with io.open(self._temporary_filename, mode='wb') as f:
             obj = self.storage._get_object(self.name)
-            for data in obj.as_stream():
-                f.write(data)
+            if self.storage.retry_policy is None:
+                for data in obj.as_stream():
+                    f.write(data)
+            else:
+                # Resume the download instead of starting over if it
+                # fails.
+                reader = _LibcloudObjectReader(obj, self.storage)
+                shutil.copyfileobj(reader, f, self.storage.read_buffer_size)
 
     def _upload(self):
+        self.storage._retry('upload', self.name, self._upload_once)
+
+    def _upload_once(self):
         with io.open(self._temporary_filename, mode='rb') as f:
             self.storage.container.upload_object_via_stream(
                 iterator=f,
                 object_name=self.name
             )
+
+
+class _LibcloudObjectReader(io.RawIOBase):
+    """
+    A read-only, seekable raw stream over a Libcloud object.
+
+    The data is fetched lazily from a download stream that starts at the
+    current position, so that reading a small part of a large object
+    only transfers the bytes that are actually read. Seeking discards
+    the current download stream, and the next read starts a new one at
+    the new position.
+
+    If the storage has a retry policy, a download stream that fails, or
+    ends before the end of an object of known size, is replaced with a
+    new one starting at the current position. If the storage has a
+    hedge policy, the download streams of objects up to its
+    ``max_size`` are started with it.
+
+    :param obj: the :class:`~libcloud.storage.base.Object` to read
+    :param storage: the :class:`ApacheLibcloudStorage` the object is
+        read from, or ``None``
+    """
+    mode = 'rb'
+
+    def __init__(self, obj, storage=None):
+        self._obj = obj
+        self._retry_policy = getattr(storage, 'retry_policy', None)
+        self._hedge_policy = getattr(storage, 'hedge_policy', None)
+        self._storage = storage
+        self._attempt = None
+        self._position = 0
+        self._chunks = None
+        self._buffer = memoryview(b'')
+
+    @property
+    def name(self):
+        return self._obj.name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._check_not_closed()
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._check_not_closed()
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            if self._obj.size is None:
+                raise io.UnsupportedOperation(
+                    'cannot seek from the end of an object of unknown size'
+                )
+            position = self._obj.size + offset
+        else:
+            raise ValueError('invalid whence ({0!r})'.format(whence))
+        if position < 0:
+            raise ValueError('negative seek position {0!r}'.format(position))
+
+        skipped = position - self._position
+        if 0 <= skipped <= len(self._buffer):
+            self._buffer = self._buffer[skipped:]
+        else:
+            self._discard_chunks()
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        self._check_not_closed()
+        if not self._buffer and not self._fill_buffer():
+            return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self._position += size
+        return size
+
+    def close(self):
+        self._discard_chunks()
+        super(_LibcloudObjectReader, self).close()
+
+    def _check_not_closed(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+
+    def _fill_buffer(self):
+        size = self._obj.size
+        if size is not None and self._position >= size:
+            return False
+        if self._retry_policy is not None:
+            return self._fill_buffer_with_retries(size)
+        if self._chunks is None:
+            self._chunks = self._start_download(self._position)
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = memoryview(chunk)
+                return True
+        return False
+
+    def _fill_buffer_with_retries(self, size):
+        if self._attempt is None:
+            self._attempt = self._retry_policy.begin(
+                'download',
+                self.name,
+                self._storage
+            )
+        while True:
+            try:
+                if self._chunks is None:
+                    self._chunks = self._start_download(self._position)
+                for chunk in self._chunks:
+                    if chunk:
+                        self._buffer = memoryview(chunk)
+                        self._attempt.reset()
+                        return True
+                if size is None:
+                    return False
+                # The connection was closed before the whole object was
+                # received.
+                raise IOError(
+                    errno.ECONNRESET,
+                    'Download of {name!r} ended at byte {position} of '
+                    '{size}'.format(
+                        name=self.name,
+                        position=self._position,
+                        size=size
+                    )
+                )
+            except Exception as exc:
+                self._close_chunks()
+                if not self._attempt.retry(exc):
+                    raise
+
+    def _discard_chunks(self):
+        self._close_chunks()
+        self._buffer = memoryview(b'')
+
+    def _close_chunks(self):
+        # Closing the download stream releases its HTTP response right
+        # away instead of when the stream is garbage collected.
+        chunks, self._chunks = self._chunks, None
+        _close(chunks)
+
+    def _start_download(self, offset):
+        policy = self._hedge_policy
+        size = self._obj.size
+        if policy is None or size is None or size > policy.max_size:
+            return self._open_chunks(offset)
+        return policy.call(self._prefetch_chunks, offset)
+
+    def _prefetch_chunks(self, offset):
+        """
+        Start a download stream at ``offset`` and wait for its first
+        chunk.
+        """
+        chunks = self._open_chunks(offset)
+        for chunk in chunks:
+            if chunk:
+                return _PrefetchedChunks(chunk, chunks)
+        return _PrefetchedChunks(b'', chunks)
+
+    def _open_chunks(self, offset):
+        if offset == 0:
+            return _iter_stream(self._obj.as_stream())
+        driver = self._obj.driver
+        try:
+            return _iter_stream(driver.download_object_range_as_stream(
+                self._obj,
+                start_bytes=offset
+            ))
+        except (AttributeError, NotImplementedError):
+            # The driver does not support ranged downloads, so download
+            # the object from the start and skip to the offset instead.
+            return _skip_bytes(_iter_stream(self._obj.as_stream()), offset)
+
+
+class _PrefetchedChunks(object):
+    """
+    An iterator over the chunks of a download stream whose first chunk
+    has already been read.
+    """
+
+    def __init__(self, first, chunks):
+        self._first = first
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        return next(self._chunks)
+
+    next = __next__
+
+    def close(self):
+        _close(self._chunks)
+
+
+def _call(operation, name, function, *args, **kwargs):
+    return function(*args, **kwargs)
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def _iter_stream(stream):
+    try:
+        for chunk in stream:
+            yield chunk
+    finally:
+        _close(stream)
+
+
+def _skip_bytes(chunks, count):
+    try:
+        for chunk in chunks:
+            if count:
+                if len(chunk) <= count:
+                    count -= len(chunk)
+                    continue
+                chunk = chunk[count:]
+                count = 0
+            yield chunk
+    finally:
+        _close(chunks)
+
+
+class _MultipartUploadWriter(io.RawIOBase):
+    """
+    A write-only raw stream that uploads the written data in parts.
+
+    The data is buffered until a full part has been written, and the
+    part is then uploaded in a background thread while the caller keeps
+    writing. At most ``concurrency`` parts are uploaded at the same
+    time; writing blocks when that many parts are already in flight.
+    If the stream is closed before a full part has been written, the
+    data is uploaded as a single object instead.
+
+    :param upload: the multipart upload, see :class:`_S3MultipartUpload`
+    :param part_size: the size of the parts in bytes
+    :param concurrency: the maximum number of parts uploaded at once
+    :param part_retries: how many times a failed part upload is retried
+        if no ``retry_policy`` is given
+    :param retry_policy: if given, a :class:`~siilo.retry.RetryPolicy`
+        that decides when a failed part upload is retried
+    :param backend: the storage the upload is reported to the
+        ``retry_policy`` as being done on
+    """
+    mode = 'wb'
+
+    def __init__(self, upload, part_size, concurrency, part_retries,
+                 retry_policy=None, backend=None):
+        self._upload = upload
+        self._part_size = part_size
+        self._concurrency = concurrency
+        self._part_retries = part_retries
+        self._retry_policy = retry_policy
+        self._backend = backend
+        self._buffer = bytearray()
+        self._parts = []
+        self._executor = None
+        self._discarded = False
+
+    @property
+    def name(self):
+        return self._upload.name
+
+    def writable(self):
+        return True
+
+    def discard(self):
+        """Make closing the stream abort the upload instead of
+        completing it."""
+        self._discarded = True
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        if self._discarded:
+            return len(b)
+        self._buffer += b
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._submit_part(part)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._discarded:
+                self._abort()
+            else:
+                self._finish()
+        finally:
+            super(_MultipartUploadWriter, self).close()
+
+    def _abort(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._upload.abort()
+
+    def _finish(self):
+        if self._executor is None:
+            self._upload.put(bytes(self._buffer))
+            return
+        try:
+            if self._buffer:
+                self._submit_part(bytes(self._buffer))
+            self._upload.complete([part.result() for part in self._parts])
+        except BaseException:
+            self._executor.shutdown(wait=True)
+            self._upload.abort()
+            raise
+        self._executor.shutdown(wait=True)
+
+    def _submit_part(self, data):
+        from concurrent.futures import (
+            FIRST_COMPLETED,
+            ThreadPoolExecutor,
+            wait
+        )
+        if self._executor is None:
+            self._upload.begin()
+            self._executor = ThreadPoolExecutor(self._concurrency)
+
+        in_flight = [part for part in self._parts if not part.done()]
+        if len(in_flight) >= self._concurrency:
+            wait(in_flight, return_when=FIRST_COMPLETED)
+        for part in self._parts:
+            if part.done() and part.exception() is not None:
+                raise part.exception()
+
+        number = len(self._parts) + 1
+        self._parts.append(
+            self._executor.submit(self._upload_part, number, data)
+        )
+
+    def _upload_part(self, number, data):
+        if self._retry_policy is not None:
+            attempt = self._retry_policy.begin(
+                'upload',
+                self.name,
+                self._backend
+            )
+        retries = 0
+        while True:
+            try:
+                etag = self._upload.upload_part(number, data)
+            except Exception as exc:
+                if self._retry_policy is not None:
+                    if not attempt.retry(exc):
+                        raise
+                elif retries >= self._part_retries:
+                    raise
+                retries += 1
+            else:
+                return number, etag
+
+
+#: Passed to the upload thread of a :class:`_StreamingUploadWriter` to
+#: make the upload fail.
+_ABORT = object()
+
+
+class _StreamingUploadWriter(io.RawIOBase):
+    """
+    A write-only raw stream that uploads the written data to a Libcloud
+    container with ``upload_object_via_stream()``.
+
+    The data is buffered in memory until it exceeds ``spool_size``
+    bytes. Small files are uploaded from the buffer when the stream is
+    closed. For larger files, the upload is started in a background
+    thread as soon as the buffer is full, and the data written after
+    that is passed to the upload through a bounded queue.
+    """
+
+    _QUEUE_SIZE = 8
+
+    def __init__(self, container, name, spool_size, retry=None):
+        self.container = container
+        self._name = name
+        self.spool_size = spool_size
+        self._retry = _call if retry is None else retry
+        self._buffer = bytearray()
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self._discarded = False
+        self._received_end = False
+
+    @property
+    def name(self):
+        return self._name
+
+    def writable(self):
+        return True
+
+    def discard(self):
+        """Make closing the stream abort the upload instead of
+        finishing it."""
+        self._discarded = True
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        if self._discarded:
+            return len(b)
+        if self._thread is None:
+            self._buffer += b
+            if len(self._buffer) > self.spool_size:
+                self._start_upload()
+        else:
+            self._put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._discarded:
+                self._abort()
+            elif self._thread is None:
+                data = bytes(self._buffer)
+                self._retry(
+                    'upload',
+                    self._name,
+                    lambda: self._upload(iter([data]))
+                )
+            else:
+                self._queue.put(None)
+                self._thread.join()
+                if self._error is not None:
+                    raise self._error
+        finally:
+            self._buffer = None
+            super(_StreamingUploadWriter, self).close()
+
+    def _abort(self):
+        if self._thread is not None:
+            # The upload fails when it reaches the marker, and the
+            # upload thread then drains the queue up to the end.
+            self._queue.put(_ABORT)
+            self._queue.put(None)
+            self._thread.join()
+
+    def _start_upload(self):
+        self._queue = queue.Queue(self._QUEUE_SIZE)
+        self._queue.put(bytes(self._buffer))
+        self._buffer = bytearray()
+        self._thread = threading.Thread(
+            target=self._run_upload,
+            name='siilo-upload'
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_upload(self):
+        try:
+            self._upload(self._iter_queue())
+        except BaseException as exc:
+            self._error = exc
+            # Drain the queue so that the writer isn't blocked forever,
+            # unless the upload already received the end of the data.
+            if not self._received_end:
+                while self._queue.get() is not None:
+                    pass
+
+    def _iter_queue(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                self._received_end = True
+                return
+            if data is _ABORT:
+                raise IOError('The upload was aborted.')
+            yield data
+
+    def _put(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def _upload(self, iterator):
+        self.container.upload_object_via_stream(
+            iterator=iterator,
+            object_name=self._name
+        )
+
+
+class _S3MultipartUpload(object):
+    """
+    A multipart upload to an S3 compatible Libcloud storage driver.
+
+    The upload is initiated, completed and aborted through the driver
+    on the calling thread, and initiating and completing it are retried
+    with ``retry``. The parts can be uploaded concurrently from multiple
+    threads, each using its own copy of the driver's connection, as
+    Libcloud connections are not thread-safe.
+
+    :param container: the :class:`~libcloud.storage.base.Container` to
+        upload the object to
+    :param name: the name of the object
+    :param retry: if given, called as ``retry(operation, name, function)``
+        to call ``function`` with retries
+    """
+    def __init__(self, container, name, retry=None):
+        self.container = container
+        self.name = name
+        self.upload_id = None
+        self._retry = _call if retry is None else retry
+        self._local = threading.local()
+
+    @property
+    def driver(self):
+        return self.container.driver
+
+    def put(self, data):
+        self._retry('upload', self.name, lambda: (
+            self.container.upload_object_via_stream(
+                iterator=iter([data]),
+                object_name=self.name
+            )
+        ))
+
+    def begin(self):
+        self.upload_id = self._retry(
+            'upload',
+            self.name,
+            self.driver._initiate_multipart,
+            container=self.container,
+            object_name=self.name
+        )
+
+    def upload_part(self, number, data):
+        from libcloud.common.exceptions import BaseHTTPError
+        response = self._connection.request(
+            self.driver._get_object_path(self.container, self.name),
+            method='PUT',
+            data=data,
+            headers={
+                'Content-Length': len(data),
+                'Content-MD5': base64.b64encode(
+                    hashlib.md5(data).digest()
+                ).decode('ascii'),
+            },
+            params={'uploadId': self.upload_id, 'partNumber': number}
+        )
+        if response.status != 200:
+            raise BaseHTTPError(
+                response.status,
+                'Error uploading part {0} of {1!r}: status code {2}'.format(
+                    number,
+                    self.name,
+                    response.status
+                )
+            )
+        return response.headers['etag'].replace('"', '')
+
+    def complete(self, parts):
+        self._retry(
+            'upload',
+            self.name,
+            self.driver._commit_multipart,
+            container=self.container,
+            object_name=self.name,
+            upload_id=self.upload_id,
+            chunks=parts
+        )
+
+    def abort(self):
+        self.driver._abort_multipart(
+            container=self.container,
+            object_name=self.name,
+            upload_id=self.upload_id
+        )
+
+    @property
+    def _connection(self):
+        if getattr(self.driver.connection, 'thread_safe', False) is True:
+            return self.driver.connection
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = copy.copy(self.driver.connection)
+            connection.connect()
+            self._local.connection = connection
+        return connection
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of Libcloud connections.
+
+    The connections in the pool are copies of the given connection, and
+    each of them is used by only one thread at a time. The underlying
+    HTTP connections are kept alive between requests, so that a request
+    made with a connection from the pool usually doesn't have to pay for
+    a new TCP connection and TLS handshake.
+
+    :param connection:
+        the Libcloud :class:`~libcloud.common.base.Connection` to copy
+        the connections in the pool from
+
+    :param size:
+        the maximum number of idle connections kept in the pool. If more
+        threads make requests at the same time, new connections are
+        created for them, but they are discarded after use.
+
+    :param idle_timeout:
+        the number of seconds after which an idle connection is
+        discarded
+    """
+    def __init__(self, connection, size, idle_timeout):
+        self.connection = connection
+        self.size = size
+        self.idle_timeout = idle_timeout
+
+        #: The number of times an idle connection was reused.
+        self.hits = 0
+
+        #: The number of times a new connection had to be created.
+        self.misses = 0
+
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    @property
+    def idle(self):
+        """The number of idle connections in the pool."""
+        return len(self._idle)
+
+    @contextmanager
+    def acquire(self):
+        """
+        A context manager that takes a connection from the pool, or
+        creates a new one if there are no idle connections, and returns
+        it to the pool afterwards.
+        """
+        connection = self._take()
+        try:
+            yield connection
+        finally:
+            self._put(connection)
+
+    def clear(self):
+        """Close and discard all idle connections."""
+        with self._lock:
+            connections = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in connections:
+            self._close(connection)
+
+    def _take(self):
+        stale = []
+        with self._lock:
+            now = time.time()
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                stale.append(self._idle.popleft()[0])
+            if self._idle:
+                connection = self._idle.pop()[0]
+                self.hits += 1
+            else:
+                connection = None
+                self.misses += 1
+        for stale_connection in stale:
+            self._close(stale_connection)
+        if connection is None:
+            connection = copy.copy(self.connection)
+            connection.connect()
+        return connection
+
+    def _put(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+                return
+        self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        session = getattr(connection.connection, 'session', None)
+        if session is not None:
+            session.close()
+
+    def __repr__(self):
+        return (
+            '<ConnectionPool size={size!r}, idle={idle!r}, '
+            'hits={hits!r}, misses={misses!r}>'
+        ).format(
+            size=self.size,
+            idle=self.idle,
+            hits=self.hits,
+            misses=self.misses
+        )
+
+
+class _PooledConnection(object):
+    """
+    A thread-safe stand-in for the connection of a Libcloud driver.
+
+    Each request is made with a connection taken from the given
+    :class:`ConnectionPool`. Everything else is delegated to the
+    connection the pool was created from.
+    """
+    thread_safe = True
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def request(self, *args, **kwargs):
+        with self._pool.acquire() as connection:
+            response = connection.request(*args, **kwargs)
+            if kwargs.get('raw'):
+                # Raw responses fetch the underlying HTTP response from
+                # the connection lazily, so it must be done before the
+                # connection is reused by another thread.
+                response.response
+            return response
+
+    def __getattr__(self, name):
+        return getattr(self._pool.connection, name)
@@ -6,11 +6,55 @@
     :copyright: (c) 2014 by Janne Vanhala.
     :license: MIT, see LICENSE for more details.
 """
+from collections import namedtuple
+import shutil
+
+
+class FileInfo(namedtuple('FileInfo', ['name', 'size', 'modified', 'etag'])):
+    """Information about a file in a storage, as returned by
+    :meth:`Storage.iterdir` and :meth:`Storage.walk`.
+
+    .. attribute:: name
+
+       the name of the file within the storage
+
+    .. attribute:: size
+
+       the size of the file in bytes, or ``None`` if not known
+
+    .. attribute:: modified
+
+       the last modification time of the file as a naive UTC
+       :class:`~datetime.datetime`, or ``None`` if not known
+
+    .. attribute:: etag
+
+       an opaque identifier of the file contents, such as the ETag of an
+       object in a cloud storage, or ``None`` if not known
+    """
+    __slots__ = ()
 
 
 class Storage(object):
     """An abstract interface for concrete storage drivers."""
 
+    def copy(self, src, dst):
+        """Copy the file referenced by ``src`` to ``dst``, replacing
+        ``dst`` if it already exists.
+
+        If the file ``src`` does not exist, raises
+        :exc:`.FileNotFoundError`.
+
+        By default, this reads ``src`` and writes it to ``dst`` in
+        chunks, but storage system implementations can copy files
+        without transferring their contents through the application,
+        e.g. with server-side copy.
+
+        """
+        with self.open(src, 'rb') as source:
+            with self.open(dst, 'wb') as destination:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+
     def delete(self, name):
         """Delete the file referenced by ``name``.
 
@@ -22,6 +66,29 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def delete_many(self, names):
+        """Delete the files referenced by ``names``.
+
+        Return a dictionary that maps each name either to ``None``, if
+        the file was deleted, or to the exception raised when deleting
+        it, such as :exc:`.FileNotFoundError`.
+
+        By default, this calls :meth:`delete` for each name, but storage
+        system implementations can delete the files more efficiently.
+
+        """
+        results = {}
+        for name in names:
+            try:
+                self.delete(name)
+            except NotImplementedError:
+                raise
+            except Exception as exc:
+                results[name] = exc
+            else:
+                results[name] = None
+        return results
+
     def exists(self, name):
         """Return ``True`` if the file referenced by ``name`` exists in
         the storage system, or ``False`` if the name is available for a
@@ -30,6 +97,53 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def iterdir(self, prefix=''):
+        """Return a generator of :class:`FileInfo` objects for the files
+        whose name starts with ``prefix`` and that are directly within
+        the directory of the prefix.
+
+        For example, ``iterdir('images/')`` yields ``images/a.jpg`` but
+        not ``images/thumbnails/a.jpg``, and ``iterdir('images/a')``
+        yields only the files in ``images`` starting with ``a``. The
+        files are yielded in lexicographical order of their names.
+
+        By default, this filters the results of :meth:`walk`.
+
+        """
+        start = len(prefix)
+        for info in self.walk(prefix):
+            if '/' not in info.name[start:]:
+                yield info
+
+    def walk(self, prefix=''):
+        """Return a generator of :class:`FileInfo` objects for all the
+        files whose name starts with ``prefix``, including the files in
+        subdirectories.
+
+        The files are yielded lazily in lexicographical order of their
+        names, so that listing a large number of files doesn't require
+        keeping them all in memory.
+
+        If the storage system does not support listing files, raises
+        :exc:`~exceptions.NotImplementedError`.
+
+        """
+        raise NotImplementedError
+
+    def move(self, src, dst):
+        """Move the file referenced by ``src`` to ``dst``, replacing
+        ``dst`` if it already exists.
+
+        If the file ``src`` does not exist, raises
+        :exc:`.FileNotFoundError`.
+
+        By default, this copies the file with :meth:`copy` and then
+        deletes ``src``.
+
+        """
+        self.copy(src, dst)
+        self.delete(src)
+
     def open(self, name, mode='r', encoding=None):
         """Open the file referenced by ``name`` and return a
         corresponding stream.
@@ -70,3 +184,25 @@ class Storage(object):
 
         """
         raise NotImplementedError
+
+    def urls(self, names):
+        """Return a list of public URLs for the files referenced by
+        ``names``, in the same order.
+
+        This is equivalent to calling :meth:`url` for each name, but
+        storage system implementations can generate the URLs more
+        efficiently. See also :meth:`iter_urls`.
+
+        """
+        return list(self.iter_urls(names))
+
+    def iter_urls(self, names):
+        """Return a generator of public URLs for the files referenced by
+        ``names``, in the same order.
+
+        Unlike :meth:`urls`, this generates the URLs lazily, which is
+        useful for very large lists of names.
+
+        """
+        for name in names:
+            yield self.url(name)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.storages.caching
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import collections
+import errno
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from .._compat import force_bytes, replace, scandir
+from ..exceptions import FileNotFoundError
+from .base import Storage
+
+
+class CachingStorage(Storage):
+    """A storage that keeps a local on-disk cache of the files read from
+    an :class:`.ApacheLibcloudStorage`, such as an
+    :class:`.AmazonS3Storage`.
+
+    Example::
+
+        from siilo.storages.caching import CachingStorage
+
+        storage = CachingStorage(
+            AmazonS3Storage(...),
+            cache_directory='/var/cache/assets',
+            max_size=10 * 1024 ** 3
+        )
+
+        with storage.open('logo.png', 'rb') as f:
+            data = f.read()
+
+    When a file is opened for reading, it is downloaded into the cache
+    directory, unless it is already cached, and the cached copy is
+    opened. A cached copy is revalidated before it is used by comparing
+    its ETag with the ETag of the object in the cloud storage, which
+    only fetches the object's metadata. The copy is downloaded again if
+    the object has changed. If the storage provider doesn't return an
+    ETag, the size and the last modification time of the object are
+    compared instead. Objects that have neither are not cached, as
+    their cached copies couldn't be revalidated.
+
+    The cache is limited to ``max_size`` bytes, and the least recently
+    used files are evicted to make room for new ones. Files larger than
+    ``max_size`` are not cached but read from the cloud storage
+    directly. The cache directory is scanned when the storage is
+    created, so that the files cached by earlier processes are reused.
+
+    All the other methods are delegated to the wrapped storage, and
+    writing or deleting a file removes its cached copy.
+
+    :param storage: the :class:`.ApacheLibcloudStorage` to cache
+    :param cache_directory: the directory for the cached files. It
+        should be used by this storage only. Defaults to a new temporary
+        directory.
+    :param max_size: the maximum total size of the cached files in
+        bytes. Defaults to 1 GiB.
+    :param max_age: the number of seconds a cached file is used after it
+        has been revalidated without revalidating it again. Defaults to
+        0, which means that every read revalidates the file.
+    """
+
+    def __init__(self, storage, cache_directory=None, max_size=1024 ** 3,
+                 max_age=0):
+        self.storage = storage
+        if cache_directory is None:
+            cache_directory = tempfile.mkdtemp(prefix='siilo-cache-')
+        self.cache_directory = cache_directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+        #: The number of reads served from the cache.
+        self.hits = 0
+
+        #: The number of reads that downloaded the file.
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._load_entries()
+
+    @property
+    def size_in_cache(self):
+        """The total size of the cached files in bytes."""
+        return self._size
+
+    def clear_cache(self):
+        """Remove all the cached files."""
+        with self._lock:
+            while self._entries:
+                self._evict(next(iter(self._entries)))
+
+    def copy(self, src, dst):
+        self._discard(dst)
+        self.storage.copy(src, dst)
+
+    def delete(self, name):
+        self._discard(name)
+        self.storage.delete(name)
+
+    def delete_many(self, names):
+        names = list(names)
+        for name in names:
+            self._discard(name)
+        return self.storage.delete_many(names)
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def iterdir(self, prefix=''):
+        return self.storage.iterdir(prefix)
+
+    def walk(self, prefix=''):
+        return self.storage.walk(prefix)
+
+    def move(self, src, dst):
+        self._discard(src)
+        self._discard(dst)
+        self.storage.move(src, dst)
+
+    def open(self, name, mode='r', encoding=None):
+        if set(mode) - set('rbt'):
+            self._discard(name)
+            return self.storage.open(name, mode=mode, encoding=encoding)
+        path = self._cached_path(name)
+        if path is not None:
+            try:
+                return io.open(path, mode=mode, encoding=encoding)
+            except (IOError, OSError) as exc:
+                # The file may have been evicted by another thread.
+                if exc.errno != errno.ENOENT:
+                    raise
+        return self.storage.open(name, mode=mode, encoding=encoding)
+
+    def size(self, name):
+        return self.storage.size(name)
+
+    def url(self, name):
+        return self.storage.url(name)
+
+    def iter_urls(self, names):
+        return self.storage.iter_urls(names)
+
+    def _cached_path(self, name):
+        """
+        Return the path of an up-to-date cached copy of the given file,
+        downloading the file if needed, or ``None`` if the file is too
+        large to be cached.
+        """
+        key = self._key(name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return entry.path
+
+        try:
+            obj = self.storage._get_object(name)
+        except FileNotFoundError:
+            self._discard(name)
+            raise
+        etag = _version(obj)
+        if etag is None:
+            self._discard(name)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.etag_key == self._key(etag):
+                self._entries[key] = self._entries.pop(key)._replace(
+                    validated_at=time.time()
+                )
+                self.hits += 1
+                return entry.path
+            self.misses += 1
+        if obj.size is not None and obj.size > self.max_size:
+            return None
+        return self._download(key, etag, obj)
+
+    def _is_fresh(self, entry):
+        return time.time() - entry.validated_at < self.max_age
+
+    def _download(self, key, etag, obj):
+        fd, temporary_path = tempfile.mkstemp(
+            dir=self.cache_directory,
+            prefix='.download-'
+        )
+        try:
+            with io.open(fd, 'wb') as f:
+                for chunk in obj.as_stream():
+                    f.write(chunk)
+                size = f.tell()
+            if size > self.max_size:
+                os.remove(temporary_path)
+                return None
+            path = os.path.join(
+                self.cache_directory,
+                '{key}-{etag_key}'.format(key=key, etag_key=self._key(etag))
+            )
+            with self._lock:
+                replace(temporary_path, path)
+                self._add(_CacheEntry(
+                    key=key,
+                    etag_key=self._key(etag),
+                    path=path,
+                    size=size,
+                    validated_at=time.time()
+                ))
+            return path
+        except BaseException:
+            _remove(temporary_path)
+            raise
+
+    def _add(self, entry):
+        old_entry = self._entries.pop(entry.key, None)
+        if old_entry is not None:
+            self._size -= old_entry.size
+            if old_entry.path != entry.path:
+                _remove(old_entry.path)
+        self._entries[entry.key] = entry
+        self._size += entry.size
+        while self._size > self.max_size:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        _remove(entry.path)
+
+    def _discard(self, name):
+        key = self._key(name)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def _load_entries(self):
+        try:
+            os.makedirs(self.cache_directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        entries = []
+        for dir_entry in scandir(self.cache_directory):
+            if dir_entry.name.startswith('.download-'):
+                _remove(dir_entry.path)
+                continue
+            key, _, etag_key = dir_entry.name.partition('-')
+            if not etag_key or not dir_entry.is_file():
+                continue
+            stat = dir_entry.stat()
+            entries.append((stat.st_atime, _CacheEntry(
+                key=key,
+                etag_key=etag_key,
+                path=dir_entry.path,
+                size=stat.st_size,
+                validated_at=0
+            )))
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            self._add(entry)
+
+    @staticmethod
+    def _key(value):
+        return hashlib.sha1(force_bytes(value)).hexdigest()
+
+    def __repr__(self):
+        return (
+            '<CachingStorage storage={storage!r}, '
+            'cache_directory={cache_directory!r}>'
+        ).format(
+            storage=self.storage,
+            cache_directory=self.cache_directory
+        )
+
+
+_CacheEntry = collections.namedtuple(
+    '_CacheEntry',
+    ['key', 'etag_key', 'path', 'size', 'validated_at']
+)
+
+
+def _version(obj):
+    """
+    Return a string that changes whenever the given Libcloud object
+    changes: its ETag, or its size and last modification time if it has
+    no ETag. Return ``None`` if the object has neither.
+    """
+    if obj.hash:
+        return obj.hash
+    extra = obj.extra or {}
+    modified = extra.get('last_modified') or extra.get('modify_time')
+    if obj.size is None or modified is None:
+        return None
+    return 'size={size};modified={modified}'.format(
+        size=obj.size,
+        modified=modified
+    )
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
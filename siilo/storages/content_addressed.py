@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.storages.content_addressed
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import collections
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+import threading
+
+from .._compat import force_text
+from ..exceptions import ArgumentError, FileNotFoundError
+from .base import FileInfo, Storage
+
+
+class ContentAddressedStorage(Storage):
+    """A storage that stores the contents of its files in another
+    storage once per distinct content, no matter how many files have the
+    same contents.
+
+    Example::
+
+        from siilo.storages.content_addressed import (
+            ContentAddressedStorage
+        )
+        from siilo.storages.filesystem import FileSystemStorage
+
+        storage = ContentAddressedStorage(
+            FileSystemStorage(base_directory='/path/to/uploads')
+        )
+
+        for name in ['a.png', 'b.png']:
+            with storage.open(name, 'wb') as f:
+                f.write(avatar)
+
+        storage.save_index()
+
+    The contents written to a file opened with :meth:`open` are hashed
+    while they are written, and spooled to a temporary file. When the
+    file is closed, the contents are uploaded to the wrapped storage as
+    a *blob* named after the digest, unless a blob with the same digest
+    is already stored, in which case nothing is uploaded at all.
+
+    The names of the files are mapped to the digests of their contents
+    in an index, which is kept in memory. The index is loaded from the
+    wrapped storage when it is first needed, and written to it with
+    :meth:`save_index`. Copying, moving and deleting files only change
+    the index.
+
+    A blob is kept as long as the index references it. Deleting the last
+    file referencing a blob doesn't delete the blob right away, but
+    :meth:`collect_garbage` deletes such blobs later. If the same
+    contents are written again before that, the blob is reused.
+
+    The storage is safe to use from multiple threads, but the index
+    must have a single writer: only one :class:`ContentAddressedStorage`
+    at a time, in one process, may use the same index in the wrapped
+    storage. The index isn't locked or merged with the changes of other
+    writers, so :meth:`save_index` overwrites the index saved by
+    another writer, and :meth:`collect_garbage` deletes the blobs that
+    only the files added by another writer reference.
+
+    :param storage: the :class:`.Storage` where the blobs and the index
+        are stored
+    :param algorithm: the name of the :mod:`hashlib` algorithm used for
+        the digests. Defaults to ``'sha256'``.
+    :param blob_prefix: the prefix of the names of the blobs in
+        ``storage``. Defaults to ``'blobs/'``.
+    :param index_name: the name of the index in ``storage``. Defaults to
+        ``'index.json'``.
+    :param spool_size: the maximum size of written contents kept in
+        memory before they are spooled to disk. Defaults to 1 MiB.
+    """
+
+    def __init__(self, storage, algorithm='sha256', blob_prefix='blobs/',
+                 index_name='index.json', spool_size=1024 * 1024):
+        if algorithm not in hashlib.algorithms_available:
+            raise ArgumentError(
+                'Invalid value {algorithm!r} for algorithm.'.format(
+                    algorithm=algorithm
+                )
+            )
+        self.storage = storage
+        self.algorithm = algorithm
+        self.blob_prefix = blob_prefix
+        self.index_name = index_name
+        self.spool_size = spool_size
+
+        self._lock = threading.RLock()
+        self._index = None
+        self._references = None
+        self._garbage = set()
+        self._uploading = collections.Counter()
+
+    @property
+    def index(self):
+        """A dictionary mapping the names of the files to
+        ``(digest, size)`` pairs. It is loaded from the wrapped storage
+        on first access, or empty if the index doesn't exist yet.
+        """
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            return self._index
+
+    def _load_index(self):
+        try:
+            with self.storage.open(self.index_name, 'rb') as f:
+                data = json.loads(force_text(f.read()))
+        except FileNotFoundError:
+            data = {'files': {}}
+        self._index = dict(
+            (name, (digest, size))
+            for name, (digest, size) in data['files'].items()
+        )
+        self._references = collections.Counter(
+            digest for digest, _ in self._index.values()
+        )
+
+    def save_index(self):
+        """Write the index to the wrapped storage."""
+        with self._lock:
+            data = json.dumps(
+                {'files': self.index},
+                separators=(',', ':'),
+                sort_keys=True
+            )
+        with self.storage.open(self.index_name, 'wb') as f:
+            f.write(data.encode('utf-8'))
+
+    def collect_garbage(self, full=False):
+        """Delete the blobs that are no longer referenced by any file,
+        and return the number of blobs deleted.
+
+        By default, only the blobs that have lost their last reference
+        since the index was loaded are deleted. If ``full`` is `True`,
+        all the blobs in the wrapped storage are listed with
+        :meth:`.Storage.walk`, and every blob not referenced by the
+        index is deleted. This also deletes the blobs written before a
+        crash, whose index was never saved.
+        """
+        with self._lock:
+            self.index
+            if full:
+                garbage = set(
+                    self._digest(info.name)
+                    for info in self.storage.walk(self.blob_prefix)
+                )
+                garbage.difference_update(self._references)
+                # The blobs being uploaded aren't referenced until their
+                # uploads have finished.
+                garbage.difference_update(self._uploading)
+            else:
+                garbage = set(self._garbage)
+            # The lock is held while deleting, so that a concurrent
+            # write can't start referencing a blob being deleted.
+            results = self.storage.delete_many(
+                self._blob_name(digest) for digest in sorted(garbage)
+            )
+            self._garbage.difference_update(garbage)
+        return sum(1 for exc in results.values() if exc is None)
+
+    def copy(self, src, dst):
+        with self._lock:
+            self._set(dst, self._get(src))
+
+    def delete(self, name):
+        with self._lock:
+            self._get(name)
+            self._set(name, None)
+
+    def exists(self, name):
+        return name in self.index
+
+    def walk(self, prefix=''):
+        with self._lock:
+            entries = sorted(
+                (name, entry) for name, entry in self.index.items()
+                if name.startswith(prefix)
+            )
+        for name, (digest, size) in entries:
+            yield FileInfo(name=name, size=size, modified=None, etag=digest)
+
+    def move(self, src, dst):
+        with self._lock:
+            entry = self._get(src)
+            self._set(dst, entry)
+            if src != dst:
+                self._set(src, None)
+
+    def open(self, name, mode='rb', encoding=None):
+        if set(mode) <= set('rbt'):
+            digest, _ = self._get(name)
+            blob = self.storage.open(self._blob_name(digest), 'rb')
+            if 'b' in mode:
+                return blob
+            return io.TextIOWrapper(blob, encoding=encoding)
+        if set(mode) <= set('wbt'):
+            writer = io.BufferedWriter(_HashingWriter(self, name))
+            if 'b' in mode:
+                return writer
+            return io.TextIOWrapper(writer, encoding=encoding)
+        raise ArgumentError(
+            'Invalid mode {mode!r}. ContentAddressedStorage supports only '
+            'read and write modes.'.format(mode=mode)
+        )
+
+    def size(self, name):
+        _, size = self._get(name)
+        return size
+
+    def url(self, name):
+        digest, _ = self._get(name)
+        return self.storage.url(self._blob_name(digest))
+
+    def _get(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def _set(self, name, entry):
+        """
+        Point ``name`` to ``entry``, or remove it from the index if
+        ``entry`` is ``None``, and update the reference counts of the
+        blobs.
+        """
+        index = self.index
+        old_entry = index.pop(name, None)
+        if entry is not None:
+            index[name] = entry
+            self._references[entry[0]] += 1
+            self._garbage.discard(entry[0])
+        if old_entry is not None:
+            digest = old_entry[0]
+            self._references[digest] -= 1
+            if not self._references[digest]:
+                del self._references[digest]
+                self._garbage.add(digest)
+
+    def _store(self, name, digest, size, f):
+        """
+        Upload the contents of ``f`` as the blob ``digest`` unless it
+        is already stored, and point ``name`` to it.
+        """
+        entry = (digest, size)
+        with self._lock:
+            self.index
+            if digest in self._references or digest in self._garbage:
+                self._set(name, entry)
+                return
+            self._uploading[digest] += 1
+        try:
+            with self.storage.open(self._blob_name(digest), 'wb') as blob:
+                shutil.copyfileobj(f, blob, 1024 * 1024)
+            with self._lock:
+                self._set(name, entry)
+        finally:
+            with self._lock:
+                self._uploading[digest] -= 1
+                if not self._uploading[digest]:
+                    del self._uploading[digest]
+
+    def _blob_name(self, digest):
+        return '{prefix}{head}/{digest}'.format(
+            prefix=self.blob_prefix,
+            head=digest[:2],
+            digest=digest
+        )
+
+    def _digest(self, blob_name):
+        return blob_name.rpartition('/')[2]
+
+    def __repr__(self):
+        return '<ContentAddressedStorage storage={storage!r}>'.format(
+            storage=self.storage
+        )
+
+
+class _HashingWriter(io.RawIOBase):
+    """
+    A writable raw stream that hashes and spools the written contents,
+    and stores them in a :class:`ContentAddressedStorage` when closed.
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self._name = name
+        self._hash = hashlib.new(storage.algorithm)
+        self._size = 0
+        self._file = tempfile.SpooledTemporaryFile(storage.spool_size)
+
+    @property
+    def name(self):
+        return self._name
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._hash.update(b)
+        self._file.write(b)
+        self._size += len(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._file.seek(0)
+            self._storage._store(
+                self._name,
+                self._hash.hexdigest(),
+                self._size,
+                self._file
+            )
+        finally:
+            self._file.close()
+            super(_HashingWriter, self).close()
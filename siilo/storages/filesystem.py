@@ -7,18 +7,24 @@
     :license: MIT, see LICENSE for more details.
 """
 
+from datetime import datetime
 from functools import wraps
+import binascii
 import errno
 import io
+import mmap
 import os
+import shutil
 
-from .._compat import urljoin, quote
+from .._cache import LRUCache
+from .._compat import urljoin, quote, replace, scandir
 from siilo.exceptions import (
+    ArgumentError,
     FileNotAccessibleViaURLError,
     FileNotFoundError,
     FileNotWithinStorageError
 )
-from .base import Storage
+from .base import FileInfo, Storage
 
 
 def _ensure_file_exists(method):
@@ -33,6 +39,23 @@ def _ensure_file_exists(method):
     return wrapper
 
 
+def _send_file(f, socket, offset, count, chunk_size=64 * 1024):
+    """
+    Send ``count`` bytes of the file ``f`` starting at ``offset`` to
+    ``socket`` with :meth:`socket.socket.sendall`.
+    """
+    f.seek(offset)
+    sent = 0
+    while count is None or sent < count:
+        size = chunk_size if count is None else min(chunk_size, count - sent)
+        data = f.read(size)
+        if not data:
+            break
+        socket.sendall(data)
+        sent += len(data)
+    return sent
+
+
 class FileSystemStorage(Storage):
     """
     A storage driver for the local filesystem.
@@ -61,10 +84,88 @@ class FileSystemStorage(Storage):
         :meth:`.url`. Otherwise :meth:`.url` will raise
         :exc:`.FileNotAccessibleViaURLError`.
 
+    :param atomic_writes:
+        if `True`, files opened in ``'w'`` modes are written to a
+        temporary file in the same directory, which is renamed over the
+        destination when the file is closed. Readers therefore never
+        see a partially written file, and concurrent writers of the
+        same file don't need locks: the last one to close its file
+        wins. If an exception is raised inside the ``with`` block of
+        the file, the temporary file is removed and the destination is
+        left untouched. :meth:`copy` writes the destination in the same
+        way. Append and update modes always write to the file directly.
+        Defaults to `False`.
+
+    :param fsync:
+        if `True`, atomically written files are flushed to disk with
+        :func:`os.fsync` before they are renamed into place, so that a
+        crash can't leave a truncated file behind. Has effect only if
+        ``atomic_writes`` is `True`. Defaults to `True`.
+
+    :param fsync_directory:
+        if `True`, the directory is flushed to disk with
+        :func:`os.fsync` after an atomically written file has been
+        renamed into place, so that the rename itself survives a crash.
+        Has effect only if ``atomic_writes`` is `True`. Defaults to
+        `True`.
+
+    :param directory_cache_size:
+        the maximum number of directories remembered to exist, so that
+        opening files for writing doesn't need to call
+        :func:`os.makedirs` for them again. If a cached directory is
+        removed behind the storage's back, the directory is created
+        again on the next write. Set to ``None`` to disable the cache.
+        Defaults to 1024.
+
+    :param path_cache_size:
+        the maximum number of file names whose normalized paths are
+        remembered, so that repeated calls for the same names don't
+        need to normalize them again. Set to ``None`` to disable the
+        cache. Defaults to 4096.
+
+    :param use_dir_fd:
+        if `True`, the storage holds :attr:`base_directory` open, and
+        :meth:`delete`, :meth:`exists`, :meth:`open` and :meth:`size`
+        resolve names relative to the open directory with the
+        ``dir_fd`` argument of the :mod:`os` functions, like
+        ``openat()``. This saves the kernel from looking up the
+        components of :attr:`base_directory` on every call. The other
+        methods, and :meth:`open` when it creates missing directories or
+        writes atomically, still use paths under :attr:`base_directory`,
+        so it must not be renamed or replaced while the storage is used.
+        :attr:`base_directory` must exist. Call :meth:`close` to close
+        the directory. Requires Python 3.3 or newer on a platform
+        supporting ``dir_fd``. Defaults to `False`.
+
     """
-    def __init__(self, base_directory, base_url=None):
+    def __init__(self, base_directory, base_url=None, atomic_writes=False,
+                 fsync=True, fsync_directory=True,
+                 directory_cache_size=1024, path_cache_size=4096,
+                 use_dir_fd=False):
+        if use_dir_fd and not _supports_dir_fd():
+            raise ArgumentError(
+                'use_dir_fd is not supported on this platform'
+            )
+        self.use_dir_fd = use_dir_fd
+        self._dir_fd = None
+
+        #: The :class:`~siilo._cache.LRUCache` mapping file names to
+        #: their paths, or ``None`` if the cache is disabled.
+        self.path_cache = None
+        if path_cache_size is not None:
+            self.path_cache = LRUCache(maxsize=path_cache_size)
+
         self.base_directory = base_directory
         self.base_url = base_url
+        self.atomic_writes = atomic_writes
+        self.fsync = fsync
+        self.fsync_directory = fsync_directory
+
+        #: The :class:`~siilo._cache.LRUCache` of directories known to
+        #: exist, or ``None`` if the cache is disabled.
+        self.directory_cache = None
+        if directory_cache_size is not None:
+            self.directory_cache = LRUCache(maxsize=directory_cache_size)
 
     @property
     def base_directory(self):
@@ -73,23 +174,183 @@ class FileSystemStorage(Storage):
     @base_directory.setter
     def base_directory(self, value):
         self._base_directory = self._normalize_path(value)
+        self._base_prefix = os.path.join(self._base_directory, '')
+        if self.path_cache is not None:
+            self.path_cache.clear()
+        if self.use_dir_fd:
+            self.close()
+            self._dir_fd = os.open(
+                self._base_directory,
+                os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+            )
+
+    def close(self):
+        """
+        Close :attr:`base_directory` if the storage holds it open
+        because of ``use_dir_fd``.
+        """
+        if self._dir_fd is not None:
+            dir_fd, self._dir_fd = self._dir_fd, None
+            os.close(dir_fd)
+
+    @_ensure_file_exists
+    def copy(self, src, dst):
+        src_path = self._compute_path(src)
+        dst_path = self._compute_path(dst)
+        if not os.path.isfile(src_path):
+            raise FileNotFoundError(src)
+        self._write_to_directory(
+            dst_path,
+            lambda: self._copy(src_path, dst_path)
+        )
+
+    def _copy(self, src_path, dst_path):
+        if not self.atomic_writes:
+            shutil.copyfile(src_path, dst_path)
+            return
+        with io.open(src_path, 'rb') as src:
+            with self._open(dst_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
 
     @_ensure_file_exists
     def delete(self, name):
-        os.remove(self._compute_path(name))
+        path, kwargs = self._resolve(name)
+        os.unlink(path, **kwargs)
+
+    def delete_many(self, names):
+        results = {}
+        for name in names:
+            try:
+                os.remove(self._compute_path(name))
+            except (IOError, OSError) as exc:
+                if exc.errno == errno.ENOENT:
+                    exc = FileNotFoundError(name)
+                results[name] = exc
+            except FileNotWithinStorageError as exc:
+                results[name] = exc
+            else:
+                results[name] = None
+        return results
 
     def exists(self, name):
-        return os.path.exists(self._compute_path(name))
+        path, kwargs = self._resolve(name)
+        try:
+            os.stat(path, **kwargs)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def iterdir(self, prefix=''):
+        directory, name_prefix = self._split_prefix(prefix)
+        for name, entry in self._scan(directory, name_prefix):
+            if entry.is_file():
+                yield self._file_info(name, entry)
+
+    def walk(self, prefix=''):
+        directory, name_prefix = self._split_prefix(prefix)
+        return self._walk(directory, name_prefix)
+
+    @_ensure_file_exists
+    def mmap(self, name):
+        """
+        Map the given file into memory and return a read-only
+        :class:`memoryview` of its contents.
+
+        The pages of the file are read lazily by the operating system
+        as they are accessed, without copying them into a Python bytes
+        object. The mapping is closed once the returned view and all
+        the views sliced from it are garbage collected or released.
+
+        :param name: the name of the file to map
+        :return: a read-only :class:`memoryview` of the file contents
+        :raises FileNotFoundError: if the file does not exist
+        :raises FileNotWithinStorageError: if the file is not within
+            :attr:`base_directory`
+        """
+        with io.open(self._compute_path(name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            return memoryview(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+
+    @_ensure_file_exists
+    def move(self, src, dst):
+        src_path = self._compute_path(src)
+        dst_path = self._compute_path(dst)
+        if not os.path.isfile(src_path):
+            raise FileNotFoundError(src)
+        self._write_to_directory(
+            dst_path,
+            lambda: shutil.move(src_path, dst_path)
+        )
+
+    def invalidate_directory_cache(self):
+        """
+        Forget the directories known to exist. Call this after removing
+        directories within :attr:`base_directory` if the files in them
+        may be opened for writing again.
+        """
+        if self.directory_cache is not None:
+            self.directory_cache.clear()
 
     @_ensure_file_exists
     def open(self, name, mode='rb'):
         path = self._compute_path(name)
-        self._ensure_path_exists_for_write_modes(path, mode)
+        if 'a' in mode or 'w' in mode:
+            return self._write_to_directory(
+                path,
+                lambda: self._open(path, mode)
+            )
+        return self._open(path, mode)
+
+    def _open(self, path, mode):
+        if self.atomic_writes and 'w' in mode:
+            return _AtomicFile(
+                path,
+                mode,
+                fsync=self.fsync,
+                fsync_directory=self.fsync_directory
+            )
+        if self._dir_fd is not None:
+            dir_fd = self._dir_fd
+            return io.open(
+                self._relative_path(path),
+                mode,
+                opener=lambda path, flags: os.open(path, flags, dir_fd=dir_fd)
+            )
         return io.open(path, mode)
 
+    @_ensure_file_exists
+    def send_to(self, name, socket, offset=0, count=None):
+        """
+        Send the contents of the given file to a connected socket.
+
+        The file is sent with :meth:`socket.socket.sendfile`, which uses
+        :func:`os.sendfile` to copy the data from the file to the socket
+        inside the kernel where it is available. On older Python
+        versions the file is sent in chunks with
+        :meth:`socket.socket.sendall` instead.
+
+        :param name: the name of the file to send
+        :param socket: a connected blocking stream socket
+        :param offset: the position in the file to start sending from
+        :param count: the number of bytes to send, or ``None`` to send
+            until the end of the file
+        :return: the number of bytes sent
+        :raises FileNotFoundError: if the file does not exist
+        :raises FileNotWithinStorageError: if the file is not within
+            :attr:`base_directory`
+        """
+        with io.open(self._compute_path(name), 'rb') as f:
+            if hasattr(socket, 'sendfile'):
+                return socket.sendfile(f, offset, count)
+            return _send_file(f, socket, offset, count)
+
     @_ensure_file_exists
     def size(self, name):
-        return os.path.getsize(self._compute_path(name))
+        path, kwargs = self._resolve(name)
+        return os.stat(path, **kwargs).st_size
 
     def url(self, name):
         if self.base_url is None:
@@ -115,25 +376,238 @@ class FileSystemStorage(Storage):
         :raises FileNotWithinStorage: if the computed path is not within
             :attr:`base_directory`.
         """
+        cache = self.path_cache
+        if cache is not None:
+            path = cache.get(name)
+            if path is not None:
+                return path
         path = self._normalize_path(os.path.join(self.base_directory, name))
-        if not path.startswith(self.base_directory):
+        if (
+            path != self.base_directory and
+            not path.startswith(self._base_prefix)
+        ):
             raise FileNotWithinStorageError(name)
+        if cache is not None:
+            cache.set(name, path)
         return path
 
-    def _ensure_path_exists_for_write_modes(self, path, mode):
-        base_path = os.path.dirname(path)
-        is_write_mode = 'a' in mode or 'w' in mode
-        if is_write_mode:
-            self._ensure_path_exists(base_path)
+    def _resolve(self, name):
+        """
+        Return the path of the given file and the keyword arguments to
+        pass to the :mod:`os` functions along with it. If the storage
+        holds :attr:`base_directory` open, the path is relative to it.
+        """
+        path = self._compute_path(name)
+        if self._dir_fd is None:
+            return path, {}
+        return self._relative_path(path), {'dir_fd': self._dir_fd}
+
+    def _relative_path(self, path):
+        return path[len(self._base_prefix):] or os.curdir
+
+    @staticmethod
+    def _split_prefix(prefix):
+        directory, _, name_prefix = prefix.rpartition('/')
+        return directory, name_prefix
+
+    def _walk(self, directory, name_prefix=''):
+        for name, entry in self._scan(directory, name_prefix):
+            if entry.is_dir():
+                for info in self._walk(name):
+                    yield info
+            elif entry.is_file():
+                yield self._file_info(name, entry)
+
+    def _scan(self, directory, name_prefix):
+        """
+        Return a list of ``(name, entry)`` pairs for the entries in
+        ``directory`` starting with ``name_prefix``, where ``entry`` is
+        the directory entry returned by :func:`os.scandir`.
 
-    def _ensure_path_exists(self, path):
+        The entries are sorted so that walking the directory tree
+        depth-first yields the names in lexicographical order.
+        """
+        path = self._compute_path(directory)
+        try:
+            entries = [
+                entry for entry in scandir(path)
+                if entry.name.startswith(name_prefix)
+            ]
+        except OSError as exc:
+            if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+                return []
+            raise
+        entries.sort(key=lambda entry: (
+            entry.name + '/' if entry.is_dir() else entry.name
+        ))
+        return [
+            (directory + '/' + entry.name if directory else entry.name, entry)
+            for entry in entries
+        ]
+
+    @staticmethod
+    def _file_info(name, entry):
+        stat = entry.stat()
+        return FileInfo(
+            name=name,
+            size=stat.st_size,
+            modified=datetime.utcfromtimestamp(stat.st_mtime),
+            etag=None
+        )
+
+    def _write_to_directory(self, path, function):
+        """
+        Ensure that the directory of ``path`` exists, and return the
+        result of ``function``, which writes to ``path``.
+        """
+        directory = os.path.dirname(path)
+        self._ensure_path_exists(directory)
+        try:
+            return function()
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            # The directory was removed after it was cached.
+            self._ensure_path_exists(directory, cached=False)
+            return function()
+
+    def _ensure_path_exists(self, path, cached=True):
+        cache = self.directory_cache
+        if cache is not None and cached and cache.get(path):
+            return
         try:
             os.makedirs(path)
         except OSError as exc:
             if exc.errno != errno.EEXIST:
                 raise
+        if cache is not None:
+            cache.set(path, True)
 
     def __repr__(self):
         return '<FileSystemStorage base_directory={base_directory!r}>'.format(
             base_directory=self.base_directory
         )
+
+
+class _AtomicFile(object):
+    """
+    A file opened for writing to a temporary file next to ``path``,
+    which replaces ``path`` when the file is closed.
+    """
+
+    def __init__(self, path, mode, fsync=True, fsync_directory=True):
+        self.path = path
+        self.fsync = fsync
+        self.fsync_directory = fsync_directory
+        self._temporary_path, fd = self._create_temporary_file()
+        try:
+            self._file = io.open(fd, mode)
+        except BaseException:
+            os.close(fd)
+            os.remove(self._temporary_path)
+            raise
+
+    def _create_temporary_file(self):
+        directory, filename = os.path.split(self.path)
+        while True:
+            temporary_path = os.path.join(
+                directory,
+                '.{filename}.{suffix}.tmp'.format(
+                    filename=filename,
+                    suffix=binascii.hexlify(os.urandom(6)).decode('ascii')
+                )
+            )
+            try:
+                # Unlike tempfile.mkstemp(), os.open() honors the umask,
+                # so the file gets the same permissions as with io.open().
+                fd = os.open(
+                    temporary_path,
+                    os.O_RDWR | os.O_CREAT | os.O_EXCL |
+                    getattr(os, 'O_BINARY', 0),
+                    0o666
+                )
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            else:
+                return temporary_path, fd
+
+    @property
+    def name(self):
+        return self.path
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        """Write the file to disk and rename it over :attr:`path`."""
+        if self._file.closed:
+            return
+        try:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except BaseException:
+            self.discard()
+            raise
+        self._file.close()
+        try:
+            replace(self._temporary_path, self.path)
+        except BaseException:
+            self._remove_temporary_file()
+            raise
+        if self.fsync_directory:
+            _fsync_directory(os.path.dirname(self.path))
+
+    def discard(self):
+        """Close the file and remove it without touching :attr:`path`."""
+        if not self._file.closed:
+            self._file.close()
+            self._remove_temporary_file()
+
+    def _remove_temporary_file(self):
+        try:
+            os.remove(self._temporary_path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __repr__(self):
+        return '<_AtomicFile path={path!r}>'.format(path=self.path)
+
+
+def _supports_dir_fd():
+    supports_dir_fd = getattr(os, 'supports_dir_fd', set())
+    return all(
+        function in supports_dir_fd
+        for function in (os.open, os.unlink, os.stat)
+    )
+
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Directories can't be opened on Windows, where the rename is
+        # durable without this.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
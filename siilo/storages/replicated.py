@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.storages.replicated
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+import io
+import shutil
+import tempfile
+import threading
+
+from .._compat import perf_counter
+from ..exceptions import ArgumentError, FileNotFoundError, ReplicationError
+from .base import Storage
+
+
+class ReplicatedStorage(Storage):
+    """A storage that keeps a copy of every file in each of several
+    other storages, the *replicas*.
+
+    Example::
+
+        from siilo.storages.replicated import ReplicatedStorage
+
+        storage = ReplicatedStorage(
+            [
+                AmazonS3Storage(..., region='eu-west-1'),
+                AmazonS3Storage(..., region='us-east-1'),
+            ],
+            write_quorum=1
+        )
+
+        with storage.open('logo.png', 'wb') as f:
+            f.write(data)
+
+    Changes are made to all the replicas at the same time. The contents
+    written to a file opened with :meth:`open` are spooled to a
+    temporary file, and when the file is closed, they are uploaded to
+    every replica concurrently. Copying, moving and deleting files is
+    fanned out in the same way. A change returns as soon as it has
+    succeeded in ``write_quorum`` replicas, and the rest of the replicas
+    are changed in the background, so they may briefly lag behind. If
+    the change fails in too many replicas, :exc:`.ReplicationError` is
+    raised once every replica has responded. Deleting a file that is
+    missing from some of the replicas succeeds, but
+    :exc:`.FileNotFoundError` is raised if it is missing from all of
+    them.
+
+    Reads go to the replica that has responded the fastest: the latency
+    of each replica is measured on every read, and the replicas are
+    tried in the order of the moving averages of their latencies. A
+    replica that fails with any other error than
+    :exc:`.FileNotFoundError` is considered unhealthy for
+    ``retry_after`` seconds, during which it is only used if all the
+    other replicas fail too. :meth:`exists`, :meth:`size` and reading a
+    file with :meth:`open` fall back to the next replica on such
+    errors, and raise the error of the first replica if every replica
+    fails. They also fall back to the next replica when the file is
+    missing, as the replica may be lagging behind, so a file is only
+    reported missing after every replica has been asked. Listing files
+    is delegated to the fastest healthy replica, and URLs are built by
+    the first replica.
+
+    The replicas are used from many threads at the same time, so they
+    must be thread-safe. An :class:`.ApacheLibcloudStorage` needs a
+    ``connection_pool_size``.
+
+    :param storages: the list of :class:`.Storage` objects to replicate
+        the files to
+    :param write_quorum: the number of replicas a change must succeed in
+        before it returns. Defaults to all the replicas.
+    :param max_workers: the maximum number of threads changing the
+        replicas. Defaults to four per replica.
+    :param spool_size: the maximum size of written contents kept in
+        memory before they are spooled to disk. Defaults to 1 MiB.
+    :param retry_after: the number of seconds a failed replica is
+        avoided for. Defaults to 30.
+    """
+
+    #: The weight of the latest measurement in the moving average of the
+    #: latency of a replica.
+    LATENCY_WEIGHT = 0.2
+
+    def __init__(self, storages, write_quorum=None, max_workers=None,
+                 spool_size=1024 * 1024, retry_after=30):
+        self.storages = list(storages)
+        if not self.storages:
+            raise ArgumentError('At least one storage is required.')
+        if write_quorum is None:
+            write_quorum = len(self.storages)
+        if not 1 <= write_quorum <= len(self.storages):
+            raise ArgumentError(
+                'Invalid value {write_quorum!r} for write_quorum. It '
+                'must be between 1 and the number of storages.'.format(
+                    write_quorum=write_quorum
+                )
+            )
+        self.write_quorum = write_quorum
+        self.max_workers = max_workers or 4 * len(self.storages)
+        self.spool_size = spool_size
+        self.retry_after = retry_after
+
+        #: The number of changes to a replica that failed in the
+        #: background after the write quorum was reached.
+        self.lagging_failures = 0
+
+        self._lock = threading.Lock()
+        self._latencies = [None] * len(self.storages)
+        self._failed_until = [0.0] * len(self.storages)
+        self._executor = None
+        self._background = set()
+
+    @property
+    def latencies(self):
+        """The moving averages of the read latencies of the replicas in
+        seconds, in the order of :attr:`storages`. The latency of a
+        replica that hasn't been read from yet is `None`.
+        """
+        with self._lock:
+            return list(self._latencies)
+
+    def wait(self, timeout=None):
+        """Wait until the changes still being made to the replicas in the
+        background have finished, or until ``timeout`` seconds have
+        passed, and return whether they have finished.
+        """
+        from concurrent.futures import wait
+        with self._lock:
+            pending = list(self._background)
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def copy(self, src, dst):
+        self._fan_out(src, lambda storage: storage.copy(src, dst))
+
+    def delete(self, name):
+        self._fan_out(
+            name,
+            lambda storage: storage.delete(name),
+            missing_ok=True
+        )
+
+    def delete_many(self, names):
+        names = list(names)
+        outcomes = dict((name, []) for name in names)
+        for storage, future in self._submit_all(
+            lambda storage: storage.delete_many(names)
+        ):
+            exc = future.exception()
+            for name in names:
+                error = exc if exc is not None else future.result()[name]
+                outcomes[name].append((storage, error))
+        results = {}
+        for name in names:
+            succeeded = sum(1 for _, exc in outcomes[name] if exc is None)
+            errors = [
+                (storage, exc) for storage, exc in outcomes[name]
+                if exc is not None
+            ]
+            missing = sum(
+                1 for _, exc in errors if isinstance(exc, FileNotFoundError)
+            )
+            try:
+                self._check(name, succeeded, missing, errors, True)
+            except Exception as exc:
+                results[name] = exc
+            else:
+                results[name] = None
+        return results
+
+    def exists(self, name):
+        def exists(storage):
+            if not storage.exists(name):
+                raise FileNotFoundError(name)
+            return True
+
+        try:
+            return self._read(exists)
+        except FileNotFoundError:
+            return False
+
+    def iterdir(self, prefix=''):
+        return self.storages[self._ranked()[0]].iterdir(prefix)
+
+    def walk(self, prefix=''):
+        return self.storages[self._ranked()[0]].walk(prefix)
+
+    def move(self, src, dst):
+        self._fan_out(src, lambda storage: storage.move(src, dst))
+
+    def open(self, name, mode='rb', encoding=None):
+        if set(mode) <= set('rbt'):
+            kwargs = {} if encoding is None else {'encoding': encoding}
+            return self._read(
+                lambda storage: storage.open(name, mode, **kwargs)
+            )
+        if set(mode) <= set('wbt'):
+            writer = io.BufferedWriter(_ReplicatingWriter(self, name))
+            if 'b' in mode:
+                return writer
+            return io.TextIOWrapper(writer, encoding=encoding)
+        raise ArgumentError(
+            'Invalid mode {mode!r}. ReplicatedStorage supports only '
+            'read and write modes.'.format(mode=mode)
+        )
+
+    def size(self, name):
+        return self._read(lambda storage: storage.size(name))
+
+    def url(self, name):
+        return self.storages[0].url(name)
+
+    def iter_urls(self, names):
+        return self.storages[0].iter_urls(names)
+
+    def _read(self, function):
+        """
+        Call ``function`` with the replicas in the order of their
+        latencies until it succeeds, and return its result.
+
+        A replica that raises :exc:`.FileNotFoundError` may only be
+        lagging behind, so the next replica is tried. The error is
+        raised if the file is missing from all the replicas.
+        """
+        errors = []
+        missing = None
+        for index in self._ranked():
+            start = perf_counter()
+            try:
+                result = function(self.storages[index])
+            except FileNotFoundError as exc:
+                self._measure(index, perf_counter() - start)
+                missing = exc
+            except Exception as exc:
+                with self._lock:
+                    self._failed_until[index] = (
+                        perf_counter() + self.retry_after
+                    )
+                errors.append(exc)
+            else:
+                self._measure(index, perf_counter() - start)
+                return result
+        if errors:
+            raise errors[0]
+        raise missing
+
+    def _ranked(self):
+        """
+        Return the indices of the replicas, healthy replicas first, in
+        the order of their latencies. Replicas that haven't been read
+        from yet come first, so that their latencies get measured.
+        """
+        now = perf_counter()
+        with self._lock:
+            return sorted(
+                range(len(self.storages)),
+                key=lambda index: (
+                    self._failed_until[index] > now,
+                    self._latencies[index] or 0.0,
+                    index
+                )
+            )
+
+    def _measure(self, index, seconds):
+        with self._lock:
+            latency = self._latencies[index]
+            if latency is None:
+                self._latencies[index] = seconds
+            else:
+                self._latencies[index] = latency + self.LATENCY_WEIGHT * (
+                    seconds - latency
+                )
+            self._failed_until[index] = 0.0
+
+    def _fan_out(self, name, function, missing_ok=False):
+        """
+        Call ``function`` with every replica concurrently, and return
+        when it has succeeded with enough of them, or raise an error
+        after it has been called with all of them. A replica that raises
+        :exc:`.FileNotFoundError` counts as a success if ``missing_ok``
+        is `True`, as long as the function succeeds with at least one
+        replica.
+        """
+        from concurrent.futures import as_completed
+        futures = dict(
+            (future, storage)
+            for storage, future in self._submit_all(function)
+        )
+        succeeded = missing = 0
+        errors = []
+        for future in as_completed(list(futures)):
+            exc = future.exception()
+            storage = futures.pop(future)
+            if exc is None:
+                succeeded += 1
+            else:
+                errors.append((storage, exc))
+                if isinstance(exc, FileNotFoundError):
+                    missing += 1
+            done = succeeded + missing if missing_ok else succeeded
+            if succeeded and done >= self.write_quorum:
+                for future in futures:
+                    future.add_done_callback(self._finish_in_background)
+                return
+        self._check(name, succeeded, missing, errors, missing_ok)
+
+    def _check(self, name, succeeded, missing, errors, missing_ok):
+        if not succeeded and errors and missing == len(errors):
+            raise FileNotFoundError(name)
+        if missing_ok:
+            succeeded += missing
+        if not succeeded or succeeded < self.write_quorum:
+            raise ReplicationError(
+                name,
+                succeeded,
+                self.write_quorum,
+                errors
+            )
+
+    def _submit_all(self, function):
+        """
+        Submit ``function`` to be called with each replica, and return
+        a list of ``(storage, future)`` pairs.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            pairs = [
+                (storage, self._executor.submit(function, storage))
+                for storage in self.storages
+            ]
+            self._background.update(future for _, future in pairs)
+        for _, future in pairs:
+            future.add_done_callback(self._forget)
+        return pairs
+
+    def _forget(self, future):
+        with self._lock:
+            self._background.discard(future)
+
+    def _finish_in_background(self, future):
+        exc = future.exception()
+        if exc is not None and not isinstance(exc, FileNotFoundError):
+            with self._lock:
+                self.lagging_failures += 1
+
+    def _replicate(self, name, spool):
+        """
+        Upload the contents of ``spool`` to every replica as ``name``.
+        """
+        shared = _SharedFile(spool, len(self.storages))
+
+        def upload(storage):
+            try:
+                with storage.open(name, 'wb') as f:
+                    shutil.copyfileobj(shared.reader(), f, 1024 * 1024)
+            finally:
+                shared.release()
+
+        self._fan_out(name, upload)
+
+    def __repr__(self):
+        return '<ReplicatedStorage storages={storages!r}>'.format(
+            storages=self.storages
+        )
+
+
+class _ReplicatingWriter(io.RawIOBase):
+    """
+    A writable raw stream that spools the written contents, and
+    replicates them with a :class:`ReplicatedStorage` when closed.
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self._name = name
+        self._file = tempfile.SpooledTemporaryFile(storage.spool_size)
+
+    @property
+    def name(self):
+        return self._name
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._file.write(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._storage._replicate(self._name, self._file)
+        finally:
+            super(_ReplicatingWriter, self).close()
+
+
+class _SharedFile(object):
+    """
+    A file read by several threads at the same time, each with a reader
+    of its own, and closed when each of its ``users`` has released it.
+    """
+
+    def __init__(self, file, users):
+        self._file = file
+        self._users = users
+        self._lock = threading.Lock()
+
+    def reader(self):
+        return _SharedFileReader(self)
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if not self._users:
+                self._file.close()
+
+    def read_at(self, position, size):
+        with self._lock:
+            self._file.seek(position)
+            return self._file.read(size)
+
+
+class _SharedFileReader(object):
+    def __init__(self, shared):
+        self._shared = shared
+        self._position = 0
+
+    def read(self, size=-1):
+        data = self._shared.read_at(self._position, size)
+        self._position += len(data)
+        return data
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+    siilo.transfer
+    ~~~~~~~~~~~~~~
+
+    :copyright: (c) 2014 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+from collections import namedtuple
+import threading
+import time
+
+from ._concurrent import map_bounded
+
+
+class TransferReport(namedtuple(
+    'TransferReport',
+    ['files', 'bytes', 'seconds', 'retries', 'failures']
+)):
+    """A summary of a transfer, as returned by
+    :meth:`TransferManager.transfer`.
+
+    .. attribute:: files
+
+       the number of files transferred successfully
+
+    .. attribute:: bytes
+
+       the number of bytes transferred, including the bytes of failed
+       attempts
+
+    .. attribute:: seconds
+
+       the duration of the transfer in seconds
+
+    .. attribute:: retries
+
+       the number of times a file was retried after a failed attempt
+
+    .. attribute:: failures
+
+       a dictionary that maps the name of each file that couldn't be
+       transferred to the exception raised by its last attempt
+    """
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        """The average throughput of the transfer in bytes per
+        second."""
+        if not self.seconds:
+            return 0.0
+        return self.bytes / float(self.seconds)
+
+    def __str__(self):
+        return (
+            '{files} files, {megabytes:.1f} MB in {seconds:.1f} s '
+            '({throughput:.1f} MB/s), {retries} retries, '
+            '{failures} failures'
+        ).format(
+            files=self.files,
+            megabytes=self.bytes / 1e6,
+            seconds=self.seconds,
+            throughput=self.throughput / 1e6,
+            retries=self.retries,
+            failures=len(self.failures)
+        )
+
+
+class TransferManager(object):
+    """Transfers files from one storage to another in parallel.
+
+    Example::
+
+        from siilo.transfer import TransferManager
+
+        manager = TransferManager(
+            source=FileSystemStorage(base_directory='/path/to/files'),
+            destination=AmazonS3Storage(..., connection_pool_size=16),
+            max_workers=16
+        )
+        report = manager.transfer(names)
+        print(report)
+
+    Each file is read from ``source`` and written to ``destination`` in
+    a pool of ``max_workers`` threads, so that many files are in flight
+    at the same time over separate connections. The names are consumed
+    lazily, so ``names`` can be a generator of any length.
+
+    The threads share the :class:`.ConnectionPool` of an
+    :class:`.ApacheLibcloudStorage`, whose ``connection_pool_size``
+    should therefore be at least ``max_workers`` for the connections to
+    be kept alive between files. A storage that is not safe to share
+    between threads, i.e. an :class:`.ApacheLibcloudStorage` without a
+    connection pool, is only used from the thread calling
+    :meth:`transfer`, which makes the transfer serial.
+
+    :param source: the :class:`.Storage` to read the files from
+    :param destination: the :class:`.Storage` to write the files to
+    :param max_workers: the maximum number of files transferred at the
+        same time. Defaults to 16.
+    :param retries: how many times the transfer of a file is retried
+        after it fails. Defaults to 2.
+    :param retry_delay: the number of seconds to wait before the first
+        retry of a file. The delay is doubled for each further retry.
+        Defaults to 0.5.
+    :param chunk_size: the size of the chunks read from the source
+        files in bytes. Defaults to 1 MiB.
+    """
+
+    def __init__(self, source, destination, max_workers=16, retries=2,
+                 retry_delay=0.5, chunk_size=1024 * 1024):
+        self.source = source
+        self.destination = destination
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.chunk_size = chunk_size
+
+    def transfer(self, names, progress=None):
+        """Transfer the files referenced by ``names`` from the source
+        storage to the destination storage, replacing files with the
+        same names in the destination, and return a
+        :class:`TransferReport`.
+
+        A file that can't be transferred is reported in
+        :attr:`TransferReport.failures` instead of raising an
+        exception, so that the other files are transferred anyway.
+
+        :param names: an iterable of the names of the files to transfer
+        :param progress: if given, called as ``progress(name, count)``
+            with the name of a file and the number of bytes of it
+            transferred since the previous call. It is called from the
+            worker threads, so it must be thread-safe.
+        """
+        state = _TransferState(progress)
+        start = time.time()
+        if _is_thread_safe(self.source) and \
+                _is_thread_safe(self.destination):
+            results = (
+                (name, future.exception())
+                for name, future in map_bounded(
+                    lambda name: self._transfer_file(name, state),
+                    names,
+                    self.max_workers
+                )
+            )
+        else:
+            # The files are transferred in the calling thread, which
+            # may also be using the storages to produce the names.
+            results = (
+                (name, _exception(self._transfer_file, name, state))
+                for name in names
+            )
+        for name, exc in results:
+            if exc is None:
+                state.files += 1
+            else:
+                state.failures[name] = exc
+        return TransferReport(
+            files=state.files,
+            bytes=state.bytes,
+            seconds=time.time() - start,
+            retries=state.retries,
+            failures=state.failures
+        )
+
+    def _transfer_file(self, name, state):
+        attempt = 0
+        while True:
+            try:
+                return self._copy(name, state)
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+            time.sleep(self.retry_delay * 2 ** attempt)
+            attempt += 1
+            state.add_retry()
+
+    def _copy(self, name, state):
+        with self.source.open(name, 'rb') as source:
+            destination = self.destination.open(name, 'wb')
+            try:
+                while True:
+                    data = source.read(self.chunk_size)
+                    if not data:
+                        break
+                    destination.write(data)
+                    state.add_bytes(name, len(data))
+            except BaseException:
+                self._discard(name, destination)
+                raise
+            destination.close()
+
+    def _discard(self, name, destination):
+        """
+        Close a destination file whose transfer failed without leaving
+        a truncated file behind.
+
+        A file with a ``discard()`` method, such as an atomically
+        written file of a :class:`.FileSystemStorage` or a
+        :class:`.LibcloudFile`, is discarded without changing the
+        destination. Other files can only be closed, so the truncated
+        file is deleted.
+        """
+        discard = getattr(destination, 'discard', None)
+        try:
+            if discard is not None:
+                discard()
+                return
+            destination.close()
+            self.destination.delete(name)
+        except Exception:
+            # The error of the transfer is more interesting.
+            pass
+
+    def __repr__(self):
+        return (
+            '<TransferManager source={source!r}, '
+            'destination={destination!r}>'
+        ).format(source=self.source, destination=self.destination)
+
+
+class _TransferState(object):
+    def __init__(self, progress):
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def add_bytes(self, name, count):
+        with self._lock:
+            self.bytes += count
+        if self.progress is not None:
+            self.progress(name, count)
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+
+def _exception(function, *args):
+    """
+    Call ``function`` with the given arguments, and return the exception
+    it raises, or ``None``.
+    """
+    try:
+        function(*args)
+    except Exception as exc:
+        return exc
+    return None
+
+
+def _is_thread_safe(storage):
+    # Libcloud connections can only be shared between threads through a
+    # connection pool. Wrapping storages are as safe as the storage they
+    # wrap, and replicated storages as safe as all their replicas.
+    if getattr(storage, 'connection_pool', True) is None:
+        return False
+    wrapped = getattr(storage, 'storages', None)
+    if wrapped is not None:
+        return all(_is_thread_safe(replica) for replica in wrapped)
+    wrapped = getattr(storage, 'storage', None)
+    return wrapped is None or _is_thread_safe(wrapped)
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime
+import errno
+import io
 import locale
 import os
+import threading
 try:
     from unittest import mock
 except ImportError:
     import mock
 
+import freezegun
 from libcloud.storage.base import Container
 from libcloud.storage.types import ObjectDoesNotExistError
 import pytest
@@ -135,7 +140,7 @@ def test_open_returns_libcloud_file_with_given_mode_and_encoding(storage):
 
 
 @pytest.mark.parametrize(
-    'mode', ['a', 'a+', 'a+b', 'ab', 'r', 'r+', 'r+b', 'rb']
+    'mode', ['a', 'a+', 'a+b', 'ab', 'r', 'r+', 'r+b']
 )
 def test_downloads_file_for_read_and_append_modes(storage, container, mode):
     contents = b'Quick brown fox jumps over lazy dog'
@@ -148,6 +153,170 @@ def test_downloads_file_for_read_and_append_modes(storage, container, mode):
             assert tempfile.read() == contents
 
 
+@pytest.fixture
+def streamed_object(container):
+    contents = b'Quick brown fox jumps over lazy dog'
+
+    obj = container.get_object('some_file.txt')
+    obj.size = len(contents)
+    obj.as_stream.side_effect = lambda: iter([contents[:10], contents[10:]])
+    obj.driver.download_object_range_as_stream.side_effect = (
+        lambda obj, start_bytes: iter([contents[start_bytes:]])
+    )
+    return obj
+
+
+@pytest.mark.parametrize('mode', ['rb', 'br'])
+def test_streams_file_for_binary_read_mode(storage, streamed_object, mode):
+    with storage.open('some_file.txt', mode) as file_:
+        assert file_._temporary_directory is None
+        assert file_.read() == b'Quick brown fox jumps over lazy dog'
+
+
+def test_streamed_file_is_read_lazily(storage, streamed_object):
+    with storage.open('some_file.txt', 'rb') as file_:
+        assert not streamed_object.as_stream.called
+        assert file_.read(5) == b'Quick'
+    assert streamed_object.as_stream.call_count == 1
+
+
+def test_streamed_file_seek_uses_ranged_download(storage, streamed_object):
+    with storage.open('some_file.txt', 'rb') as file_:
+        assert file_.seek(-3, os.SEEK_END) == 32
+        assert file_.read() == b'dog'
+        assert file_.tell() == 35
+        file_.seek(6)
+        assert file_.read(5) == b'brown'
+    driver = streamed_object.driver
+    assert driver.download_object_range_as_stream.call_args_list == [
+        mock.call(streamed_object, start_bytes=32),
+        mock.call(streamed_object, start_bytes=6),
+    ]
+
+
+def test_streamed_file_seek_closes_discarded_download(storage,
+                                                      streamed_object):
+    streams = []
+
+    def stream(obj, start_bytes):
+        streams.append(mock.MagicMock())
+        streams[-1].__iter__.return_value = iter([b'dog'])
+        return streams[-1]
+
+    driver = streamed_object.driver
+    driver.download_object_range_as_stream.side_effect = stream
+    with storage.open('some_file.txt', 'rb') as file_:
+        file_.seek(32)
+        assert file_.read(1) == b'd'
+        file_.seek(31)
+        assert streams[0].close.called
+        file_.read(1)
+        assert not streams[1].close.called
+    assert streams[1].close.called
+
+
+def test_streamed_file_uses_read_buffer_size(storage, streamed_object):
+    storage.read_buffer_size = 4
+    with storage.open('some_file.txt', 'rb') as file_:
+        assert file_.peek(1) == b'Quic'
+        assert file_.read1(10) == b'Quic'
+        assert file_.read(2) == b'k '
+
+
+def test_streamed_file_supports_peek_and_read1(storage, streamed_object):
+    with storage.open('some_file.txt', 'rb') as file_:
+        assert file_.peek(5).startswith(b'Quick')
+        assert file_.tell() == 0
+        assert file_.read1(5) == b'Quick'
+        # The first chunk of the download ends at 'Quick brow'.
+        buffer_ = bytearray(6)
+        assert file_.readinto1(buffer_) == 5
+        assert buffer_[:5] == b' brow'
+
+
+def test_streamed_file_can_be_wrapped_in_text_wrapper(
+    storage, streamed_object
+):
+    with storage.open('some_file.txt', 'rb') as file_:
+        text = io.TextIOWrapper(file_, encoding='ascii')
+        assert text.read(5) == u'Quick'
+        assert text.readline() == u' brown fox jumps over lazy dog'
+
+
+def make_archive_object(container, contents):
+    obj = container.get_object('archive')
+    obj.size = len(contents)
+    obj.as_stream.side_effect = lambda: iter([contents])
+    obj.driver.download_object_range_as_stream.side_effect = (
+        lambda obj, start_bytes: iter([contents[start_bytes:]])
+    )
+
+
+def test_streamed_file_can_be_read_with_gzip(storage, container):
+    import gzip
+    buffer_ = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer_, mode='wb') as f:
+        f.write(b'x' * 100000)
+    make_archive_object(container, buffer_.getvalue())
+    with storage.open('archive', 'rb') as file_:
+        with gzip.GzipFile(fileobj=file_) as f:
+            assert f.read(10) == b'x' * 10
+            assert len(f.read()) == 99990
+
+
+def test_streamed_file_can_be_read_with_zipfile(storage, container):
+    import zipfile
+    buffer_ = io.BytesIO()
+    with zipfile.ZipFile(buffer_, 'w') as f:
+        f.writestr('a.txt', b'foo')
+        f.writestr('b.txt', b'bar')
+    make_archive_object(container, buffer_.getvalue())
+    with storage.open('archive', 'rb') as file_:
+        with zipfile.ZipFile(file_) as f:
+            assert f.namelist() == ['a.txt', 'b.txt']
+            assert f.read('b.txt') == b'bar'
+
+
+def test_streamed_file_can_be_read_with_tarfile(storage, container):
+    import tarfile
+    buffer_ = io.BytesIO()
+    with tarfile.open(fileobj=buffer_, mode='w') as f:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 3
+        f.addfile(info, io.BytesIO(b'foo'))
+    make_archive_object(container, buffer_.getvalue())
+    with storage.open('archive', 'rb') as file_:
+        with tarfile.open(fileobj=file_) as f:
+            assert f.extractfile('a.txt').read() == b'foo'
+
+
+def test_streamed_file_supports_readinto(storage, streamed_object):
+    buffer_ = bytearray(5)
+    with storage.open('some_file.txt', 'rb') as file_:
+        file_.seek(10)
+        assert file_.readinto(buffer_) == 5
+    assert buffer_ == b'n fox'
+
+
+def test_streamed_file_falls_back_to_skipping_without_range_support(
+    storage, streamed_object
+):
+    driver = streamed_object.driver
+    driver.download_object_range_as_stream.side_effect = NotImplementedError
+    with storage.open('some_file.txt', 'rb') as file_:
+        file_.seek(12)
+        assert file_.read(3) == b'fox'
+
+
+def test_streamed_file_raises_error_if_file_doesnt_exist(
+    storage, container, object_does_not_exist
+):
+    container.get_object.side_effect = object_does_not_exist
+    with pytest.raises(FileNotFoundError) as excinfo:
+        storage.open('some_file.txt', 'rb')
+    assert excinfo.value.name == 'some_file.txt'
+
+
 @pytest.mark.parametrize('mode', ['w', 'wb', 'w+', 'w+b'])
 def test_doesnt_download_file_for_write_modes(storage, container, mode):
     with storage.open('some_file.txt', mode):
@@ -160,7 +329,7 @@ def test_doesnt_download_file_for_write_modes(storage, container, mode):
     ('mode', 'encoding'),
     [
         ('r', None),
-        ('w', 'UTF-8'),
+        ('w+', 'UTF-8'),
     ]
 )
 def test_opens_temporary_file_with_given_mode_and_encoding(
@@ -191,7 +360,7 @@ def test_always_opens_temporary_file_within_the_temporary_directory(
 
 @pytest.mark.parametrize(
     'mode',
-    ['a', 'a+', 'a+b', 'ab', 'w', 'wb', 'w+', 'w+b']
+    ['a', 'a+', 'a+b', 'ab', 'w+', 'w+b']
 )
 def test_uploads_file_opened_in_write_mode_but_not_written_to_to_storage(
     storage, container, mode, object_does_not_exist
@@ -210,7 +379,7 @@ def test_uploads_file_opened_in_write_mode_but_not_written_to_to_storage(
 
 @pytest.mark.parametrize(
     'mode',
-    ['a', 'a+', 'a+b', 'ab', 'r+', 'r+b', 'w', 'wb', 'w+', 'w+b']
+    ['a', 'a+', 'a+b', 'ab', 'r+', 'r+b', 'w+', 'w+b']
 )
 @pytest.mark.parametrize(
     ('method_name', 'method_args'),
@@ -262,6 +431,7 @@ def test_removes_temporary_directory_after_file_is_closed(storage, container):
         ('readinto', [], True),
         ('readline', [], True),
         ('readlines', [], True),
+        ('seek', [0], True),
         ('seekable', [], True),
         ('tell', [], False),
         ('writable', [], True),
@@ -351,3 +521,899 @@ def test_libcloudfile_repr(storage, mode, encoding, expected_format):
             mode=file_.mode,
             encoding=encoding
         )
+
+
+@pytest.fixture
+def multipart_upload(storage):
+    upload = mock.MagicMock(name='upload')
+    upload.upload_part.side_effect = (
+        lambda number, data: 'etag-{0}'.format(number)
+    )
+    storage.upload_part_size = 4
+    storage._create_multipart_upload = mock.Mock(return_value=upload)
+    return upload
+
+
+@pytest.mark.parametrize('mode', ['w', 'wb'])
+def test_write_only_modes_use_multipart_upload_if_supported(
+    storage, container, multipart_upload, mode
+):
+    with storage.open('some_file.txt', mode) as file_:
+        assert file_._temporary_directory is None
+    storage._create_multipart_upload.assert_called_with('some_file.txt')
+    assert not container.upload_object_via_stream.called
+
+
+def test_multipart_upload_puts_small_file_as_single_object(
+    storage, multipart_upload
+):
+    with storage.open('some_file.txt', 'wb') as file_:
+        file_.write(b'foo')
+    multipart_upload.put.assert_called_with(b'foo')
+    assert not multipart_upload.begin.called
+
+
+def test_multipart_upload_uploads_file_in_parts(storage, multipart_upload):
+    with storage.open('some_file.txt', 'wb') as file_:
+        file_.write(b'0123456789')
+    assert multipart_upload.begin.called
+    assert sorted(multipart_upload.upload_part.call_args_list) == [
+        mock.call(1, b'0123'),
+        mock.call(2, b'4567'),
+        mock.call(3, b'89'),
+    ]
+    multipart_upload.complete.assert_called_with(
+        [(1, 'etag-1'), (2, 'etag-2'), (3, 'etag-3')]
+    )
+    assert not multipart_upload.put.called
+
+
+def test_multipart_upload_encodes_text(storage, multipart_upload):
+    storage.upload_part_size = 1024
+    with storage.open('some_file.txt', 'w', 'utf-8') as file_:
+        file_.write(u'åäö')
+    multipart_upload.put.assert_called_with(u'åäö'.encode('utf-8'))
+
+
+def test_multipart_upload_retries_failed_part(storage, multipart_upload):
+    failures = [IOError('Connection reset')]
+
+    def upload_part(number, data):
+        if number == 2 and failures:
+            raise failures.pop()
+        return 'etag-{0}'.format(number)
+
+    multipart_upload.upload_part.side_effect = upload_part
+    with storage.open('some_file.txt', 'wb') as file_:
+        file_.write(b'0123456789')
+
+    calls = multipart_upload.upload_part.call_args_list
+    assert calls.count(mock.call(1, b'0123')) == 1
+    assert calls.count(mock.call(2, b'4567')) == 2
+    assert multipart_upload.complete.called
+
+
+def test_multipart_upload_is_aborted_if_part_keeps_failing(
+    storage, multipart_upload
+):
+    multipart_upload.upload_part.side_effect = IOError('Connection reset')
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'0123')
+    with pytest.raises(IOError):
+        file_.close()
+    assert multipart_upload.upload_part.call_count == 3
+    assert multipart_upload.abort.called
+    assert not multipart_upload.complete.called
+
+
+def test_discard_aborts_multipart_upload(storage, multipart_upload):
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'0123456789')
+    file_.flush()
+    file_.discard()
+    assert file_.closed
+    assert multipart_upload.abort.called
+    assert not multipart_upload.complete.called
+    assert not multipart_upload.put.called
+
+
+def test_discard_of_small_multipart_upload_uploads_nothing(
+    storage, multipart_upload
+):
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'01')
+    file_.discard()
+    assert not multipart_upload.put.called
+    assert not multipart_upload.abort.called
+
+
+def test_multipart_upload_is_used_with_s3_driver():
+    from libcloud.storage.drivers.s3 import S3StorageDriver
+    from siilo.storages.apache_libcloud import (
+        ApacheLibcloudStorage,
+        _S3MultipartUpload,
+    )
+    driver = S3StorageDriver('key', 'secret')
+    storage = ApacheLibcloudStorage(Container('bucket', {}, driver))
+    upload = storage._create_multipart_upload('some_file.txt')
+    assert isinstance(upload, _S3MultipartUpload)
+    assert upload.container is storage.container
+    assert upload.name == 'some_file.txt'
+
+
+@pytest.fixture
+def uploaded(container):
+    """Collect the data uploaded with ``upload_object_via_stream``."""
+    uploads = {}
+
+    def upload_object_via_stream(iterator, object_name):
+        uploads[object_name] = b''.join(iterator)
+
+    container.upload_object_via_stream.side_effect = upload_object_via_stream
+    return uploads
+
+
+@pytest.mark.parametrize(('mode', 'data'), [
+    ('w', u'foo'),
+    ('wb', b'foo'),
+])
+def test_write_only_modes_upload_small_file_from_memory(
+    storage, container, uploaded, mode, data
+):
+    with mock.patch('tempfile.mkdtemp') as mkdtemp:
+        with storage.open('some_file.txt', mode) as file_:
+            file_.write(data)
+            assert not container.upload_object_via_stream.called
+    assert not mkdtemp.called
+    assert file_._temporary_directory is None
+    assert uploaded == {'some_file.txt': b'foo'}
+
+
+def test_write_only_mode_uploads_empty_file(storage, uploaded):
+    with storage.open('some_file.txt', 'wb'):
+        pass
+    assert uploaded == {'some_file.txt': b''}
+
+
+def test_write_only_mode_streams_large_file_into_upload(
+    storage, container, uploaded
+):
+    storage.upload_spool_size = 4
+    with storage.open('some_file.txt', 'wb') as file_:
+        file_.write(b'foo')
+        file_.flush()
+        assert not container.upload_object_via_stream.called
+        file_.write(b'bar')
+        file_.flush()
+        assert container.upload_object_via_stream.called
+        file_.write(b'baz' * 10000)
+    assert uploaded == {'some_file.txt': b'foobar' + b'baz' * 10000}
+
+
+def test_write_only_mode_raises_streaming_upload_error(storage, container):
+    from libcloud.common.types import LibcloudError
+    storage.upload_spool_size = 4
+    error = LibcloudError('upload failed')
+
+    def upload_object_via_stream(iterator, object_name):
+        next(iterator)
+        raise error
+
+    container.upload_object_via_stream.side_effect = upload_object_via_stream
+    file_ = storage.open('some_file.txt', 'wb')
+    with pytest.raises(LibcloudError):
+        for _ in range(1000):
+            file_.write(b'x' * 1024)
+            file_.flush()
+    with pytest.raises(LibcloudError):
+        file_.close()
+
+
+def test_write_only_mode_raises_error_of_upload_that_fails_at_end(
+    storage, container
+):
+    from libcloud.common.types import LibcloudError
+    storage.upload_spool_size = 4
+
+    def upload_object_via_stream(iterator, object_name):
+        for _ in iterator:
+            pass
+        raise LibcloudError('upload rejected')
+
+    container.upload_object_via_stream.side_effect = upload_object_via_stream
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'foobar')
+    errors = []
+
+    def close():
+        try:
+            file_.close()
+        except LibcloudError as exc:
+            errors.append(exc)
+
+    closer = threading.Thread(target=close)
+    closer.daemon = True
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive()
+    assert [exc.value for exc in errors] == ['upload rejected']
+
+
+def test_discard_doesnt_upload_small_file(storage, uploaded):
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'foo')
+    file_.discard()
+    assert file_.closed
+    assert uploaded == {}
+
+
+def test_discard_aborts_streaming_upload(storage, container):
+    storage.upload_spool_size = 4
+    received = []
+
+    def upload_object_via_stream(iterator, object_name):
+        for data in iterator:
+            received.append(data)
+
+    container.upload_object_via_stream.side_effect = upload_object_via_stream
+    file_ = storage.open('some_file.txt', 'wb')
+    file_.write(b'foobar')
+    file_.flush()
+    file_.discard()
+    assert file_.closed
+    assert received == [b'foobar']
+    assert isinstance(file_._writer._error, IOError)
+
+
+def test_discard_doesnt_upload_temporary_file(storage, container):
+    file_ = storage.open('some_file.txt', 'w+b')
+    file_.write(b'foo')
+    temporary_directory = file_._temporary_directory
+    file_.discard()
+    assert file_.closed
+    assert not container.upload_object_via_stream.called
+    assert not os.path.exists(temporary_directory)
+
+
+def test_multipart_upload_isnt_used_without_multipart_support(storage):
+    assert storage._create_multipart_upload('some_file.txt') is None
+
+
+class TestS3MultipartUpload(object):
+    @pytest.fixture
+    def driver(self):
+        driver = mock.MagicMock(name='driver')
+        driver._get_object_path.return_value = '/bucket/some_file.txt'
+        driver._initiate_multipart.return_value = 'upload-id'
+        return driver
+
+    @pytest.fixture
+    def upload(self, driver):
+        from siilo.storages.apache_libcloud import _S3MultipartUpload
+        container = mock.MagicMock(name='container', driver=driver)
+        upload = _S3MultipartUpload(container, 'some_file.txt')
+        upload._local.connection = mock.MagicMock(name='connection')
+        upload.begin()
+        return upload
+
+    def test_begin_initiates_multipart_upload(self, upload, driver):
+        driver._initiate_multipart.assert_called_with(
+            container=upload.container,
+            object_name='some_file.txt'
+        )
+        assert upload.upload_id == 'upload-id'
+
+    def test_upload_part(self, upload):
+        connection = upload._local.connection
+        connection.request.return_value.status = 200
+        connection.request.return_value.headers = {'etag': '"abc"'}
+
+        assert upload.upload_part(1, b'foo') == 'abc'
+        connection.request.assert_called_with(
+            '/bucket/some_file.txt',
+            method='PUT',
+            data=b'foo',
+            headers={
+                'Content-Length': 3,
+                'Content-MD5': 'rL0Y20zC+Fzt72VPzMSk2A==',
+            },
+            params={'uploadId': 'upload-id', 'partNumber': 1}
+        )
+
+    def test_upload_part_raises_error_on_unexpected_status(self, upload):
+        from libcloud.common.exceptions import BaseHTTPError
+        upload._local.connection.request.return_value.status = 500
+        with pytest.raises(BaseHTTPError) as excinfo:
+            upload.upload_part(1, b'foo')
+        assert excinfo.value.code == 500
+
+    def test_complete_commits_multipart_upload(self, upload, driver):
+        upload.complete([(1, 'abc')])
+        driver._commit_multipart.assert_called_with(
+            container=upload.container,
+            object_name='some_file.txt',
+            upload_id='upload-id',
+            chunks=[(1, 'abc')]
+        )
+
+    def test_abort_aborts_multipart_upload(self, upload, driver):
+        upload.abort()
+        driver._abort_multipart.assert_called_with(
+            container=upload.container,
+            object_name='some_file.txt',
+            upload_id='upload-id'
+        )
+
+
+class FakeConnection(object):
+    host = 'example.com'
+
+    def __init__(self):
+        self.connection = None
+
+    def connect(self):
+        self.connection = mock.Mock(name='http_connection')
+
+    def request(self, action, **kwargs):
+        return mock.Mock(name='response', connection=self)
+
+
+class TestConnectionPool(object):
+    @pytest.fixture
+    def pool(self):
+        from siilo.storages.apache_libcloud import ConnectionPool
+        return ConnectionPool(FakeConnection(), size=2, idle_timeout=60)
+
+    def test_creates_new_connection_if_pool_is_empty(self, pool):
+        with pool.acquire() as connection:
+            assert isinstance(connection, FakeConnection)
+            assert connection is not pool.connection
+            assert connection.connection is not None
+        assert pool.misses == 1
+        assert pool.hits == 0
+
+    def test_reuses_idle_connection(self, pool):
+        with pool.acquire() as first:
+            pass
+        with pool.acquire() as second:
+            pass
+        assert first is second
+        assert pool.misses == 1
+        assert pool.hits == 1
+
+    def test_concurrently_acquired_connections_are_different(self, pool):
+        with pool.acquire() as first:
+            with pool.acquire() as second:
+                assert first is not second
+
+    def test_keeps_at_most_size_idle_connections(self, pool):
+        with pool.acquire() as first:
+            with pool.acquire() as second:
+                with pool.acquire() as third:
+                    pass
+        assert pool.idle == 2
+        assert not third.connection.session.close.called
+        assert not second.connection.session.close.called
+        assert first.connection.session.close.called
+
+    def test_discards_connections_idle_longer_than_idle_timeout(self, pool):
+        with freezegun.freeze_time('2014-01-01 12:00:00'):
+            with pool.acquire() as first:
+                pass
+        with freezegun.freeze_time('2014-01-01 12:01:01'):
+            with pool.acquire() as second:
+                pass
+        assert first is not second
+        assert first.connection.session.close.called
+        assert pool.misses == 2
+
+    def test_clear_closes_idle_connections(self, pool):
+        with pool.acquire() as connection:
+            pass
+        pool.clear()
+        assert pool.idle == 0
+        assert connection.connection.session.close.called
+
+    def test_repr(self, pool):
+        assert repr(pool) == (
+            '<ConnectionPool size=2, idle=0, hits=0, misses=0>'
+        )
+
+
+class TestPooledConnection(object):
+    @pytest.fixture
+    def pooled_connection(self):
+        from siilo.storages.apache_libcloud import (
+            ConnectionPool,
+            _PooledConnection,
+        )
+        pool = ConnectionPool(FakeConnection(), size=2, idle_timeout=60)
+        return _PooledConnection(pool)
+
+    def test_is_thread_safe(self, pooled_connection):
+        assert pooled_connection.thread_safe is True
+
+    def test_delegates_attributes_to_pool_connection(self, pooled_connection):
+        assert pooled_connection.host == 'example.com'
+
+    def test_makes_request_with_connection_from_pool(self, pooled_connection):
+        response = pooled_connection.request('/foo')
+        pool = pooled_connection._pool
+        assert response.connection is not pool.connection
+        assert pool.idle == 1
+
+    def test_resolves_raw_response_before_releasing_connection(
+        self, pooled_connection
+    ):
+        response = pooled_connection.request('/foo', raw=True)
+        assert response.response is not None
+
+
+def test_connection_pooling_is_disabled_by_default(storage):
+    assert storage.connection_pool is None
+
+
+def test_connection_pool_replaces_driver_connection():
+    from libcloud.storage.drivers.s3 import S3StorageDriver
+    from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+    driver = S3StorageDriver('key', 'secret')
+    connection = driver.connection
+    storage = ApacheLibcloudStorage(
+        Container('bucket', {}, driver),
+        connection_pool_size=5,
+        connection_idle_timeout=30
+    )
+    assert storage.connection_pool.connection is connection
+    assert storage.connection_pool.size == 5
+    assert storage.connection_pool.idle_timeout == 30
+    assert driver.connection.thread_safe is True
+    assert driver.connection.host == connection.host
+
+
+@pytest.fixture
+def cached_storage(container):
+    from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+    return ApacheLibcloudStorage(
+        container=container,
+        metadata_cache_size=10,
+        metadata_cache_ttl=5
+    )
+
+
+def test_metadata_caching_is_disabled_by_default(storage):
+    assert storage.metadata_cache is None
+
+
+def test_metadata_cache_is_configurable(cached_storage):
+    assert cached_storage.metadata_cache.maxsize == 10
+    assert cached_storage.metadata_cache.ttl == 5
+
+
+def test_metadata_cache_avoids_repeated_requests(cached_storage, container):
+    assert cached_storage.exists('some_file.txt')
+    cached_storage.size('some_file.txt')
+    cached_storage.url('some_file.txt')
+    assert container.get_object.call_count == 1
+    assert cached_storage.metadata_cache.hits == 2
+    assert cached_storage.metadata_cache.misses == 1
+
+
+def test_metadata_cache_doesnt_cache_missing_files(
+    cached_storage, container, object_does_not_exist
+):
+    container.get_object.side_effect = object_does_not_exist
+    assert not cached_storage.exists('some_file.txt')
+    assert not cached_storage.exists('some_file.txt')
+    assert container.get_object.call_count == 2
+
+
+def test_delete_invalidates_metadata_cache(cached_storage, container):
+    cached_storage.exists('some_file.txt')
+    cached_storage.delete('some_file.txt')
+    cached_storage.exists('some_file.txt')
+    assert container.get_object.call_count == 2
+
+
+@pytest.mark.parametrize('mode', ['w', 'a', 'r+'])
+def test_writing_file_invalidates_metadata_cache(
+    cached_storage, container, mode
+):
+    obj = container.get_object.return_value
+    obj.as_stream.return_value = iter([b''])
+    cached_storage.exists('some_file.txt')
+    with cached_storage.open('some_file.txt', mode) as file_:
+        file_.write(u'foo')
+    assert len(cached_storage.metadata_cache) == 0
+
+
+def test_reading_file_doesnt_invalidate_metadata_cache(
+    cached_storage, container
+):
+    obj = container.get_object.return_value
+    obj.as_stream.return_value = iter([b''])
+    cached_storage.exists('some_file.txt')
+    with cached_storage.open('some_file.txt', 'r'):
+        pass
+    assert len(cached_storage.metadata_cache) == 1
+
+
+def make_object(name, **kwargs):
+    from libcloud.storage.base import Object
+    kwargs.setdefault('size', 3)
+    kwargs.setdefault('hash', 'abc')
+    kwargs.setdefault('extra', {})
+    kwargs.setdefault('meta_data', {})
+    return Object(name=name, container=None, driver=None, **kwargs)
+
+
+def test_walk_iterates_objects_with_prefix(storage, container):
+    container.iterate_objects.return_value = iter([
+        make_object('a/b.txt'),
+        make_object('a/c/'),
+        make_object('a/c/d.txt'),
+    ])
+    names = [info.name for info in storage.walk('a/')]
+    assert names == ['a/b.txt', 'a/c/d.txt']
+    container.iterate_objects.assert_called_with(prefix='a/')
+
+
+def test_walk_without_prefix(storage, container):
+    container.iterate_objects.return_value = iter([])
+    assert list(storage.walk()) == []
+    container.iterate_objects.assert_called_with(prefix=None)
+
+
+def test_iterdir_yields_objects_directly_within_directory(storage, container):
+    container.iterate_objects.return_value = iter([
+        make_object('a/b.txt'),
+        make_object('a/c/d.txt'),
+    ])
+    assert [info.name for info in storage.iterdir('a/')] == ['a/b.txt']
+
+
+@pytest.mark.parametrize(
+    ('extra', 'modified'),
+    [
+        ({}, None),
+        ({'last_modified': 'garbage'}, None),
+        (
+            {'last_modified': '2014-04-25T12:30:15.000Z'},
+            datetime(2014, 4, 25, 12, 30, 15)
+        ),
+        (
+            {'last_modified': 'Fri, 25 Apr 2014 12:30:15 GMT'},
+            datetime(2014, 4, 25, 12, 30, 15)
+        ),
+        ({'modify_time': 1398429015.0}, datetime(2014, 4, 25, 12, 30, 15)),
+    ]
+)
+def test_walk_returns_file_info(storage, container, extra, modified):
+    from siilo.storages.base import FileInfo
+    container.iterate_objects.return_value = iter([
+        make_object('a.txt', extra=extra)
+    ])
+    assert list(storage.walk()) == [
+        FileInfo(name='a.txt', size=3, modified=modified, etag='abc')
+    ]
+
+
+@pytest.mark.parametrize('connection_pool', [None, mock.sentinel.pool])
+def test_delete_many_deletes_objects_without_fetching_them(
+    storage, container, object_does_not_exist, connection_pool
+):
+    def delete_object(obj):
+        if obj.name == 'b.txt':
+            raise object_does_not_exist
+        return True
+
+    storage.connection_pool = connection_pool
+    container.driver = mock.Mock(name='driver')
+    container.driver.delete_object.side_effect = delete_object
+
+    results = storage.delete_many(['a.txt', 'b.txt'])
+
+    assert results['a.txt'] is None
+    assert isinstance(results['b.txt'], FileNotFoundError)
+    calls = container.driver.delete_object.call_args_list
+    deleted = sorted(call[0][0].name for call in calls)
+    assert deleted == ['a.txt', 'b.txt']
+    assert not container.get_object.called
+
+
+def test_delete_many_invalidates_metadata_cache(cached_storage, container):
+    container.driver = mock.Mock(name='driver')
+    cached_storage.exists('some_file.txt')
+    cached_storage.delete_many(['some_file.txt'])
+    assert len(cached_storage.metadata_cache) == 0
+
+
+def connection_reset():
+    return IOError(errno.ECONNRESET, 'Connection reset by peer')
+
+
+class TestRetryPolicy(object):
+    @pytest.fixture
+    def policy(self):
+        from siilo.retry import RetryPolicy
+        with mock.patch('siilo.retry.time.sleep'):
+            yield RetryPolicy(max_retries=2, jitter=False)
+
+    @pytest.fixture
+    def storage(self, container, policy):
+        from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+        return ApacheLibcloudStorage(container=container, retry_policy=policy)
+
+    def test_get_object_is_retried(self, storage, container, policy):
+        obj = mock.Mock(name='obj', size=3)
+        container.get_object.side_effect = [connection_reset(), obj]
+        assert storage.size('some_file.txt') == 3
+        assert container.get_object.call_count == 2
+        assert policy.retries == 1
+
+    def test_missing_file_is_not_retried(
+        self, storage, container, policy, object_does_not_exist
+    ):
+        container.get_object.side_effect = object_does_not_exist
+        assert storage.exists('some_file.txt') is False
+        assert container.get_object.call_count == 1
+        assert policy.retries == 0
+
+    def test_gives_up_after_max_retries(self, storage, container, policy):
+        container.get_object.side_effect = connection_reset()
+        with pytest.raises(IOError):
+            storage.exists('some_file.txt')
+        assert container.get_object.call_count == 3
+
+    def test_delete_is_retried(self, storage, container, policy):
+        obj = container.get_object('some_file.txt')
+        obj.delete.side_effect = [connection_reset(), True]
+        storage.delete('some_file.txt')
+        assert obj.delete.call_count == 2
+
+    def test_delete_retry_of_deleted_file_succeeds(
+        self, storage, container, policy, object_does_not_exist
+    ):
+        obj = container.get_object('some_file.txt')
+        obj.delete.side_effect = [connection_reset(), object_does_not_exist]
+        storage.delete('some_file.txt')
+        assert obj.delete.call_count == 2
+
+    def test_delete_of_missing_file_fails_without_retries(
+        self, storage, container, policy, object_does_not_exist
+    ):
+        obj = container.get_object('some_file.txt')
+        obj.delete.side_effect = object_does_not_exist
+        with pytest.raises(FileNotFoundError):
+            storage.delete('some_file.txt')
+        assert obj.delete.call_count == 1
+
+    def test_delete_many_is_retried(self, storage, container):
+        container.driver = mock.Mock(name='driver')
+        container.driver.delete_object.side_effect = [connection_reset(), True]
+        assert storage.delete_many(['a.txt']) == {'a.txt': None}
+        assert container.driver.delete_object.call_count == 2
+
+    @pytest.fixture
+    def flaky_object(self, container):
+        """An object whose downloads fail after the first 10 bytes."""
+        contents = b'Quick brown fox jumps over lazy dog'
+
+        def chunks(start):
+            yield contents[start:start + 10]
+            if start + 10 < len(contents):
+                raise connection_reset()
+
+        obj = container.get_object('some_file.txt')
+        obj.name = 'some_file.txt'
+        obj.size = len(contents)
+        obj.as_stream.side_effect = lambda: chunks(0)
+        obj.driver.download_object_range_as_stream.side_effect = (
+            lambda obj, start_bytes: chunks(start_bytes)
+        )
+        return obj
+
+    def test_streamed_download_resumes_from_failure(
+        self, storage, flaky_object, policy
+    ):
+        with storage.open('some_file.txt', 'rb') as file_:
+            assert file_.read() == b'Quick brown fox jumps over lazy dog'
+        calls = flaky_object.driver.download_object_range_as_stream
+        assert calls.call_args_list == [
+            mock.call(flaky_object, start_bytes=10),
+            mock.call(flaky_object, start_bytes=20),
+            mock.call(flaky_object, start_bytes=30),
+        ]
+        assert policy.retries == 3
+
+    def test_temporary_file_download_resumes_from_failure(
+        self, storage, flaky_object
+    ):
+        with storage.open('some_file.txt', 'r') as file_:
+            assert file_.read() == u'Quick brown fox jumps over lazy dog'
+
+    def test_truncated_download_is_resumed(self, storage, container):
+        contents = b'Quick brown fox'
+        obj = container.get_object('some_file.txt')
+        obj.size = len(contents)
+        obj.as_stream.side_effect = lambda: iter([contents[:5]])
+        obj.driver.download_object_range_as_stream.side_effect = (
+            lambda obj, start_bytes: iter([contents[start_bytes:]])
+        )
+        with storage.open('some_file.txt', 'rb') as file_:
+            assert file_.read() == contents
+
+    def test_temporary_file_upload_is_retried(
+        self, storage, container, uploaded
+    ):
+        attempts = []
+
+        def upload_object_via_stream(iterator, object_name):
+            attempts.append(b''.join(iterator))
+            if len(attempts) == 1:
+                raise connection_reset()
+            uploaded[object_name] = attempts[-1]
+
+        container.upload_object_via_stream.side_effect = (
+            upload_object_via_stream
+        )
+        with storage.open('some_file.txt', 'w+b') as file_:
+            file_.write(b'foo')
+        assert attempts == [b'foo', b'foo']
+        assert uploaded == {'some_file.txt': b'foo'}
+
+    def test_failed_upload_can_be_retried_by_closing_again(
+        self, storage, container, policy
+    ):
+        policy.max_retries = 0
+        container.upload_object_via_stream.side_effect = IOError('down')
+        file_ = storage.open('some_file.txt', 'w+b')
+        file_.write(b'foo')
+        with pytest.raises(IOError):
+            file_.close()
+        assert not file_.closed
+        assert os.path.exists(file_._temporary_filename)
+
+        container.upload_object_via_stream.side_effect = None
+        file_.close()
+        assert file_.closed
+        assert not os.path.exists(file_._temporary_directory)
+
+    def test_small_write_only_upload_is_retried(self, storage, container):
+        container.upload_object_via_stream.side_effect = [
+            connection_reset(),
+            None,
+        ]
+        with storage.open('some_file.txt', 'wb') as file_:
+            file_.write(b'foo')
+        assert container.upload_object_via_stream.call_count == 2
+
+    def test_multipart_put_is_retried(self, storage, container):
+        from siilo.storages.apache_libcloud import _S3MultipartUpload
+        container.upload_object_via_stream.side_effect = [
+            connection_reset(),
+            None,
+        ]
+        upload = _S3MultipartUpload(container, 'some_file.txt',
+                                    retry=storage._retry)
+        upload.put(b'foo')
+        assert container.upload_object_via_stream.call_count == 2
+
+    def test_multipart_initiate_and_complete_are_retried(self, storage,
+                                                         container):
+        from siilo.storages.apache_libcloud import _S3MultipartUpload
+        container.driver = driver = mock.MagicMock(name='driver')
+        driver._initiate_multipart.side_effect = [
+            connection_reset(),
+            'upload-id',
+        ]
+        driver._commit_multipart.side_effect = [connection_reset(), None]
+        upload = _S3MultipartUpload(container, 'some_file.txt',
+                                    retry=storage._retry)
+        upload.begin()
+        upload.complete([(1, 'abc')])
+        assert upload.upload_id == 'upload-id'
+        assert driver._initiate_multipart.call_count == 2
+        assert driver._commit_multipart.call_count == 2
+
+    def test_multipart_part_is_retried_with_policy(self, storage, policy):
+        upload = mock.MagicMock(name='upload')
+        upload.upload_part.side_effect = [
+            connection_reset(),
+            connection_reset(),
+            'etag-1',
+        ]
+        storage.upload_part_size = 4
+        storage.upload_part_retries = 0
+        storage._create_multipart_upload = mock.Mock(return_value=upload)
+        with storage.open('some_file.txt', 'wb') as file_:
+            file_.write(b'0123')
+        upload.complete.assert_called_with([(1, 'etag-1')])
+        assert policy.retries == 2
+
+    def test_multipart_part_isnt_retried_on_permanent_error(self, storage,
+                                                            policy):
+        from libcloud.common.exceptions import BaseHTTPError
+        upload = mock.MagicMock(name='upload')
+        upload.upload_part.side_effect = BaseHTTPError(403, 'Forbidden')
+        storage.upload_part_size = 4
+        storage._create_multipart_upload = mock.Mock(return_value=upload)
+        file_ = storage.open('some_file.txt', 'wb')
+        file_.write(b'0123')
+        with pytest.raises(BaseHTTPError):
+            file_.close()
+        assert upload.upload_part.call_count == 1
+        assert upload.abort.called
+        assert policy.retries == 0
+
+
+class TestHedgePolicy(object):
+    @pytest.fixture
+    def policy(self):
+        from siilo.hedging import HedgePolicy
+        return HedgePolicy(initial_delay=0.01)
+
+    def test_requires_connection_pool(self, container, policy):
+        from siilo.exceptions import ArgumentError
+        from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+        with pytest.raises(ArgumentError):
+            ApacheLibcloudStorage(container=container, hedge_policy=policy)
+
+    @pytest.fixture
+    def storage(self, container, policy):
+        from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+        container.driver = mock.MagicMock(name='driver')
+        return ApacheLibcloudStorage(
+            container=container,
+            connection_pool_size=2,
+            hedge_policy=policy
+        )
+
+    @pytest.fixture
+    def slow_object(self, container):
+        """An object whose first download is slow to respond."""
+        import threading
+        contents = b'Quick brown fox jumps over lazy dog'
+        released = threading.Event()
+        streams = []
+
+        def as_stream():
+            streams.append(None)
+            if len(streams) == 1:
+                released.wait(5)
+            return iter([contents[:10], contents[10:]])
+
+        obj = container.get_object('some_file.txt')
+        obj.size = len(contents)
+        obj.as_stream.side_effect = as_stream
+        obj.driver.download_object_range_as_stream.side_effect = (
+            lambda obj, start_bytes: iter([contents[start_bytes:]])
+        )
+        yield obj
+        released.set()
+
+    def test_slow_download_is_hedged(self, storage, slow_object, policy):
+        with storage.open('some_file.txt', 'rb') as file_:
+            assert file_.read() == b'Quick brown fox jumps over lazy dog'
+        assert slow_object.as_stream.call_count == 2
+        assert policy.hedged == 1
+        assert policy.hedges_won == 1
+
+    def test_large_download_is_not_hedged(
+        self, storage, slow_object, policy
+    ):
+        policy.max_size = 10
+        slow_object.as_stream.side_effect = (
+            lambda: iter([b'Quick brown fox jumps over lazy dog'])
+        )
+        with storage.open('some_file.txt', 'rb') as file_:
+            assert file_.read(5) == b'Quick'
+        assert policy.requests == 0
+
+    def test_seek_starts_hedged_ranged_download(
+        self, storage, slow_object, policy
+    ):
+        with storage.open('some_file.txt', 'rb') as file_:
+            file_.seek(6)
+            assert file_.read(5) == b'brown'
+        assert policy.requests == 1
+        assert policy.hedged == 0
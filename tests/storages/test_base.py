@@ -1,3 +1,8 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import pytest
 
 
@@ -30,3 +35,85 @@ def test_size_raises_not_implemented_error(storage):
 def test_url_raises_not_implemented_error(storage):
     with pytest.raises(NotImplementedError):
         storage.url('README.rst')
+
+
+def test_urls_raises_not_implemented_error(storage):
+    with pytest.raises(NotImplementedError):
+        storage.urls(['README.rst'])
+
+
+def test_urls_returns_url_for_each_name_in_order(storage):
+    storage.url = lambda name: 'http://example.com/' + name
+    assert storage.urls(['b.txt', 'a.txt']) == [
+        'http://example.com/b.txt',
+        'http://example.com/a.txt',
+    ]
+
+
+def test_iter_urls_generates_urls_lazily(storage):
+    storage.url = lambda name: 'http://example.com/' + name
+    urls = storage.iter_urls(iter(['a.txt', 'b.txt']))
+    assert not isinstance(urls, list)
+    assert next(urls) == 'http://example.com/a.txt'
+
+
+def test_walk_raises_not_implemented_error(storage):
+    with pytest.raises(NotImplementedError):
+        list(storage.walk())
+
+
+def test_iterdir_filters_files_from_walk(storage):
+    from siilo.storages.base import FileInfo
+    storage.walk = lambda prefix: iter([
+        FileInfo(name, None, None, None)
+        for name in ['a/b.txt', 'a/c/d.txt', 'a/e.txt']
+        if name.startswith(prefix)
+    ])
+    assert [info.name for info in storage.iterdir('a/')] == [
+        'a/b.txt',
+        'a/e.txt',
+    ]
+
+
+def test_delete_many_raises_not_implemented_error(storage):
+    with pytest.raises(NotImplementedError):
+        storage.delete_many(['README.rst'])
+
+
+def test_delete_many_deletes_each_file(storage):
+    from siilo.exceptions import FileNotFoundError
+    error = FileNotFoundError('b.txt')
+
+    def delete(name):
+        if name == 'b.txt':
+            raise error
+
+    storage.delete = delete
+    assert storage.delete_many(['a.txt', 'b.txt']) == {
+        'a.txt': None,
+        'b.txt': error,
+    }
+
+
+def test_copy_streams_file_contents(storage):
+    import io
+    files = {'a.txt': io.BytesIO(b'foo')}
+
+    class Destination(io.BytesIO):
+        def close(self):
+            files['b.txt'] = io.BytesIO(self.getvalue())
+            io.BytesIO.close(self)
+
+    storage.open = lambda name, mode: (
+        Destination() if 'w' in mode else files[name]
+    )
+    storage.copy('a.txt', 'b.txt')
+    assert files['b.txt'].getvalue() == b'foo'
+
+
+def test_move_copies_and_deletes_file(storage):
+    storage.copy = mock.Mock()
+    storage.delete = mock.Mock()
+    storage.move('a.txt', 'b.txt')
+    storage.copy.assert_called_with('a.txt', 'b.txt')
+    storage.delete.assert_called_with('a.txt')
@@ -0,0 +1,244 @@
+import os
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from libcloud.storage.base import Container
+from libcloud.storage.types import ObjectDoesNotExistError
+import pytest
+
+from siilo.exceptions import FileNotFoundError
+
+
+class FakeCloud(object):
+    """Objects of a mocked Libcloud container, keyed by name."""
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = 0
+
+    def put(self, name, data, etag, extra=None):
+        obj = mock.Mock(name=name, hash=etag, size=len(data), extra=extra)
+        obj.as_stream.side_effect = lambda: self._stream(data)
+        self.objects[name] = obj
+
+    def _stream(self, data):
+        self.downloads += 1
+        for i in range(0, len(data), 2):
+            yield data[i:i + 2]
+
+    def get_object(self, name):
+        try:
+            return self.objects[name]
+        except KeyError:
+            raise ObjectDoesNotExistError(
+                driver=None,
+                value=None,
+                object_name=name
+            )
+
+
+@pytest.fixture
+def cloud():
+    return FakeCloud()
+
+
+@pytest.fixture
+def backend(cloud):
+    from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+    container = mock.MagicMock(name='container', spec=Container)
+    container.get_object.side_effect = cloud.get_object
+    return ApacheLibcloudStorage(container=container)
+
+
+@pytest.fixture
+def cache_directory(tmpdir):
+    return str(tmpdir.join('cache'))
+
+
+@pytest.fixture
+def storage(backend, cache_directory):
+    from siilo.storages.caching import CachingStorage
+    return CachingStorage(
+        backend,
+        cache_directory=cache_directory,
+        max_size=10
+    )
+
+
+def read(storage, name, mode='rb'):
+    with storage.open(name, mode) as f:
+        return f.read()
+
+
+def test_repr(storage, backend, cache_directory):
+    assert repr(storage) == (
+        '<CachingStorage storage={0!r}, cache_directory={1!r}>'.format(
+            backend,
+            cache_directory
+        )
+    )
+
+
+def test_cache_directory_defaults_to_temporary_directory(backend):
+    from siilo.storages.caching import CachingStorage
+    storage = CachingStorage(backend)
+    assert os.path.isdir(storage.cache_directory)
+
+
+def test_repeated_reads_are_served_from_cache(storage, cloud):
+    cloud.put('a.txt', b'hello', etag='1')
+    assert read(storage, 'a.txt') == b'hello'
+    assert read(storage, 'a.txt') == b'hello'
+    assert read(storage, 'a.txt', 'r') == u'hello'
+    assert cloud.downloads == 1
+    assert (storage.hits, storage.misses) == (2, 1)
+    assert storage.size_in_cache == 5
+
+
+def test_changed_object_is_downloaded_again(storage, cloud):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    cloud.put('a.txt', b'world', etag='2')
+    assert read(storage, 'a.txt') == b'world'
+    assert cloud.downloads == 2
+    assert len(os.listdir(storage.cache_directory)) == 1
+
+
+def test_object_without_etag_is_revalidated_by_size_and_modified_time(
+    storage, cloud
+):
+    modified = {'last_modified': 'Thu, 15 Oct 2026 10:00:00 GMT'}
+    cloud.put('a.txt', b'hello', etag=None, extra=modified)
+    assert read(storage, 'a.txt') == b'hello'
+    assert read(storage, 'a.txt') == b'hello'
+    assert cloud.downloads == 1
+    cloud.put('a.txt', b'hi', etag=None, extra=modified)
+    assert read(storage, 'a.txt') == b'hi'
+    cloud.put('a.txt', b'yo', etag=None, extra={
+        'last_modified': 'Thu, 15 Oct 2026 10:00:01 GMT'
+    })
+    assert read(storage, 'a.txt') == b'yo'
+    assert cloud.downloads == 3
+
+
+def test_object_that_cannot_be_revalidated_is_not_cached(storage, cloud):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    cloud.put('a.txt', b'world', etag=None)
+    assert read(storage, 'a.txt') == b'world'
+    assert read(storage, 'a.txt') == b'world'
+    assert cloud.downloads == 3
+    assert storage.size_in_cache == 0
+    assert os.listdir(storage.cache_directory) == []
+
+
+def test_max_age_skips_revalidation(storage, cloud):
+    storage.max_age = 60
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    cloud.put('a.txt', b'world', etag='2')
+    assert read(storage, 'a.txt') == b'hello'
+
+
+def test_least_recently_used_files_are_evicted(storage, cloud):
+    cloud.put('a.txt', b'aaaa', etag='1')
+    cloud.put('b.txt', b'bbbb', etag='1')
+    cloud.put('c.txt', b'cccc', etag='1')
+    read(storage, 'a.txt')
+    read(storage, 'b.txt')
+    read(storage, 'a.txt')
+    read(storage, 'c.txt')
+    assert storage.size_in_cache == 8
+    assert cloud.downloads == 3
+    read(storage, 'a.txt')
+    assert cloud.downloads == 3
+    read(storage, 'b.txt')
+    assert cloud.downloads == 4
+
+
+def test_files_larger_than_cache_are_not_cached(storage, cloud):
+    cloud.put('a.txt', b'x' * 11, etag='1')
+    assert read(storage, 'a.txt') == b'x' * 11
+    assert storage.size_in_cache == 0
+    assert os.listdir(storage.cache_directory) == []
+
+
+def test_files_of_unknown_size_larger_than_cache_are_not_cached(
+    storage, cloud
+):
+    cloud.put('a.txt', b'x' * 11, etag='1')
+    cloud.objects['a.txt'].size = None
+    assert read(storage, 'a.txt') == b'x' * 11
+    assert storage.size_in_cache == 0
+    assert os.listdir(storage.cache_directory) == []
+
+
+def test_deleted_object_is_removed_from_cache(storage, cloud):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    del cloud.objects['a.txt']
+    with pytest.raises(FileNotFoundError):
+        read(storage, 'a.txt')
+    assert storage.size_in_cache == 0
+
+
+@pytest.mark.parametrize('mode', ['w', 'wb', 'a', 'r+'])
+def test_write_modes_remove_cached_copy(storage, backend, cloud, mode):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    with mock.patch.object(backend, 'open') as open_:
+        storage.open('a.txt', mode)
+    open_.assert_called_with('a.txt', mode=mode, encoding=None)
+    assert storage.size_in_cache == 0
+
+
+@pytest.mark.parametrize(('method_name', 'args'), [
+    ('delete', ('a.txt',)),
+    ('copy', ('b.txt', 'a.txt')),
+    ('move', ('a.txt', 'b.txt')),
+])
+def test_changing_methods_remove_cached_copy(
+    storage, backend, cloud, method_name, args
+):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    with mock.patch.object(backend, method_name) as method:
+        getattr(storage, method_name)(*args)
+    method.assert_called_with(*args)
+    assert storage.size_in_cache == 0
+
+
+@pytest.mark.parametrize(('method_name', 'args'), [
+    ('exists', ('a.txt',)),
+    ('size', ('a.txt',)),
+    ('url', ('a.txt',)),
+    ('walk', ('a/',)),
+    ('iterdir', ('a/',)),
+    ('iter_urls', (['a.txt'],)),
+])
+def test_other_methods_are_delegated(storage, backend, method_name, args):
+    with mock.patch.object(backend, method_name) as method:
+        assert getattr(storage, method_name)(*args) is method.return_value
+    method.assert_called_with(*args)
+
+
+def test_cache_is_reused_by_new_storage(
+    storage, backend, cloud, cache_directory
+):
+    from siilo.storages.caching import CachingStorage
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    storage = CachingStorage(backend, cache_directory=cache_directory)
+    assert storage.size_in_cache == 5
+    assert read(storage, 'a.txt') == b'hello'
+    assert cloud.downloads == 1
+
+
+def test_clear_cache(storage, cloud):
+    cloud.put('a.txt', b'hello', etag='1')
+    read(storage, 'a.txt')
+    storage.clear_cache()
+    assert storage.size_in_cache == 0
+    assert os.listdir(storage.cache_directory) == []
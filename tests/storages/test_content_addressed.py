@@ -0,0 +1,219 @@
+import hashlib
+import json
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.exceptions import ArgumentError, FileNotFoundError
+
+FOO_DIGEST = hashlib.sha256(b'foo').hexdigest()
+BAR_DIGEST = hashlib.sha256(b'bar').hexdigest()
+
+
+@pytest.fixture
+def backend(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(base_directory=str(tmpdir))
+
+
+@pytest.fixture
+def storage(backend):
+    from siilo.storages.content_addressed import ContentAddressedStorage
+    return ContentAddressedStorage(backend)
+
+
+def write(storage, name, data):
+    with storage.open(name, 'wb') as f:
+        f.write(data)
+
+
+def test_repr(storage, backend):
+    assert repr(storage) == (
+        '<ContentAddressedStorage storage={0!r}>'.format(backend)
+    )
+
+
+def test_constructor_raises_error_for_invalid_algorithm(backend):
+    from siilo.storages.content_addressed import ContentAddressedStorage
+    with pytest.raises(ArgumentError):
+        ContentAddressedStorage(backend, algorithm='foo')
+
+
+def test_write_stores_blob_under_digest(storage, tmpdir):
+    write(storage, 'a.txt', b'foo')
+    blob = tmpdir.join('blobs', FOO_DIGEST[:2], FOO_DIGEST)
+    assert blob.read_binary() == b'foo'
+    assert storage.index == {'a.txt': (FOO_DIGEST, 3)}
+
+
+def test_duplicate_write_doesnt_touch_backend(storage, backend):
+    write(storage, 'a.txt', b'foo')
+    with mock.patch.object(backend, 'open') as open_:
+        write(storage, 'b.txt', b'foo')
+    assert not open_.called
+    assert storage.index['b.txt'] == storage.index['a.txt']
+
+
+def test_text_mode_write_and_read(storage):
+    with storage.open('a.txt', 'w') as f:
+        f.write(u'foo')
+    assert storage.index['a.txt'] == (FOO_DIGEST, 3)
+    with storage.open('a.txt', 'r') as f:
+        assert f.read() == u'foo'
+
+
+def test_text_mode_read_uses_encoding(storage):
+    with storage.open('a.txt', 'w', encoding='latin-1') as f:
+        f.write(u'h\xe9llo')
+    with storage.open('a.txt', 'r', encoding='latin-1') as f:
+        assert f.read() == u'h\xe9llo'
+
+
+def test_write_spools_large_contents_to_disk(backend):
+    from siilo.storages.content_addressed import ContentAddressedStorage
+    storage = ContentAddressedStorage(backend, spool_size=4)
+    write(storage, 'a.txt', b'foo' * 1000)
+    with storage.open('a.txt') as f:
+        assert f.read() == b'foo' * 1000
+
+
+def test_open_raises_error_if_file_doesnt_exist(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.open('a.txt')
+
+
+def test_open_raises_error_for_unsupported_mode(storage):
+    with pytest.raises(ArgumentError):
+        storage.open('a.txt', 'a')
+
+
+def test_exists_size_url_and_walk(storage, backend):
+    backend.base_url = 'http://example.com/'
+    write(storage, 'b/c.txt', b'foo')
+    write(storage, 'a.txt', b'bar')
+    assert storage.exists('a.txt')
+    assert not storage.exists('c.txt')
+    assert storage.size('b/c.txt') == 3
+    assert storage.url('b/c.txt') == (
+        'http://example.com/blobs/{0}/{1}'.format(FOO_DIGEST[:2], FOO_DIGEST)
+    )
+    assert [(info.name, info.etag) for info in storage.walk()] == [
+        ('a.txt', BAR_DIGEST),
+        ('b/c.txt', FOO_DIGEST),
+    ]
+    assert [info.name for info in storage.iterdir()] == ['a.txt']
+
+
+def test_copy_and_move_only_change_index(storage, backend):
+    write(storage, 'a.txt', b'foo')
+    with mock.patch.object(backend, 'open') as open_:
+        storage.copy('a.txt', 'b.txt')
+        storage.move('b.txt', 'c.txt')
+    assert not open_.called
+    assert sorted(storage.index) == ['a.txt', 'c.txt']
+
+
+def test_move_to_same_name_keeps_file(storage):
+    write(storage, 'a.txt', b'foo')
+    storage.move('a.txt', 'a.txt')
+    assert storage.exists('a.txt')
+
+
+@pytest.mark.parametrize('method_name', ['copy', 'move'])
+def test_copy_and_move_raise_error_if_file_doesnt_exist(
+    storage, method_name
+):
+    with pytest.raises(FileNotFoundError):
+        getattr(storage, method_name)('a.txt', 'b.txt')
+
+
+def test_delete_raises_error_if_file_doesnt_exist(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.delete('a.txt')
+
+
+def test_delete_keeps_blob_until_garbage_is_collected(storage, backend):
+    write(storage, 'a.txt', b'foo')
+    write(storage, 'b.txt', b'foo')
+    write(storage, 'c.txt', b'bar')
+    storage.delete('a.txt')
+    storage.delete('c.txt')
+    blob_name = 'blobs/{0}/{1}'.format(FOO_DIGEST[:2], FOO_DIGEST)
+    garbage_name = 'blobs/{0}/{1}'.format(BAR_DIGEST[:2], BAR_DIGEST)
+    assert backend.exists(garbage_name)
+    assert storage.collect_garbage() == 1
+    assert backend.exists(blob_name)
+    assert not backend.exists(garbage_name)
+    assert storage.collect_garbage() == 0
+
+
+def test_rewriting_garbage_reuses_blob(storage, backend):
+    write(storage, 'a.txt', b'foo')
+    storage.delete('a.txt')
+    with mock.patch.object(backend, 'open') as open_:
+        write(storage, 'b.txt', b'foo')
+    assert not open_.called
+    assert storage.collect_garbage() == 0
+    with storage.open('b.txt') as f:
+        assert f.read() == b'foo'
+
+
+def test_overwriting_file_releases_old_blob(storage):
+    write(storage, 'a.txt', b'foo')
+    write(storage, 'a.txt', b'bar')
+    assert storage.collect_garbage() == 1
+
+
+def test_save_and_load_index(storage, backend, tmpdir):
+    from siilo.storages.content_addressed import ContentAddressedStorage
+    write(storage, 'a.txt', b'foo')
+    storage.save_index()
+    assert json.loads(tmpdir.join('index.json').read()) == {
+        'files': {'a.txt': [FOO_DIGEST, 3]}
+    }
+    reloaded = ContentAddressedStorage(backend)
+    assert reloaded.index == {'a.txt': (FOO_DIGEST, 3)}
+    with mock.patch.object(backend, 'open') as open_:
+        write(reloaded, 'b.txt', b'foo')
+    assert not open_.called
+
+
+def test_full_garbage_collection_deletes_unindexed_blobs(storage, backend):
+    from siilo.storages.content_addressed import ContentAddressedStorage
+    write(storage, 'a.txt', b'foo')
+    storage.save_index()
+    write(storage, 'b.txt', b'bar')
+    reloaded = ContentAddressedStorage(backend)
+    assert reloaded.collect_garbage() == 0
+    assert reloaded.collect_garbage(full=True) == 1
+    assert [info.name for info in backend.walk('blobs/')] == [
+        'blobs/{0}/{1}'.format(FOO_DIGEST[:2], FOO_DIGEST)
+    ]
+
+
+def test_full_garbage_collection_keeps_blob_being_uploaded(storage, backend):
+    uploading = threading.Event()
+    released = threading.Event()
+    open_ = backend.open
+
+    def open_slowly(name, mode='rb'):
+        f = open_(name, mode)
+        if 'w' in mode:
+            uploading.set()
+            released.wait(5)
+        return f
+
+    writer = threading.Thread(target=write, args=(storage, 'a.txt', b'foo'))
+    with mock.patch.object(backend, 'open', side_effect=open_slowly):
+        writer.start()
+        assert uploading.wait(5)
+        assert storage.collect_garbage(full=True) == 0
+        released.set()
+        writer.join(5)
+    assert storage.index['a.txt'] == (FOO_DIGEST, 3)
+    with storage.open('a.txt') as f:
+        assert f.read() == b'foo'
@@ -1,9 +1,15 @@
+from datetime import datetime
 import io
 import os
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 import pytest
 
 from siilo.exceptions import (
+    ArgumentError,
     FileNotAccessibleViaURLError,
     FileNotFoundError,
     FileNotWithinStorageError,
@@ -157,3 +163,459 @@ def test_url_raises_error_if_base_url_not_set(storage):
     with pytest.raises(FileNotAccessibleViaURLError) as excinfo:
         storage.url('file.txt')
     assert excinfo.value.name == 'file.txt'
+
+
+@pytest.fixture
+def tree(tmpdir):
+    tmpdir.join('a.txt').write('a')
+    tmpdir.join('a-b.txt').write('ab')
+    tmpdir.join('a', 'x.txt').write('ax', ensure=True)
+    tmpdir.join('a', 'y', 'z.txt').write('ayz', ensure=True)
+    tmpdir.join('b.txt').write('b')
+    tmpdir.join('empty').ensure(dir=True)
+    return tmpdir
+
+
+def test_walk_yields_all_files_in_lexicographical_order(storage, tree):
+    names = [info.name for info in storage.walk()]
+    assert names == ['a-b.txt', 'a.txt', 'a/x.txt', 'a/y/z.txt', 'b.txt']
+    assert names == sorted(names)
+
+
+@pytest.mark.parametrize(
+    ('prefix', 'names'),
+    [
+        ('a/', ['a/x.txt', 'a/y/z.txt']),
+        ('a', ['a-b.txt', 'a.txt', 'a/x.txt', 'a/y/z.txt']),
+        ('a/y', ['a/y/z.txt']),
+        ('c', []),
+        ('c/', []),
+        ('a.txt/', []),
+    ]
+)
+def test_walk_yields_files_starting_with_prefix(storage, tree, prefix, names):
+    assert [info.name for info in storage.walk(prefix)] == names
+
+
+def test_walk_returns_file_info(storage, tree):
+    from siilo.storages.base import FileInfo
+    info = next(storage.walk('a/y/'))
+    mtime = os.path.getmtime(str(tree.join('a', 'y', 'z.txt')))
+    assert info == FileInfo(
+        name='a/y/z.txt',
+        size=3,
+        modified=datetime.utcfromtimestamp(mtime),
+        etag=None
+    )
+
+
+def test_walk_raises_error_if_prefix_not_within_storage(storage):
+    with pytest.raises(FileNotWithinStorageError):
+        list(storage.walk('../foo/'))
+
+
+@pytest.mark.parametrize(
+    ('prefix', 'names'),
+    [
+        ('', ['a-b.txt', 'a.txt', 'b.txt']),
+        ('a/', ['a/x.txt']),
+        ('a', ['a-b.txt', 'a.txt']),
+        ('c/', []),
+    ]
+)
+def test_iterdir_yields_files_directly_within_directory(
+    storage, tree, prefix, names
+):
+    assert [info.name for info in storage.iterdir(prefix)] == names
+
+
+def test_delete_many_removes_the_files(storage, tmpdir):
+    files = [tmpdir.join('foo').ensure(), tmpdir.join('bar', 'baz').ensure()]
+    assert storage.delete_many(['foo', 'bar/baz']) == {
+        'foo': None,
+        'bar/baz': None,
+    }
+    assert not any(file_.check() for file_ in files)
+
+
+def test_delete_many_returns_errors(storage):
+    results = storage.delete_many(['foo', '../foo'])
+    assert isinstance(results['foo'], FileNotFoundError)
+    assert results['foo'].name == 'foo'
+    assert isinstance(results['../foo'], FileNotWithinStorageError)
+
+
+@pytest.mark.parametrize('method_name', ['copy', 'move'])
+def test_copy_and_move_create_destination(storage, tmpdir, method_name):
+    tmpdir.join('foo').write('xyzzy')
+    getattr(storage, method_name)('foo', 'bar/baz')
+    assert tmpdir.join('bar', 'baz').read() == 'xyzzy'
+
+
+def test_copy_keeps_source(storage, tmpdir):
+    tmpdir.join('foo').write('xyzzy')
+    storage.copy('foo', 'bar')
+    assert tmpdir.join('foo').check()
+
+
+def test_move_removes_source(storage, tmpdir):
+    tmpdir.join('foo').write('xyzzy')
+    tmpdir.join('bar').write('old')
+    storage.move('foo', 'bar')
+    assert not tmpdir.join('foo').check()
+    assert tmpdir.join('bar').read() == 'xyzzy'
+
+
+@pytest.mark.parametrize('method_name', ['copy', 'move'])
+def test_copy_and_move_raise_error_if_file_doesnt_exist(
+    storage, method_name
+):
+    with pytest.raises(FileNotFoundError) as excinfo:
+        getattr(storage, method_name)('foo', 'bar')
+    assert excinfo.value.name == 'foo'
+
+
+@pytest.mark.parametrize('method_name', ['copy', 'move'])
+@pytest.mark.parametrize(
+    ('src', 'dst'), [('../foo', 'bar'), ('foo', '../bar')]
+)
+def test_copy_and_move_raise_error_if_file_not_within_storage(
+    storage, tmpdir, method_name, src, dst
+):
+    tmpdir.join('foo').ensure()
+    with pytest.raises(FileNotWithinStorageError):
+        getattr(storage, method_name)(src, dst)
+
+
+def test_mmap_returns_read_only_view_of_file(storage, tmpdir):
+    tmpdir.join('foo').write_binary(b'xyzzy')
+    view = storage.mmap('foo')
+    assert view.readonly
+    assert view[1:3].tobytes() == b'yz'
+    assert bytes(view) == b'xyzzy'
+
+
+def test_mmap_returns_empty_view_for_empty_file(storage, tmpdir):
+    tmpdir.join('foo').ensure()
+    assert bytes(storage.mmap('foo')) == b''
+
+
+def test_mmap_raises_error_if_file_doesnt_exist(storage):
+    with pytest.raises(FileNotFoundError) as excinfo:
+        storage.mmap('foo')
+    assert excinfo.value.name == 'foo'
+
+
+def test_mmap_raises_error_if_file_not_within_storage(storage):
+    with pytest.raises(FileNotWithinStorageError):
+        storage.mmap('../foo')
+
+
+@pytest.fixture
+def socket_pair(request):
+    import socket
+    pair = socket.socketpair()
+
+    def close():
+        for sock in pair:
+            sock.close()
+    request.addfinalizer(close)
+    return pair
+
+
+def _receive_all(sock):
+    chunks = []
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return b''.join(chunks)
+        chunks.append(data)
+
+
+@pytest.mark.parametrize(('offset', 'count', 'expected'), [
+    (0, None, b'0123456789'),
+    (3, None, b'3456789'),
+    (3, 4, b'3456'),
+    (8, 10, b'89'),
+])
+def test_send_to_sends_file_to_socket(
+    storage, tmpdir, socket_pair, offset, count, expected
+):
+    tmpdir.join('foo').write_binary(b'0123456789')
+    sender, receiver = socket_pair
+    assert storage.send_to('foo', sender, offset, count) == len(expected)
+    sender.close()
+    assert _receive_all(receiver) == expected
+
+
+def test_send_to_falls_back_to_sendall(storage, tmpdir):
+    tmpdir.join('foo').write_binary(b'0123456789' * 10000)
+    sock = mock.Mock(spec=['sendall'])
+    assert storage.send_to('foo', sock, 5, 70000) == 70000
+    sent = b''.join(call[0][0] for call in sock.sendall.call_args_list)
+    assert sent == (b'0123456789' * 10000)[5:70005]
+
+
+def test_send_to_raises_error_if_file_doesnt_exist(storage, socket_pair):
+    with pytest.raises(FileNotFoundError) as excinfo:
+        storage.send_to('foo', socket_pair[0])
+    assert excinfo.value.name == 'foo'
+
+
+@pytest.fixture
+def atomic_storage(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(base_directory=str(tmpdir), atomic_writes=True)
+
+
+def test_atomic_writes_are_disabled_by_default(storage):
+    assert storage.atomic_writes is False
+    assert storage.fsync is True
+    assert storage.fsync_directory is True
+
+
+@pytest.mark.parametrize('mode', ['w', 'wb', 'w+'])
+def test_atomic_write_replaces_file_on_close(atomic_storage, tmpdir, mode):
+    tmpdir.join('foo').write('old')
+    f = atomic_storage.open('foo', mode)
+    f.write('new' if 'b' not in mode else b'new')
+    assert tmpdir.join('foo').read() == 'old'
+    f.close()
+    assert tmpdir.join('foo').read() == 'new'
+    assert tmpdir.listdir() == [tmpdir.join('foo')]
+
+
+def test_atomic_write_keeps_file_name(atomic_storage, tmpdir):
+    with atomic_storage.open('foo', 'w') as f:
+        assert f.name == str(tmpdir.join('foo'))
+        assert not f.closed
+    assert f.closed
+
+
+def test_atomic_write_is_discarded_on_error(atomic_storage, tmpdir):
+    tmpdir.join('foo').write('old')
+    with pytest.raises(ValueError):
+        with atomic_storage.open('foo', 'w') as f:
+            f.write(u'new')
+            raise ValueError
+    assert tmpdir.join('foo').read() == 'old'
+    assert tmpdir.listdir() == [tmpdir.join('foo')]
+
+
+def test_atomic_copy_replaces_destination_on_completion(atomic_storage,
+                                                        tmpdir):
+    from siilo._compat import replace
+    tmpdir.join('src').write('new')
+    tmpdir.join('dst').write('old')
+    with mock.patch(
+        'siilo.storages.filesystem.replace',
+        wraps=replace
+    ) as replace_mock:
+        atomic_storage.copy('src', 'dst')
+    assert replace_mock.call_args[0][1] == str(tmpdir.join('dst'))
+    assert tmpdir.join('dst').read() == 'new'
+
+
+def test_atomic_copy_is_discarded_on_error(atomic_storage, tmpdir):
+    tmpdir.join('src').write('new')
+    tmpdir.join('dst').write('old')
+    with mock.patch('shutil.copyfileobj', side_effect=IOError):
+        with pytest.raises(IOError):
+            atomic_storage.copy('src', 'dst')
+    assert tmpdir.join('dst').read() == 'old'
+    assert sorted(tmpdir.listdir()) == [tmpdir.join('dst'), tmpdir.join('src')]
+
+
+def test_atomic_write_last_writer_wins(atomic_storage, tmpdir):
+    first = atomic_storage.open('foo', 'w')
+    second = atomic_storage.open('foo', 'w')
+    first.write(u'first')
+    second.write(u'second')
+    second.close()
+    first.close()
+    assert tmpdir.join('foo').read() == 'first'
+
+
+def test_atomic_write_honors_umask(atomic_storage, tmpdir):
+    old_umask = os.umask(0o022)
+    try:
+        with atomic_storage.open('foo', 'w') as f:
+            f.write(u'foo')
+    finally:
+        os.umask(old_umask)
+    assert tmpdir.join('foo').stat().mode & 0o777 == 0o644
+
+
+@pytest.mark.parametrize(('fsync', 'fsync_directory', 'expected'), [
+    (True, True, 2),
+    (True, False, 1),
+    (False, True, 1),
+    (False, False, 0),
+])
+def test_atomic_write_fsync_can_be_disabled(
+    atomic_storage, fsync, fsync_directory, expected
+):
+    atomic_storage.fsync = fsync
+    atomic_storage.fsync_directory = fsync_directory
+    with mock.patch('os.fsync') as fsync_mock:
+        with atomic_storage.open('foo', 'w') as f:
+            f.write(u'foo')
+    assert fsync_mock.call_count == expected
+
+
+@pytest.mark.parametrize('mode', ['a', 'r+'])
+def test_atomic_writes_dont_apply_to_update_modes(
+    atomic_storage, tmpdir, mode
+):
+    tmpdir.join('foo').write('old')
+    f = atomic_storage.open('foo', mode)
+    f.write(u'new')
+    f.flush()
+    assert 'new' in tmpdir.join('foo').read()
+    f.close()
+
+
+def test_open_caches_existing_directories(storage, tmpdir):
+    storage.open('foo/bar', 'w').close()
+    assert storage.directory_cache.get(str(tmpdir.join('foo'))) is True
+    with mock.patch('os.makedirs') as makedirs:
+        storage.open('foo/baz', 'w').close()
+    assert not makedirs.called
+
+
+def test_open_recreates_removed_cached_directory(storage, tmpdir):
+    storage.open('foo/bar', 'w').close()
+    tmpdir.join('foo').remove()
+    storage.open('foo/bar', 'w').close()
+    assert tmpdir.join('foo', 'bar').check()
+
+
+@pytest.mark.parametrize('method', ['copy', 'move'])
+def test_copy_and_move_recreate_removed_cached_directory(storage, tmpdir,
+                                                         method):
+    tmpdir.join('src').write('data')
+    storage.open('foo/bar', 'w').close()
+    tmpdir.join('foo').remove()
+    getattr(storage, method)('src', 'foo/baz')
+    assert tmpdir.join('foo', 'baz').read() == 'data'
+
+
+def test_invalidate_directory_cache(storage):
+    storage.open('foo/bar', 'w').close()
+    storage.invalidate_directory_cache()
+    assert len(storage.directory_cache) == 0
+    with mock.patch('os.makedirs') as makedirs:
+        storage.open('foo/baz', 'w').close()
+    assert makedirs.called
+
+
+def test_directory_cache_can_be_disabled(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    storage = FileSystemStorage(
+        base_directory=str(tmpdir),
+        directory_cache_size=None
+    )
+    assert storage.directory_cache is None
+    storage.open('foo/bar', 'w').close()
+    storage.invalidate_directory_cache()
+    with mock.patch('os.makedirs') as makedirs:
+        storage.open('foo/baz', 'w').close()
+    assert makedirs.called
+
+
+def test_sibling_directory_is_not_within_storage(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    storage = FileSystemStorage(base_directory=str(tmpdir.join('uploads')))
+    tmpdir.join('uploads2', 'foo').ensure()
+    with pytest.raises(FileNotWithinStorageError):
+        storage.exists('../uploads2/foo')
+
+
+def test_base_directory_itself_is_within_storage(storage, tmpdir):
+    assert storage._compute_path('foo/..') == str(tmpdir)
+
+
+def test_compute_path_is_cached(storage, tmpdir):
+    path = storage._compute_path('foo')
+    assert storage.path_cache.get('foo') == path == str(tmpdir.join('foo'))
+
+
+def test_compute_path_doesnt_cache_names_not_within_storage(storage):
+    with pytest.raises(FileNotWithinStorageError):
+        storage._compute_path('../foo')
+    assert len(storage.path_cache) == 0
+
+
+def test_changing_base_directory_clears_path_cache(storage, tmpdir):
+    storage._compute_path('foo')
+    storage.base_directory = str(tmpdir.join('bar'))
+    assert storage._compute_path('foo') == str(tmpdir.join('bar', 'foo'))
+
+
+def test_path_cache_can_be_disabled(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    storage = FileSystemStorage(
+        base_directory=str(tmpdir),
+        path_cache_size=None
+    )
+    assert storage.path_cache is None
+    assert storage._compute_path('foo') == str(tmpdir.join('foo'))
+
+
+requires_dir_fd = pytest.mark.skipif(
+    not getattr(os, 'supports_dir_fd', None) or
+    os.open not in os.supports_dir_fd,
+    reason='dir_fd is not supported'
+)
+
+
+@pytest.fixture
+def dir_fd_storage(request, tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    storage = FileSystemStorage(base_directory=str(tmpdir), use_dir_fd=True)
+    request.addfinalizer(storage.close)
+    return storage
+
+
+@requires_dir_fd
+def test_dir_fd_storage_resolves_names_relative_to_directory(
+    dir_fd_storage, tmpdir
+):
+    with dir_fd_storage.open('foo/bar', 'w') as f:
+        f.write(u'xyzzy')
+    renamed = tmpdir.dirpath(tmpdir.basename + '-renamed')
+    tmpdir.rename(renamed)
+    try:
+        assert dir_fd_storage.exists('foo/bar')
+        assert dir_fd_storage.size('foo/bar') == 5
+        with dir_fd_storage.open('foo/bar') as f:
+            assert f.read() == b'xyzzy'
+        dir_fd_storage.delete('foo/bar')
+        assert not renamed.join('foo', 'bar').check()
+    finally:
+        renamed.rename(tmpdir)
+
+
+@requires_dir_fd
+def test_dir_fd_storage_raises_error_if_file_doesnt_exist(dir_fd_storage):
+    assert not dir_fd_storage.exists('foo')
+    with pytest.raises(FileNotFoundError):
+        dir_fd_storage.size('foo')
+    with pytest.raises(FileNotFoundError):
+        dir_fd_storage.delete('foo')
+
+
+@requires_dir_fd
+def test_close_closes_directory(dir_fd_storage):
+    dir_fd = dir_fd_storage._dir_fd
+    dir_fd_storage.close()
+    assert dir_fd_storage._dir_fd is None
+    with pytest.raises(OSError):
+        os.fstat(dir_fd)
+
+
+def test_use_dir_fd_raises_error_if_not_supported(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    with mock.patch('os.supports_dir_fd', set(), create=True):
+        with pytest.raises(ArgumentError):
+            FileSystemStorage(base_directory=str(tmpdir), use_dir_fd=True)
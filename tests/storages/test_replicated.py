@@ -0,0 +1,352 @@
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.exceptions import (
+    ArgumentError,
+    FileNotFoundError,
+    ReplicationError,
+)
+
+
+@pytest.fixture
+def replicas(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return [
+        FileSystemStorage(
+            base_directory=str(tmpdir.mkdir(region)),
+            base_url='http://{0}.example.com/'.format(region)
+        )
+        for region in ('eu', 'us', 'ap')
+    ]
+
+
+@pytest.fixture
+def storage(replicas):
+    from siilo.storages.replicated import ReplicatedStorage
+    return ReplicatedStorage(replicas)
+
+
+def write(storage, name, data):
+    with storage.open(name, 'wb') as f:
+        f.write(data)
+
+
+def read(storage, name):
+    with storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def failing(replica, error=None):
+    """Return a mock of ``replica`` whose methods raise ``error``."""
+    failing = mock.Mock(wraps=replica)
+    error = IOError('unavailable') if error is None else error
+    for method in ('copy', 'delete', 'delete_many', 'exists', 'move',
+                   'open', 'size'):
+        getattr(failing, method).side_effect = error
+    return failing
+
+
+def test_repr(storage, replicas):
+    assert repr(storage) == (
+        '<ReplicatedStorage storages={0!r}>'.format(replicas)
+    )
+
+
+def test_constructor_requires_storages():
+    from siilo.storages.replicated import ReplicatedStorage
+    with pytest.raises(ArgumentError):
+        ReplicatedStorage([])
+
+
+@pytest.mark.parametrize('write_quorum', [0, 4])
+def test_constructor_raises_error_for_invalid_write_quorum(replicas,
+                                                           write_quorum):
+    from siilo.storages.replicated import ReplicatedStorage
+    with pytest.raises(ArgumentError):
+        ReplicatedStorage(replicas, write_quorum=write_quorum)
+
+
+def test_write_quorum_defaults_to_all_replicas(storage):
+    assert storage.write_quorum == 3
+
+
+def test_write_is_replicated_to_all_replicas(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    assert [read(replica, 'a.txt') for replica in replicas] == [
+        b'hello'
+    ] * 3
+
+
+def test_write_in_text_mode(storage, replicas):
+    with storage.open('a.txt', 'w', encoding='utf-8') as f:
+        f.write(u'h\xe9llo')
+    assert read(replicas[2], 'a.txt') == u'h\xe9llo'.encode('utf-8')
+
+
+def test_large_write_is_spooled_to_disk(replicas):
+    from siilo.storages.replicated import ReplicatedStorage
+    storage = ReplicatedStorage(replicas, spool_size=10)
+    data = b'0123456789' * 1000
+    write(storage, 'a.txt', data)
+    assert [read(replica, 'a.txt') for replica in replicas] == [data] * 3
+
+
+def test_open_raises_error_for_invalid_mode(storage):
+    with pytest.raises(ArgumentError):
+        storage.open('a.txt', 'ab')
+
+
+def test_write_raises_error_if_quorum_is_not_reached(storage, replicas):
+    storage.storages[1] = failing(replicas[1])
+    with pytest.raises(ReplicationError) as excinfo:
+        write(storage, 'a.txt', b'hello')
+    assert excinfo.value.succeeded == 2
+    assert excinfo.value.quorum == 3
+    (replica, exc), = excinfo.value.errors
+    assert replica is storage.storages[1]
+    assert isinstance(exc, IOError)
+
+
+def test_write_succeeds_with_quorum_of_replicas(replicas):
+    from siilo.storages.replicated import ReplicatedStorage
+    storage = ReplicatedStorage(
+        [replicas[0], failing(replicas[1]), replicas[2]],
+        write_quorum=2
+    )
+    write(storage, 'a.txt', b'hello')
+    assert storage.wait(5)
+    assert replicas[0].exists('a.txt')
+    assert not replicas[1].exists('a.txt')
+    assert replicas[2].exists('a.txt')
+
+
+def test_write_returns_at_quorum_and_finishes_in_background(replicas):
+    from siilo.storages.replicated import ReplicatedStorage
+    released = threading.Event()
+    slow = mock.Mock(wraps=replicas[1])
+
+    def open_slowly(name, mode):
+        released.wait(5)
+        return replicas[1].open(name, mode)
+
+    slow.open.side_effect = open_slowly
+    storage = ReplicatedStorage(
+        [replicas[0], slow, replicas[2]],
+        write_quorum=2
+    )
+    write(storage, 'a.txt', b'hello')
+    assert not replicas[1].exists('a.txt')
+    assert not storage.wait(0.01)
+    released.set()
+    assert storage.wait(5)
+    assert read(replicas[1], 'a.txt') == b'hello'
+    assert storage.lagging_failures == 0
+
+
+def test_failures_after_quorum_are_counted(replicas):
+    from siilo.storages.replicated import ReplicatedStorage
+    released = threading.Event()
+    slow = mock.Mock(wraps=replicas[1])
+
+    def fail_slowly(name, mode):
+        released.wait(5)
+        raise IOError('unavailable')
+
+    slow.open.side_effect = fail_slowly
+    storage = ReplicatedStorage(
+        [replicas[0], slow, replicas[2]],
+        write_quorum=2
+    )
+    write(storage, 'a.txt', b'hello')
+    released.set()
+    assert storage.wait(5)
+    assert storage.lagging_failures == 1
+
+
+def test_copy_and_move_are_replicated(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    storage.copy('a.txt', 'b.txt')
+    storage.move('b.txt', 'c.txt')
+    for replica in replicas:
+        assert replica.exists('a.txt')
+        assert not replica.exists('b.txt')
+        assert read(replica, 'c.txt') == b'hello'
+
+
+def test_copy_raises_file_not_found_if_missing_from_all(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.copy('missing.txt', 'b.txt')
+
+
+def test_delete_is_replicated(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    storage.delete('a.txt')
+    assert not any(replica.exists('a.txt') for replica in replicas)
+
+
+def test_delete_succeeds_if_file_is_missing_from_some_replicas(storage,
+                                                               replicas):
+    write(replicas[0], 'a.txt', b'hello')
+    storage.delete('a.txt')
+    assert not replicas[0].exists('a.txt')
+
+
+def test_delete_raises_file_not_found_if_missing_from_all(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.delete('missing.txt')
+
+
+def test_delete_raises_error_if_quorum_is_not_reached(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    storage.storages[0] = failing(replicas[0])
+    with pytest.raises(ReplicationError):
+        storage.delete('a.txt')
+
+
+def test_delete_many(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    write(replicas[1], 'b.txt', b'hello')
+    storage.storages[2] = failing(replicas[2])
+    results = storage.delete_many(iter(['a.txt', 'b.txt', 'missing.txt']))
+    assert isinstance(results['a.txt'], ReplicationError)
+    assert results['a.txt'].succeeded == 2
+    assert isinstance(results['missing.txt'], ReplicationError)
+    assert not replicas[1].exists('b.txt')
+
+
+def test_delete_many_reports_missing_files(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    write(replicas[0], 'b.txt', b'hello')
+    results = storage.delete_many(['a.txt', 'b.txt', 'missing.txt'])
+    assert results['a.txt'] is None
+    assert results['b.txt'] is None
+    assert isinstance(results['missing.txt'], FileNotFoundError)
+
+
+def test_reads_measure_latency_of_replicas(storage):
+    write(storage, 'a.txt', b'hello')
+    assert storage.latencies == [None, None, None]
+    for _ in range(3):
+        assert storage.exists('a.txt')
+    assert all(latency is not None for latency in storage.latencies)
+
+
+def test_reads_go_to_fastest_replica(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    storage._latencies = [0.3, 0.1, 0.2]
+    storage.storages[1] = mock.Mock(wraps=replicas[1])
+    assert storage.size('a.txt') == 5
+    assert read(storage, 'a.txt') == b'hello'
+    assert storage.storages[1].size.called
+    assert storage.storages[1].open.called
+
+
+def test_latency_is_moving_average(storage):
+    storage._measure(0, 1.0)
+    storage._measure(0, 2.0)
+    assert storage.latencies[0] == pytest.approx(1.2)
+
+
+def test_read_falls_back_to_next_replica_on_error(storage, replicas):
+    write(storage, 'a.txt', b'hello')
+    storage._latencies = [0.1, 0.2, 0.3]
+    storage.storages[0] = failing(replicas[0])
+    assert storage.exists('a.txt')
+    assert read(storage, 'a.txt') == b'hello'
+    assert storage._ranked() == [1, 2, 0]
+
+
+def test_failed_replica_is_healthy_again_after_retry_after(storage,
+                                                           replicas):
+    write(storage, 'a.txt', b'hello')
+    storage._latencies = [0.1, 0.2, 0.3]
+    storage.retry_after = 0
+    storage.storages[0] = failing(replicas[0])
+    assert storage.exists('a.txt')
+    assert storage._ranked() == [0, 1, 2]
+
+
+def test_read_raises_error_of_first_replica_if_all_fail(storage, replicas):
+    storage._latencies = [0.1, 0.2, 0.3]
+    storage.storages = [
+        failing(replica, IOError(index))
+        for index, replica in enumerate(replicas)
+    ]
+    with pytest.raises(IOError) as excinfo:
+        storage.size('a.txt')
+    assert excinfo.value.args == (0,)
+
+
+def test_read_raises_file_not_found_if_missing_from_all(storage, replicas):
+    storage._latencies = [0.1, 0.2, 0.3]
+    storage.storages[2] = mock.Mock(wraps=replicas[2])
+    with pytest.raises(FileNotFoundError):
+        storage.open('missing.txt', 'rb')
+    with pytest.raises(FileNotFoundError):
+        storage.size('missing.txt')
+    assert not storage.exists('missing.txt')
+    assert storage.storages[2].open.called
+    assert storage._ranked() == [0, 1, 2]
+
+
+def test_read_falls_back_when_file_is_missing_from_replica(
+    storage, replicas
+):
+    write(replicas[1], 'a.txt', b'hello')
+    storage._latencies = [0.1, 0.2, 0.3]
+    assert storage.exists('a.txt')
+    assert storage.size('a.txt') == 5
+    assert read(storage, 'a.txt') == b'hello'
+
+
+def test_read_raises_error_if_file_is_missing_or_replicas_fail(storage,
+                                                               replicas):
+    storage._latencies = [0.1, 0.2, 0.3]
+    storage.storages[1] = failing(replicas[1])
+    with pytest.raises(IOError):
+        storage.exists('missing.txt')
+
+
+def test_lagging_replica_serves_read_after_quorum_write(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    from siilo.storages.replicated import ReplicatedStorage
+    fast = FileSystemStorage(base_directory=str(tmpdir.mkdir('fast')))
+    lagging = FileSystemStorage(base_directory=str(tmpdir.mkdir('lag')))
+    released = threading.Event()
+    slow = mock.Mock(wraps=lagging)
+
+    def open_slowly(name, mode='rb', *args, **kwargs):
+        if 'w' in mode:
+            released.wait(5)
+        return lagging.open(name, mode)
+
+    slow.open.side_effect = open_slowly
+    storage = ReplicatedStorage([slow, fast], write_quorum=1)
+    storage._latencies = [0.1, 0.2]
+    write(storage, 'a.txt', b'hello')
+    assert not lagging.exists('a.txt')
+    assert storage.exists('a.txt')
+    assert storage.size('a.txt') == 5
+    assert read(storage, 'a.txt') == b'hello'
+    released.set()
+    assert storage.wait(5)
+    assert read(lagging, 'a.txt') == b'hello'
+
+
+def test_walk_and_iterdir_use_fastest_replica(storage, replicas):
+    write(replicas[1], 'a.txt', b'hello')
+    storage._latencies = [0.3, 0.1, 0.2]
+    assert [info.name for info in storage.walk()] == ['a.txt']
+    assert [info.name for info in storage.iterdir()] == ['a.txt']
+
+
+def test_urls_are_built_by_first_replica(storage):
+    assert storage.url('a.txt') == 'http://eu.example.com/a.txt'
+    assert list(storage.iter_urls(['a.txt'])) == [
+        'http://eu.example.com/a.txt'
+    ]
@@ -0,0 +1,317 @@
+import asyncio
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.exceptions import ArgumentError, FileNotFoundError, SiiloError
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestThreadedAsyncStorage(object):
+    @pytest.fixture
+    def storage(self, tmpdir):
+        from siilo.storages.filesystem import FileSystemStorage
+        return FileSystemStorage(
+            base_directory=str(tmpdir),
+            base_url='http://example.com/'
+        )
+
+    @pytest.fixture
+    def async_storage(self, storage):
+        from siilo.aio import ThreadedAsyncStorage
+        return ThreadedAsyncStorage(storage, max_workers=2)
+
+    def test_repr(self, async_storage, storage):
+        assert repr(async_storage) == (
+            '<ThreadedAsyncStorage storage={0!r}>'.format(storage)
+        )
+
+    def test_writes_and_reads_file(self, async_storage, tmpdir):
+        async def main():
+            async with async_storage:
+                async with await async_storage.open('foo', 'wb') as f:
+                    await f.write(b'xyzzy')
+                async with await async_storage.open('foo') as f:
+                    await f.seek(1)
+                    return await f.read(3), await f.tell()
+        assert run(main()) == (b'yzz', 4)
+        assert tmpdir.join('foo').read() == 'xyzzy'
+
+    def test_exists_size_and_delete(self, async_storage, tmpdir):
+        tmpdir.join('foo').write('xyzzy')
+
+        async def main():
+            async with async_storage:
+                size = await async_storage.size('foo')
+                await async_storage.delete('foo')
+                return size, await async_storage.exists('foo')
+        assert run(main()) == (5, False)
+
+    def test_url(self, async_storage):
+        url = run(async_storage.url('foo'))
+        assert url == 'http://example.com/foo'
+
+    def test_propagates_errors(self, async_storage):
+        with pytest.raises(FileNotFoundError):
+            run(async_storage.size('foo'))
+
+    def test_runs_at_most_max_workers_calls_at_a_time(self, async_storage):
+        import threading
+        import time
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def exists(name):
+            with lock:
+                running.append(name)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(name)
+            return True
+
+        async_storage.storage.exists = exists
+
+        async def main():
+            async with async_storage:
+                return await asyncio.gather(*[
+                    async_storage.exists(str(i)) for i in range(10)
+                ])
+        assert run(main()) == [True] * 10
+        assert max(peak) <= 2
+
+    def test_close_shuts_down_executor(self, async_storage):
+        async def main():
+            await async_storage.exists('foo')
+            executor = async_storage._executor
+            await async_storage.close()
+            return executor
+        executor = run(main())
+        assert async_storage._executor is None
+        with pytest.raises(RuntimeError):
+            executor.submit(lambda: None)
+
+
+class TestToAsync(object):
+    def test_returns_async_file_system_storage(self, tmpdir):
+        from siilo.aio import AsyncFileSystemStorage, to_async
+        from siilo.storages.filesystem import FileSystemStorage
+        storage = FileSystemStorage(base_directory=str(tmpdir))
+        async_storage = to_async(storage, max_workers=4)
+        assert isinstance(async_storage, AsyncFileSystemStorage)
+        assert async_storage.max_workers == 4
+
+    def test_returns_async_amazon_s3_storage(self, s3_storage):
+        from siilo.aio import AsyncAmazonS3Storage, to_async
+        async_storage = to_async(s3_storage)
+        assert isinstance(async_storage, AsyncAmazonS3Storage)
+        assert async_storage.storage is s3_storage
+
+    def test_returns_threaded_async_storage_for_other_storages(self):
+        from siilo.aio import ThreadedAsyncStorage, to_async
+        storage = mock.Mock()
+        assert type(to_async(storage)) is ThreadedAsyncStorage
+
+
+@pytest.fixture
+def s3_storage():
+    from tests.storages.test_amazon_s3 import TestAmazonS3Storage
+    return TestAmazonS3Storage.make_storage()
+
+
+class FakeContent(object):
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, size=-1):
+        if size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+class FakeResponse(object):
+    def __init__(self, status=200, headers=None, data=b''):
+        self.status = status
+        self.headers = headers or {}
+        self.content = FakeContent(data)
+        self.release = mock.Mock()
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+
+    async def request(self, method, url, **kwargs):
+        if 'data' in kwargs:
+            chunks = [chunk async for chunk in kwargs['data']]
+            kwargs['data'] = b''.join(chunks)
+        self.requests.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+class TestAsyncAmazonS3Storage(object):
+    @pytest.fixture
+    def session(self):
+        return FakeSession()
+
+    @pytest.fixture
+    def async_storage(self, s3_storage, session):
+        from siilo.aio import AsyncAmazonS3Storage
+        return AsyncAmazonS3Storage(s3_storage, session=session)
+
+    def test_repr(self, async_storage):
+        assert repr(async_storage) == (
+            "<AsyncAmazonS3Storage storage="
+            "<AmazonS3Storage bucket='examplebucket'>>"
+        )
+
+    def test_requests_use_presigned_urls(self, async_storage, session):
+        session.responses.append(FakeResponse())
+        run(async_storage.exists(u'å.txt'))
+        method, url, _ = session.requests[0]
+        assert method == 'HEAD'
+        assert url.startswith(
+            'https://examplebucket.s3.amazonaws.com/%C3%A5.txt?'
+        )
+        assert 'X-Amz-Signature=' in url
+        assert 'X-Amz-Expires=900' in url
+
+    @pytest.mark.parametrize(('status', 'expected'), [
+        (200, True),
+        (404, False),
+    ])
+    def test_exists(self, async_storage, session, status, expected):
+        session.responses.append(FakeResponse(status=status))
+        assert run(async_storage.exists('foo')) is expected
+
+    def test_exists_raises_error_for_unexpected_status(
+        self, async_storage, session
+    ):
+        session.responses.append(FakeResponse(status=500))
+        with pytest.raises(SiiloError):
+            run(async_storage.exists('foo'))
+
+    def test_size_returns_content_length(self, async_storage, session):
+        session.responses.append(
+            FakeResponse(headers={'Content-Length': '123'})
+        )
+        assert run(async_storage.size('foo')) == 123
+
+    def test_size_raises_error_if_file_doesnt_exist(
+        self, async_storage, session
+    ):
+        session.responses.append(FakeResponse(status=404))
+        with pytest.raises(FileNotFoundError):
+            run(async_storage.size('foo'))
+
+    def test_delete_deletes_existing_file(self, async_storage, session):
+        session.responses.extend([FakeResponse(), FakeResponse(status=204)])
+        run(async_storage.delete('foo'))
+        assert [r[0] for r in session.requests] == ['HEAD', 'DELETE']
+
+    def test_delete_raises_error_if_file_doesnt_exist(
+        self, async_storage, session
+    ):
+        session.responses.append(FakeResponse(status=404))
+        with pytest.raises(FileNotFoundError):
+            run(async_storage.delete('foo'))
+        assert len(session.requests) == 1
+
+    def test_open_streams_file_in_read_mode(self, async_storage, session):
+        response = FakeResponse(data=b'xyzzy')
+        session.responses.append(response)
+
+        async def main():
+            async with await async_storage.open('foo') as f:
+                return await f.read(2), await f.read()
+        assert run(main()) == (b'xy', b'zzy')
+        assert session.requests[0][0] == 'GET'
+        assert response.release.called
+
+    def test_open_raises_error_if_file_doesnt_exist(
+        self, async_storage, session
+    ):
+        session.responses.append(FakeResponse(status=404))
+        with pytest.raises(FileNotFoundError):
+            run(async_storage.open('foo'))
+
+    def test_open_uploads_file_on_close_in_write_mode(
+        self, async_storage, session
+    ):
+        async_storage.SPOOL_SIZE = 4
+        session.responses.append(FakeResponse())
+
+        async def main():
+            async with await async_storage.open('foo', 'wb') as f:
+                await f.write(b'xyz')
+                await f.write(b'zy')
+        run(main())
+        method, url, kwargs = session.requests[0]
+        assert method == 'PUT'
+        assert kwargs['data'] == b'xyzzy'
+        assert kwargs['headers'] == {'Content-Length': '5'}
+
+    def test_spooled_file_is_written_in_thread_once_on_disk(
+        self, async_storage, session
+    ):
+        async_storage.SPOOL_SIZE = 4
+        session.responses.append(FakeResponse())
+        threads = []
+
+        async def main():
+            f = await async_storage.open('foo', 'wb')
+            write = f._file.write
+
+            def record_thread(data):
+                threads.append(threading.current_thread())
+                return write(data)
+
+            f._file.write = record_thread
+            await f.write(b'xyz')
+            await f.write(b'zy')
+            await f.close()
+        run(main())
+        assert threads[0] is threading.current_thread()
+        assert threads[1] is not threading.current_thread()
+        assert session.requests[0][2]['data'] == b'xyzzy'
+
+    def test_open_raises_error_for_unsupported_modes(self, async_storage):
+        with pytest.raises(ArgumentError):
+            run(async_storage.open('foo', 'r+'))
+
+    def test_url_uses_storage_url(self, async_storage):
+        assert run(async_storage.url('foo')) == (
+            'https://examplebucket.s3.amazonaws.com/foo'
+        )
+
+    def test_close_doesnt_close_given_session(self, async_storage, session):
+        session.close = mock.Mock()
+        run(async_storage.close())
+        assert not session.close.called
+
+    def test_close_closes_own_session(self, s3_storage):
+        from siilo.aio import AsyncAmazonS3Storage
+        pytest.importorskip('aiohttp')
+        async_storage = AsyncAmazonS3Storage(s3_storage, limit=5)
+
+        async def main():
+            session = async_storage.session
+            assert session.connector.limit == 5
+            await async_storage.close()
+            return session
+        assert run(main()).closed
+        assert async_storage._session is None
@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+
+def make_report(**ops_per_sec):
+    return {
+        'results': [
+            {'name': name, 'ops_per_sec': value}
+            for name, value in sorted(ops_per_sec.items())
+        ]
+    }
+
+
+@pytest.mark.parametrize(('percent', 'expected'), [
+    (0, 1),
+    (50, 5),
+    (99, 10),
+    (100, 10),
+])
+def test_percentile_uses_nearest_rank(percent, expected):
+    from benchmarks.run import percentile
+    assert percentile(list(range(1, 11)), percent) == expected
+
+
+def test_percentile_of_no_values_is_zero():
+    from benchmarks.run import percentile
+    assert percentile([], 50) == 0.0
+
+
+def test_measure_times_each_call():
+    from benchmarks.run import Benchmark, measure
+    calls = []
+    result = measure(Benchmark('example', calls.append, [1, 2, 3], 10))
+    assert calls == [1, 2, 3]
+    assert result['name'] == 'example'
+    assert result['ops'] == 3
+    assert result['ops_per_sec'] > 0
+    assert 0 <= result['p50_us'] <= result['p99_us']
+    assert result['bytes_per_sec'] == pytest.approx(
+        10 * result['ops_per_sec']
+    )
+
+
+def test_measure_without_bytes_per_op_has_no_bytes_per_sec():
+    from benchmarks.run import Benchmark, measure
+    result = measure(Benchmark('example', lambda arg: None, [1], 0))
+    assert result['bytes_per_sec'] is None
+
+
+def test_compare_returns_relative_changes():
+    from benchmarks.run import compare
+    changes = compare(
+        make_report(a=90.0, b=200.0, c=5.0),
+        make_report(a=100.0, b=100.0, d=5.0)
+    )
+    assert changes == [
+        ('a', 100.0, 90.0, pytest.approx(-0.1)),
+        ('b', 100.0, 200.0, pytest.approx(1.0)),
+    ]
+
+
+def test_regressions_are_changes_below_threshold():
+    from benchmarks.run import regressions
+    changes = [
+        ('a', 100.0, 85.0, -0.15),
+        ('b', 100.0, 75.0, -0.25),
+        ('c', 100.0, 150.0, 0.5),
+    ]
+    assert regressions(changes, threshold=0.2) == [changes[1]]
+
+
+def test_run_filters_benchmarks_by_name():
+    from benchmarks.run import run
+    lines = []
+    report = run(pattern='filesystem.exists[', scale=0.01, log=lines.append)
+    names = [result['name'] for result in report['results']]
+    assert names == [
+        'filesystem.exists[1 files]',
+        'filesystem.exists[10 files]',
+    ]
+    assert len(lines) == 2
+
+
+def test_read_benchmarks_can_run_without_write_benchmarks():
+    from benchmarks.run import run
+    report = run(pattern='.read[', scale=0.01)
+    names = [result['name'] for result in report['results']]
+    assert 'filesystem.read[1 KiB]' in names
+    assert all(result['ops'] > 0 for result in report['results'])
+
+
+def test_run_skips_suites_with_missing_dependencies(monkeypatch):
+    from benchmarks import run as module
+
+    def missing(scale):
+        raise ImportError('No module named fasteners')
+        yield
+
+    monkeypatch.setattr(module, 'SUITES', [('missing', missing)])
+    report = module.run()
+    assert report['results'] == []
+    assert report['skipped'] == {'missing': 'No module named fasteners'}
+
+
+def test_main_writes_results_as_json(tmpdir):
+    from benchmarks.run import main
+    output = tmpdir.join('results.json')
+    status = main([
+        '--filter', 'amazon_s3.url[unsigned]',
+        '--scale', '0.001',
+        '--output', str(output),
+    ])
+    assert status == 0
+    report = json.loads(output.read())
+    assert [result['name'] for result in report['results']] == [
+        'amazon_s3.url[unsigned]'
+    ]
+    assert report['results'][0]['ops'] == 10
+
+
+def test_main_fails_on_regression(tmpdir):
+    from benchmarks.run import main
+    baseline = tmpdir.join('baseline.json')
+    baseline.write(json.dumps(
+        make_report(**{'amazon_s3.url[unsigned]': 1e12})
+    ))
+    status = main([
+        '--filter', 'amazon_s3.url[unsigned]',
+        '--scale', '0.001',
+        '--output', str(tmpdir.join('results.json')),
+        '--compare', str(baseline),
+    ])
+    assert status == 1
+
+
+def test_main_passes_without_regression(tmpdir):
+    from benchmarks.run import main
+    baseline = tmpdir.join('baseline.json')
+    baseline.write(json.dumps(
+        make_report(**{'amazon_s3.url[unsigned]': 1.0})
+    ))
+    status = main([
+        '--filter', 'amazon_s3.url[unsigned]',
+        '--scale', '0.001',
+        '--output', str(tmpdir.join('results.json')),
+        '--compare', str(baseline),
+    ])
+    assert status == 0
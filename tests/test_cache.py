@@ -0,0 +1,70 @@
+import freezegun
+import pytest
+
+from siilo._cache import LRUCache
+
+
+@pytest.fixture
+def cache():
+    return LRUCache(maxsize=2)
+
+
+def test_get_returns_default_for_missing_key(cache):
+    assert cache.get('foo') is None
+    assert cache.get('foo', 'default') == 'default'
+    assert cache.misses == 2
+
+
+def test_get_returns_value_that_was_set(cache):
+    cache.set('foo', 'bar')
+    assert cache.get('foo') == 'bar'
+    assert cache.hits == 1
+
+
+def test_evicts_least_recently_used_entry(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(maxsize=2, ttl=5)
+    with freezegun.freeze_time('2014-01-01 12:00:00'):
+        cache.set('foo', 'bar')
+    with freezegun.freeze_time('2014-01-01 12:00:04'):
+        assert cache.get('foo') == 'bar'
+    with freezegun.freeze_time('2014-01-01 12:00:05'):
+        assert cache.get('foo') is None
+
+
+def test_discard_removes_entry(cache):
+    cache.set('foo', 'bar')
+    cache.discard('foo')
+    cache.discard('foo')
+    assert cache.get('foo') is None
+
+
+def test_clear_removes_all_entries(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_hit_ratio(cache):
+    assert cache.hit_ratio is None
+    cache.set('foo', 'bar')
+    cache.get('foo')
+    cache.get('foo')
+    cache.get('baz')
+    assert cache.hit_ratio == pytest.approx(2.0 / 3)
+
+
+def test_repr(cache):
+    cache.set('foo', 'bar')
+    assert repr(cache) == '<LRUCache maxsize=2, size=1>'
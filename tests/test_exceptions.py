@@ -6,6 +6,7 @@ from siilo.exceptions import (
     FileNotAccessibleViaURLError,
     FileNotFoundError,
     FileNotWithinStorageError,
+    ReplicationError,
     SiiloError,
 )
 
@@ -53,3 +54,17 @@ class TestExceptions(object):
 
     def test_is_silo_exception(self, exception, name, message):
         assert isinstance(exception, SiiloError)
+
+
+def test_replication_error():
+    errors = [('storage', IOError())]
+    exception = ReplicationError(force_bytes('Äö'), 1, 2, errors)
+    assert isinstance(exception, SiiloError)
+    assert exception.name == force_text('Äö')
+    assert exception.succeeded == 1
+    assert exception.quorum == 2
+    assert exception.errors == errors
+    assert text_type(exception) == force_text(
+        'The file "Äö" was changed in 1 replicas, fewer than the write '
+        'quorum of 2.'
+    )
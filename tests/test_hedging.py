@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+
+
+def make_policy(**kwargs):
+    from siilo.hedging import HedgePolicy
+    kwargs.setdefault('initial_delay', 0.01)
+    kwargs.setdefault('min_delay', 0)
+    return HedgePolicy(**kwargs)
+
+
+class SlowFirstCall(object):
+    """A function whose first call blocks until it is released, while
+    the following calls return immediately."""
+
+    def __init__(self):
+        self.calls = 0
+        self.results = []
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            self.released.wait(5)
+        result = Result(value, call)
+        self.results.append(result)
+        return result
+
+
+class Result(object):
+    def __init__(self, value, call):
+        self.value = value
+        self.call = call
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestHedgePolicy(object):
+    def test_fast_request_is_not_hedged(self):
+        policy = make_policy()
+        result = policy.call(lambda value: value * 2, 21)
+        assert result == 42
+        assert policy.requests == 1
+        assert policy.hedged == 0
+
+    def test_slow_request_is_hedged_and_hedge_wins(self):
+        policy = make_policy()
+        function = SlowFirstCall()
+        result = policy.call(function, 'x')
+        assert result.value == 'x'
+        assert result.call == 2
+        assert policy.hedged == 1
+        assert policy.hedges_won == 1
+        function.released.set()
+
+    def test_losing_result_is_closed(self):
+        policy = make_policy()
+        function = SlowFirstCall()
+        winner = policy.call(function, 'x')
+        function.released.set()
+        for _ in range(500):
+            if len(function.results) == 2 and function.results[1].closed:
+                break
+            threading.Event().wait(0.01)
+        loser = function.results[1]
+        assert loser.call == 1
+        assert loser.closed
+        assert not winner.closed
+
+    def test_no_hedge_when_budget_is_used_up(self):
+        policy = make_policy(budget_reserve=0, budget_ratio=0)
+        function = SlowFirstCall()
+        timer = threading.Timer(0.05, function.released.set)
+        timer.start()
+        result = policy.call(function, 'x')
+        assert result.call == 1
+        assert policy.hedged == 0
+        assert policy.budget_exhausted == 1
+
+    def test_budget_limits_hedges(self):
+        policy = make_policy(budget_reserve=1, budget_ratio=0)
+        first = SlowFirstCall()
+        policy.call(first, 'x')
+        first.released.set()
+        second = SlowFirstCall()
+        timer = threading.Timer(0.05, second.released.set)
+        timer.start()
+        policy.call(second, 'x')
+        assert policy.hedged == 1
+        assert policy.budget_exhausted == 1
+
+    def test_error_of_one_request_waits_for_the_other(self):
+        policy = make_policy()
+        calls = []
+        released = threading.Event()
+
+        def function():
+            calls.append(None)
+            if len(calls) == 1:
+                released.wait(5)
+                return 'slow'
+            raise IOError('hedge failed')
+
+        timer = threading.Timer(0.05, released.set)
+        timer.start()
+        assert policy.call(function) == 'slow'
+        assert policy.hedged == 1
+        assert policy.hedges_won == 0
+
+    def test_raises_error_of_first_request_if_both_fail(self):
+        policy = make_policy()
+        calls = []
+
+        def function():
+            calls.append(None)
+            if len(calls) == 1:
+                threading.Event().wait(0.05)
+                raise IOError('first')
+            raise IOError('second')
+
+        with pytest.raises(IOError) as excinfo:
+            policy.call(function)
+        assert str(excinfo.value) == 'first'
+
+    def test_delay_is_percentile_of_measured_latencies(self):
+        policy = make_policy(percentile=90, min_samples=10)
+        assert policy.delay == 0.01
+        future = type('Future', (), {'exception': lambda self: None})()
+        for latency in range(1, 17):
+            policy._measure(future, latency / 1000.0)
+        assert policy.delay == pytest.approx(0.015)
+
+    def test_delay_is_at_least_min_delay(self):
+        policy = make_policy(min_delay=0.02, min_samples=1)
+        future = type('Future', (), {'exception': lambda self: None})()
+        for _ in range(16):
+            policy._measure(future, 0.001)
+        assert policy.delay == 0.02
+
+    def test_failed_requests_are_not_measured(self):
+        policy = make_policy()
+        future = type('Future', (), {'exception': lambda self: IOError()})()
+        policy._measure(future, 1.0)
+        assert len(policy._latencies) == 0
+
+    def test_repr(self):
+        policy = make_policy()
+        assert repr(policy) == (
+            '<HedgePolicy delay=0.010, requests=0, hedged=0, hedges_won=0>'
+        )
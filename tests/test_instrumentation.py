@@ -0,0 +1,332 @@
+import logging
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.exceptions import FileNotFoundError
+
+
+@pytest.fixture
+def filesystem(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(
+        base_directory=str(tmpdir),
+        base_url='http://example.com/'
+    )
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def storage(filesystem, events):
+    from siilo.instrumentation import InstrumentedStorage
+    return InstrumentedStorage(filesystem, sinks=[events.append],
+                               backend='local')
+
+
+def operations(events):
+    return [(event.operation, event.name) for event in events]
+
+
+class TestInstrumentedStorage(object):
+    def test_backend_defaults_to_repr_of_storage(self, filesystem):
+        from siilo.instrumentation import InstrumentedStorage
+        storage = InstrumentedStorage(filesystem, sinks=[])
+        assert storage.backend == repr(filesystem)
+
+    def test_repr(self, storage, filesystem):
+        assert repr(storage) == (
+            '<InstrumentedStorage storage={0!r}>'.format(filesystem)
+        )
+
+    @pytest.mark.parametrize(('operation', 'args', 'expected'), [
+        ('exists', ('hello.txt',), True),
+        ('size', ('hello.txt',), 5),
+        ('url', ('hello.txt',), 'http://example.com/hello.txt'),
+    ])
+    def test_emits_event_for_operation(self, storage, filesystem, events,
+                                       operation, args, expected):
+        with filesystem.open('hello.txt', 'wb') as f:
+            f.write(b'hello')
+        assert getattr(storage, operation)(*args) == expected
+        event, = events
+        assert event.backend == 'local'
+        assert event.operation == operation
+        assert event.name == 'hello.txt'
+        assert event.seconds >= 0
+        assert event.bytes == 0
+        assert event.error is None
+
+    def test_emits_event_for_delete(self, storage, filesystem, events):
+        with filesystem.open('hello.txt', 'wb') as f:
+            f.write(b'hello')
+        storage.delete('hello.txt')
+        assert operations(events) == [('delete', 'hello.txt')]
+        assert not filesystem.exists('hello.txt')
+
+    def test_emits_event_for_copy_and_move(self, storage, filesystem,
+                                           events):
+        with filesystem.open('a.txt', 'wb') as f:
+            f.write(b'hello')
+        storage.copy('a.txt', 'b.txt')
+        storage.move('b.txt', 'c.txt')
+        assert operations(events) == [('copy', 'a.txt'), ('move', 'b.txt')]
+        assert filesystem.exists('c.txt')
+
+    def test_emits_event_for_delete_many(self, storage, events):
+        results = storage.delete_many(['missing.txt'])
+        assert isinstance(results['missing.txt'], FileNotFoundError)
+        assert operations(events) == [('delete_many', None)]
+
+    def test_emits_error_class_and_reraises(self, storage, events):
+        with pytest.raises(FileNotFoundError):
+            storage.size('missing.txt')
+        event, = events
+        assert event.operation == 'size'
+        assert event.error is FileNotFoundError
+
+    def test_write_emits_open_write_and_close(self, storage, filesystem,
+                                              events):
+        with storage.open('hello.txt', 'wb') as f:
+            assert f.write(b'hello') == 5
+            f.writelines([b' ', b'world'])
+        assert operations(events) == [
+            ('open', 'hello.txt'),
+            ('write', 'hello.txt'),
+            ('close', 'hello.txt'),
+        ]
+        assert events[1].bytes == 11
+        assert events[2].bytes == 11
+        with filesystem.open('hello.txt', 'rb') as f:
+            assert f.read() == b'hello world'
+
+    def test_write_to_libcloud_storage_counts_bytes(self, events):
+        from libcloud.storage.base import Container
+        from siilo.instrumentation import InstrumentedStorage
+        from siilo.storages.apache_libcloud import ApacheLibcloudStorage
+        container = mock.MagicMock(name='container', spec=Container)
+        storage = InstrumentedStorage(
+            ApacheLibcloudStorage(container=container),
+            sinks=[events.append]
+        )
+        with storage.open('hello.txt', 'wb') as f:
+            f.write(b'hello')
+            f.writelines([b' ', b'world'])
+        assert operations(events) == [
+            ('open', 'hello.txt'),
+            ('write', 'hello.txt'),
+            ('close', 'hello.txt'),
+        ]
+        assert events[1].bytes == 11
+
+    def test_read_emits_total_of_reads(self, storage, filesystem, events):
+        with filesystem.open('hello.txt', 'wb') as f:
+            f.write(b'line 1\nline 2\nline 3\n')
+        with storage.open('hello.txt', 'rb') as f:
+            assert f.readline() == b'line 1\n'
+            assert next(f) == b'line 2\n'
+            buffer = bytearray(3)
+            assert f.readinto(buffer) == 3
+            assert f.read() == b'e 3\n'
+            assert f.read() == b''
+        assert operations(events) == [
+            ('open', 'hello.txt'),
+            ('read', 'hello.txt'),
+            ('close', 'hello.txt'),
+        ]
+        assert events[1].bytes == 21
+        assert events[2].bytes == 0
+
+    def test_file_delegates_other_attributes(self, storage, filesystem):
+        with filesystem.open('hello.txt', 'wb') as f:
+            f.write(b'hello')
+        with storage.open('hello.txt', 'rb') as f:
+            f.seek(2)
+            assert f.tell() == 2
+            assert f.read() == b'llo'
+        assert f.closed
+
+    def test_close_twice_emits_once(self, storage, events):
+        f = storage.open('hello.txt', 'wb')
+        f.close()
+        f.close()
+        assert operations(events) == [
+            ('open', 'hello.txt'),
+            ('close', 'hello.txt'),
+        ]
+
+    def test_read_error_is_reported_on_close(self, storage, events):
+        with storage.open('hello.txt', 'wb') as f:
+            with pytest.raises(Exception):
+                f.read()
+        read_event = [e for e in events if e.operation == 'read'][0]
+        assert read_event.error is not None
+
+    def test_without_sinks_returns_unwrapped_file(self, filesystem):
+        from siilo.instrumentation import InstrumentedStorage
+        storage = InstrumentedStorage(filesystem, sinks=[])
+        with storage.open('hello.txt', 'wb') as f:
+            assert f.__class__.__name__ != '_InstrumentedFile'
+        assert storage.exists('hello.txt')
+
+    def test_sinks_can_be_enabled_later(self, filesystem, events):
+        from siilo.instrumentation import InstrumentedStorage
+        storage = InstrumentedStorage(filesystem, sinks=[])
+        storage.exists('a.txt')
+        storage.sinks.append(events.append)
+        storage.exists('b.txt')
+        assert operations(events) == [('exists', 'b.txt')]
+
+    def test_delegates_other_attributes(self, storage, filesystem):
+        assert storage.base_directory == filesystem.base_directory
+
+    def test_walk_is_delegated(self, storage, filesystem, events):
+        with filesystem.open('hello.txt', 'wb') as f:
+            f.write(b'hello')
+        assert [info.name for info in storage.walk()] == ['hello.txt']
+        assert events == []
+
+    @pytest.mark.parametrize('method_name', ['iter_urls', 'urls'])
+    def test_emits_event_for_iter_urls(self, storage, events, method_name):
+        urls = getattr(storage, method_name)(['a.txt', 'b.txt'])
+        assert list(urls) == [
+            'http://example.com/a.txt',
+            'http://example.com/b.txt',
+        ]
+        event, = events
+        assert (event.operation, event.name) == ('iter_urls', None)
+        assert event.seconds >= 0
+        assert event.error is None
+
+    def test_emits_event_for_failed_iter_urls(self, events):
+        from siilo.instrumentation import InstrumentedStorage
+        backend = mock.Mock(name='backend')
+        backend.iter_urls.return_value = iter(mock.Mock(
+            side_effect=ValueError
+        ), None)
+        storage = InstrumentedStorage(backend, sinks=[events.append])
+        with pytest.raises(ValueError):
+            list(storage.iter_urls(['a.txt']))
+        event, = events
+        assert (event.operation, event.error) == ('iter_urls', ValueError)
+
+    def test_url_and_iter_urls_pass_arguments_on(self, events):
+        from siilo.instrumentation import InstrumentedStorage
+        backend = mock.Mock(name='backend')
+        backend.iter_urls.return_value = iter(['http://example.com/a.txt'])
+        storage = InstrumentedStorage(backend, sinks=[events.append])
+        storage.url('a.txt', expires=60)
+        backend.url.assert_called_with('a.txt', expires=60)
+        assert list(storage.iter_urls(['a.txt'], expires=60)) == [
+            'http://example.com/a.txt'
+        ]
+        backend.iter_urls.assert_called_with(['a.txt'], expires=60)
+        assert operations(events) == [('url', 'a.txt'), ('iter_urls', None)]
+
+
+class TestLoggingSink(object):
+    def make_event(self, **kwargs):
+        from siilo.instrumentation import Event
+        values = dict(
+            backend='local',
+            operation='exists',
+            name='hello.txt',
+            seconds=0.0015,
+            bytes=0,
+            error=None
+        )
+        values.update(kwargs)
+        return Event(**values)
+
+    def test_logs_event(self, caplog):
+        from siilo.instrumentation import LoggingSink
+        sink = LoggingSink()
+        with caplog.at_level(logging.DEBUG, logger='siilo'):
+            sink(self.make_event())
+        record, = caplog.records
+        assert record.name == 'siilo'
+        assert record.levelno == logging.DEBUG
+        assert record.getMessage() == (
+            "local exists 'hello.txt': 1.500 ms, 0 bytes"
+        )
+
+    def test_logs_errors_as_warnings(self, caplog):
+        from siilo.instrumentation import LoggingSink
+        sink = LoggingSink()
+        with caplog.at_level(logging.DEBUG, logger='siilo'):
+            sink(self.make_event(error=FileNotFoundError))
+        record, = caplog.records
+        assert record.levelno == logging.WARNING
+        assert record.getMessage().endswith(
+            'failed with FileNotFoundError'
+        )
+
+    def test_skips_disabled_level(self, caplog):
+        from siilo.instrumentation import LoggingSink
+        sink = LoggingSink(logger=logging.getLogger('example'))
+        with caplog.at_level(logging.INFO, logger='example'):
+            sink(self.make_event())
+        assert caplog.records == []
+
+
+class TestHistogramSink(object):
+    def make_event(self, seconds, operation='read', bytes=0, error=None):
+        from siilo.instrumentation import Event
+        return Event('local', operation, 'hello.txt', seconds, bytes, error)
+
+    def test_summary_aggregates_by_backend_and_operation(self):
+        from siilo.instrumentation import HistogramSink
+        sink = HistogramSink()
+        sink(self.make_event(0.001, bytes=10))
+        sink(self.make_event(0.002, bytes=20, error=IOError))
+        sink(self.make_event(0.001, operation='exists'))
+        summary = sink.summary()
+        assert set(summary) == {('local', 'read'), ('local', 'exists')}
+        stats = summary[('local', 'read')]
+        assert stats.count == 2
+        assert stats.errors == 1
+        assert stats.bytes == 30
+        assert stats.seconds == pytest.approx(0.003)
+
+    def test_percentiles_are_upper_bounds_of_buckets(self):
+        from siilo.instrumentation import HistogramSink
+        sink = HistogramSink()
+        for _ in range(98):
+            sink(self.make_event(0.0000015))
+        sink(self.make_event(0.003))
+        sink(self.make_event(1.0))
+        stats = sink.summary()[('local', 'read')]
+        assert stats.p50 == pytest.approx(2e-6)
+        assert stats.p90 == pytest.approx(2e-6)
+        assert 0.003 <= stats.p99 <= 0.006
+
+    def test_sub_microsecond_and_huge_durations(self):
+        from siilo.instrumentation import HistogramSink
+        sink = HistogramSink()
+        sink(self.make_event(0.0))
+        sink(self.make_event(1e9))
+        stats = sink.summary()[('local', 'read')]
+        assert stats.p50 == pytest.approx(1e-6)
+        assert stats.p99 == pytest.approx(2 ** 31 / 1e6)
+
+    def test_reset(self):
+        from siilo.instrumentation import HistogramSink
+        sink = HistogramSink()
+        sink(self.make_event(0.001))
+        sink.reset()
+        assert sink.summary() == {}
+
+    def test_works_as_sink_of_instrumented_storage(self, filesystem):
+        from siilo.instrumentation import HistogramSink, InstrumentedStorage
+        sink = HistogramSink()
+        storage = InstrumentedStorage(filesystem, sinks=[sink],
+                                      backend='local')
+        for _ in range(3):
+            storage.exists('hello.txt')
+        assert sink.summary()[('local', 'exists')].count == 3
@@ -0,0 +1,204 @@
+import errno
+from socket import timeout
+import ssl
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from libcloud.common.exceptions import BaseHTTPError
+from libcloud.common.types import (
+    InvalidCredsError,
+    LibcloudError,
+    MalformedResponseError
+)
+from libcloud.storage.types import ObjectDoesNotExistError
+import pytest
+
+from siilo.exceptions import FileNotFoundError
+
+
+@pytest.fixture
+def sleep():
+    with mock.patch('siilo.retry.time.sleep') as sleep:
+        yield sleep
+
+
+def make_policy(**kwargs):
+    from siilo.retry import RetryPolicy
+    kwargs.setdefault('jitter', False)
+    return RetryPolicy(**kwargs)
+
+
+def failing(*errors):
+    """Return a function that raises the given errors in turn, and then
+    returns ``'ok'``."""
+    errors = list(errors)
+
+    def function():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    return function
+
+
+class TestRetryPolicy(object):
+    def test_returns_result_without_retries(self, sleep):
+        policy = make_policy()
+        assert policy.call('head', 'a.txt', None, lambda: 'ok') == 'ok'
+        assert policy.retries == 0
+        assert not sleep.called
+
+    def test_passes_arguments(self, sleep):
+        policy = make_policy()
+        assert policy.call('head', 'a.txt', None, max, 1, 3) == 3
+
+    def test_retries_transient_errors_with_exponential_backoff(self, sleep):
+        policy = make_policy(backoff=0.5)
+        function = failing(timeout(), timeout(), timeout())
+        assert policy.call('head', 'a.txt', None, function) == 'ok'
+        assert policy.retries == 3
+        assert sleep.call_args_list == [
+            mock.call(0.5),
+            mock.call(1.0),
+            mock.call(2.0),
+        ]
+
+    def test_backoff_is_capped(self, sleep):
+        policy = make_policy(backoff=1, max_backoff=1.5)
+        assert [policy.delay(attempt) for attempt in range(3)] == [
+            1, 1.5, 1.5
+        ]
+
+    def test_jitter_randomizes_delay_up_to_backoff(self):
+        policy = make_policy(backoff=1, jitter=True)
+        delays = [policy.delay(2) for _ in range(100)]
+        assert all(0 <= delay <= 4 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_gives_up_after_max_retries(self, sleep):
+        policy = make_policy(max_retries=2)
+        function = failing(timeout('1'), timeout('2'), timeout('3'))
+        with pytest.raises(IOError) as excinfo:
+            policy.call('head', 'a.txt', None, function)
+        assert str(excinfo.value) == '3'
+        assert policy.retries == 2
+
+    def test_doesnt_retry_errors_that_are_not_retryable(self, sleep):
+        policy = make_policy()
+        function = failing(FileNotFoundError('a.txt'))
+        with pytest.raises(FileNotFoundError):
+            policy.call('head', 'a.txt', None, function)
+        assert policy.retries == 0
+
+    def test_uses_custom_is_retryable(self, sleep):
+        policy = make_policy(
+            is_retryable=lambda exc: isinstance(exc, KeyError)
+        )
+        assert policy.call('head', 'a.txt', None, failing(KeyError())) == 'ok'
+        with pytest.raises(IOError):
+            policy.call('head', 'a.txt', None, failing(timeout()))
+
+    def test_retry_budget_limits_retries(self, sleep):
+        policy = make_policy(budget_reserve=2, budget_ratio=0)
+        for _ in range(2):
+            policy.call('head', 'a.txt', None, failing(timeout()))
+        with pytest.raises(IOError):
+            policy.call('head', 'a.txt', None, failing(timeout()))
+        assert policy.retries == 2
+        assert policy.budget_exhausted == 1
+
+    def test_requests_earn_retry_budget(self, sleep):
+        policy = make_policy(budget_reserve=1, budget_ratio=0.5)
+        policy.call('head', 'a.txt', None, failing(timeout()))
+        with pytest.raises(IOError):
+            policy.call('head', 'a.txt', None, failing(timeout()))
+        policy.call('head', 'a.txt', None, lambda: 'ok')
+        policy.call('head', 'a.txt', None, failing(timeout()))
+        assert policy.retries == 2
+
+    def test_counts_time_lost(self, sleep):
+        policy = make_policy()
+        policy.call('head', 'a.txt', None, failing(timeout(), timeout()))
+        assert policy.seconds_lost > 0
+
+    def test_emits_retry_events_to_sinks(self, sleep):
+        events = []
+        policy = make_policy(sinks=[events.append])
+        policy.call('download', 'a.txt', 'backend', failing(timeout()))
+        event, = events
+        assert event.backend == "'backend'"
+        assert event.operation == 'retry:download'
+        assert event.name == 'a.txt'
+        assert event.error is timeout
+        assert event.seconds >= 0
+
+    def test_begin_allows_resetting_attempts(self, sleep):
+        policy = make_policy(max_retries=1)
+        attempt = policy.begin('download', 'a.txt', None)
+        assert attempt.retry(timeout()) is True
+        assert attempt.retry(timeout()) is False
+        attempt.reset()
+        assert attempt.retry(timeout()) is True
+
+    def test_repr(self):
+        policy = make_policy()
+        assert repr(policy) == '<RetryPolicy retries=0, seconds_lost=0.000>'
+
+
+class ServiceError(Exception):
+    def __init__(self, code):
+        self.code = code
+
+
+@pytest.mark.parametrize(('exc', 'expected'), [
+    (IOError(errno.ECONNRESET, 'Connection reset by peer'), True),
+    (OSError(errno.ETIMEDOUT, 'Connection timed out'), True),
+    (timeout('timed out'), True),
+    (ssl.SSLError('EOF occurred in violation of protocol'), True),
+    (IOError(errno.ENOENT, 'No such file or directory'), False),
+    (OSError(errno.EACCES, 'Permission denied'), False),
+    (IOError(), False),
+    (ServiceError(500), True),
+    (ServiceError(503), True),
+    (ServiceError(408), True),
+    (ServiceError(429), True),
+    (ServiceError(400), False),
+    (ServiceError(404), False),
+    (BaseHTTPError(503, 'Service Unavailable'), True),
+    (BaseHTTPError(403, 'Forbidden'), False),
+    (LibcloudError('Unexpected status code: 503'), True),
+    (LibcloudError('Unknown error. Status code: 500'), True),
+    (LibcloudError('Unexpected status code, status_code=429'), True),
+    (LibcloudError('Unexpected status code: 400'), False),
+    (LibcloudError('This bucket is located in a different region.'), False),
+    (MalformedResponseError('Failed to parse XML'), False),
+    (InvalidCredsError('invalid'), False),
+    (ObjectDoesNotExistError('missing', None, 'a.txt'), False),
+    (FileNotFoundError('a.txt'), False),
+    (ValueError(), False),
+])
+def test_is_transient(exc, expected):
+    from siilo.retry import is_transient
+    assert is_transient(exc) is expected
+
+
+def s3_response(status):
+    from libcloud.storage.drivers.s3 import S3Response
+    response = mock.Mock(
+        status_code=status,
+        reason='Service Unavailable',
+        headers={},
+        text=''
+    )
+    return S3Response(response, mock.Mock(name='connection'))
+
+
+def test_s3_server_error_is_retried(sleep):
+    policy = make_policy()
+    responses = [503, 200]
+    response = policy.call(
+        'head', 'a.txt', None, lambda: s3_response(responses.pop(0))
+    )
+    assert response.status == 200
+    assert policy.retries == 1
@@ -0,0 +1,211 @@
+from datetime import datetime
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.storages.base import FileInfo
+
+
+@pytest.fixture
+def source(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(base_directory=str(tmpdir.join('source')))
+
+
+@pytest.fixture
+def destination(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(base_directory=str(tmpdir.join('destination')))
+
+
+def write(storage, name, data):
+    with storage.open(name, 'wb') as f:
+        f.write(data)
+
+
+def read(storage, name):
+    with storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def set_mtime(storage, name, timestamp):
+    import os
+    os.utime(storage._compute_path(name), (timestamp, timestamp))
+
+
+def test_sync_is_exported_from_package():
+    import siilo
+    from siilo._sync import sync
+    assert siilo.sync is sync
+
+
+def test_sync_transfers_missing_files(source, destination):
+    import siilo
+    write(source, 'a.txt', b'a')
+    write(source, 'b/c.txt', b'c')
+    report = siilo.sync(source, destination)
+    assert report.transferred == 2
+    assert report.bytes == 2
+    assert read(destination, 'b/c.txt') == b'c'
+
+
+def test_sync_skips_unchanged_files(source, destination):
+    import siilo
+    write(source, 'a.txt', b'a')
+    siilo.sync(source, destination)
+    with mock.patch.object(source, 'open') as open_:
+        report = siilo.sync(source, destination)
+    assert not open_.called
+    assert (report.transferred, report.skipped) == (0, 1)
+
+
+def test_sync_transfers_files_with_different_size(source, destination):
+    import siilo
+    write(source, 'a.txt', b'aa')
+    write(destination, 'a.txt', b'a')
+    set_mtime(source, 'a.txt', 1000)
+    assert siilo.sync(source, destination).transferred == 1
+    assert read(destination, 'a.txt') == b'aa'
+
+
+def test_sync_transfers_files_modified_in_source(source, destination):
+    import siilo
+    write(source, 'a.txt', b'b')
+    write(destination, 'a.txt', b'a')
+    set_mtime(destination, 'a.txt', 1000)
+    set_mtime(source, 'a.txt', 2000)
+    assert siilo.sync(source, destination).transferred == 1
+    assert read(destination, 'a.txt') == b'b'
+
+
+def test_sync_transfers_only_files_with_prefix(source, destination):
+    import siilo
+    write(source, 'a/x.txt', b'a')
+    write(source, 'b/x.txt', b'b')
+    assert siilo.sync(source, destination, prefix='a/').transferred == 1
+    assert not destination.exists('b/x.txt')
+
+
+def test_sync_checksum_mode_compares_contents(source, destination):
+    import siilo
+    write(source, 'a.txt', b'b')
+    write(source, 'b.txt', b'b')
+    write(destination, 'a.txt', b'a')
+    write(destination, 'b.txt', b'b')
+    for storage in (source, destination):
+        set_mtime(storage, 'a.txt', 1000)
+        set_mtime(storage, 'b.txt', 1000)
+    assert siilo.sync(source, destination).transferred == 0
+    report = siilo.sync(source, destination, checksum=True)
+    assert (report.transferred, report.skipped) == (1, 1)
+    assert read(destination, 'a.txt') == b'b'
+
+
+def test_sync_checksum_mode_reports_errors(source, destination):
+    import siilo
+    write(source, 'a.txt', b'a')
+    write(destination, 'a.txt', b'b')
+    error = IOError('boom')
+    with mock.patch.object(destination, 'open', side_effect=error):
+        report = siilo.sync(source, destination, checksum=True)
+    assert report.failures == {'a.txt': error}
+    assert report.transferred == 0
+
+
+@pytest.mark.parametrize('error', [None, IOError('boom')])
+def test_sync_checksum_mode_uses_one_thread_without_connection_pool(
+    source, destination, error
+):
+    import threading
+    import siilo
+    write(source, 'a.txt', b'b')
+    write(destination, 'a.txt', b'a')
+    destination.connection_pool = None
+    threads = set()
+    open_ = destination.open
+
+    def open_in_thread(name, mode):
+        threads.add(threading.current_thread())
+        if error is not None and mode == 'rb':
+            raise error
+        return open_(name, mode)
+
+    destination.open = open_in_thread
+    report = siilo.sync(source, destination, checksum=True)
+    assert threads == {threading.current_thread()}
+    if error is None:
+        assert report.transferred == 1
+    else:
+        assert report.failures == {'a.txt': error}
+
+
+def test_sync_keeps_extraneous_files_by_default(source, destination):
+    import siilo
+    write(destination, 'a.txt', b'a')
+    assert siilo.sync(source, destination).deleted == 0
+    assert destination.exists('a.txt')
+
+
+def test_sync_deletes_extraneous_files(source, destination):
+    import siilo
+    write(source, 'b.txt', b'b')
+    write(destination, 'a.txt', b'a')
+    write(destination, 'c/d.txt', b'd')
+    report = siilo.sync(source, destination, delete=True)
+    assert (report.transferred, report.deleted) == (1, 2)
+    assert [info.name for info in destination.walk()] == ['b.txt']
+
+
+def test_merge_pairs_sorted_listings():
+    from siilo._sync import _merge
+    a, b, c, d = [FileInfo(name, 1, None, None) for name in 'abcd']
+    assert list(_merge([a, c, d], [b, c])) == [
+        (a, None),
+        (None, b),
+        (c, c),
+        (d, None),
+    ]
+    assert list(_merge([], [])) == []
+
+
+@pytest.mark.parametrize(('source_info', 'destination_info', 'expected'), [
+    (FileInfo('a', 1, None, None), None, True),
+    (FileInfo('a', 1, None, None), FileInfo('a', None, None, None), True),
+    (FileInfo('a', 1, None, None), FileInfo('a', 2, None, None), True),
+    (FileInfo('a', 1, None, None), FileInfo('a', 1, None, None), False),
+    (
+        FileInfo('a', 1, datetime(2014, 1, 2), None),
+        FileInfo('a', 1, datetime(2014, 1, 1), None),
+        True
+    ),
+    (
+        FileInfo('a', 1, datetime(2014, 1, 1), None),
+        FileInfo('a', 1, datetime(2014, 1, 2), None),
+        False
+    ),
+    (FileInfo('a', 1, None, 'x'), FileInfo('a', 1, None, 'y'), True),
+    (FileInfo('a', 1, None, 'x'), FileInfo('a', 1, None, 'x'), False),
+])
+def test_has_changed(source_info, destination_info, expected):
+    from siilo._sync import _has_changed
+    assert _has_changed(source_info, destination_info) is expected
+
+
+def test_md5_uses_plain_md5_etag_without_reading_file():
+    from siilo._sync import _md5
+    storage = mock.Mock()
+    etag = '"D41D8CD98F00B204E9800998ECF8427E"'
+    info = FileInfo('a', 0, None, etag)
+    assert _md5(storage, info) == 'd41d8cd98f00b204e9800998ecf8427e'
+    assert not storage.open.called
+
+
+def test_md5_reads_file_with_multipart_etag(source):
+    import hashlib
+    from siilo._sync import _md5
+    write(source, 'a.txt', b'abc')
+    info = FileInfo('a.txt', 3, None, 'd41d8cd98f00b204e9800998ecf8427e-2')
+    assert _md5(source, info) == hashlib.md5(b'abc').hexdigest()
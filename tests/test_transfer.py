@@ -0,0 +1,238 @@
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from siilo.exceptions import FileNotFoundError
+
+
+@pytest.fixture
+def source(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    storage = FileSystemStorage(base_directory=str(tmpdir.join('source')))
+    for i in range(20):
+        with storage.open('dir/file{0}'.format(i), 'wb') as f:
+            f.write(b'x' * i)
+    return storage
+
+
+@pytest.fixture
+def destination(tmpdir):
+    from siilo.storages.filesystem import FileSystemStorage
+    return FileSystemStorage(base_directory=str(tmpdir.join('destination')))
+
+
+@pytest.fixture
+def manager(source, destination):
+    from siilo.transfer import TransferManager
+    return TransferManager(
+        source,
+        destination,
+        max_workers=4,
+        retry_delay=0,
+        chunk_size=4
+    )
+
+
+def names():
+    return ('dir/file{0}'.format(i) for i in range(20))
+
+
+def test_repr(manager, source, destination):
+    assert repr(manager) == (
+        '<TransferManager source={0!r}, destination={1!r}>'.format(
+            source,
+            destination
+        )
+    )
+
+
+def test_transfer_copies_files(manager, destination):
+    report = manager.transfer(names())
+    assert report.files == 20
+    assert report.bytes == sum(range(20))
+    assert report.failures == {}
+    assert report.retries == 0
+    for i in range(20):
+        assert destination.size('dir/file{0}'.format(i)) == i
+
+
+def test_transfer_runs_files_in_parallel(manager, source):
+    import time
+    lock = threading.Lock()
+    running = []
+    peak = []
+    open_ = source.open
+
+    def slow_open(name, mode):
+        with lock:
+            running.append(name)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(name)
+        return open_(name, mode)
+
+    with mock.patch.object(source, 'open', slow_open):
+        assert manager.transfer(names()).files == 20
+    assert max(peak) == 4
+
+
+def test_transfer_calls_progress_callback(manager):
+    calls = []
+    lock = threading.Lock()
+
+    def progress(name, count):
+        with lock:
+            calls.append((name, count))
+
+    manager.transfer(['dir/file10'], progress=progress)
+    assert calls == [('dir/file10', 4), ('dir/file10', 4), ('dir/file10', 2)]
+
+
+def test_transfer_retries_failed_files(manager, destination):
+    open_ = destination.open
+    attempts = []
+
+    def flaky_open(name, mode):
+        attempts.append(name)
+        if len(attempts) < 3:
+            raise IOError('connection reset')
+        return open_(name, mode)
+
+    with mock.patch.object(destination, 'open', flaky_open):
+        report = manager.transfer(['dir/file5'])
+    assert report.files == 1
+    assert report.retries == 2
+    assert destination.size('dir/file5') == 5
+
+
+class FailingReader(object):
+    """A source file whose read fails after the first chunk."""
+
+    def __init__(self, file):
+        self.file = file
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        if self.reads > 1:
+            raise IOError('connection reset')
+        return self.file.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+
+def test_failed_read_deletes_truncated_destination(manager, source,
+                                                   destination):
+    open_ = source.open
+    manager.retries = 0
+    with mock.patch.object(
+        source,
+        'open',
+        lambda name, mode: FailingReader(open_(name, mode))
+    ):
+        report = manager.transfer(['dir/file10'])
+    assert list(report.failures) == ['dir/file10']
+    assert not destination.exists('dir/file10')
+
+
+def test_failed_read_discards_atomic_destination(manager, source,
+                                                 destination):
+    open_ = source.open
+    manager.retries = 0
+    destination.atomic_writes = True
+    with destination.open('dir/file10', 'wb') as f:
+        f.write(b'old')
+    with mock.patch.object(
+        source,
+        'open',
+        lambda name, mode: FailingReader(open_(name, mode))
+    ):
+        report = manager.transfer(['dir/file10'])
+    assert list(report.failures) == ['dir/file10']
+    with destination.open('dir/file10', 'rb') as f:
+        assert f.read() == b'old'
+
+
+def test_transfer_reports_failures(manager):
+    report = manager.transfer(['dir/file1', 'missing'])
+    assert report.files == 1
+    assert report.retries == 2
+    assert list(report.failures) == ['missing']
+    assert isinstance(report.failures['missing'], FileNotFoundError)
+
+
+def test_transfer_is_serial_for_storages_without_connection_pool(
+    manager, destination
+):
+    from siilo.transfer import _is_thread_safe
+    destination.connection_pool = None
+    assert not _is_thread_safe(destination)
+    threads = set()
+    open_ = destination.open
+
+    def open_in_thread(name, mode):
+        threads.add(threading.current_thread())
+        return open_(name, mode)
+
+    destination.open = open_in_thread
+    with mock.patch('siilo.transfer.map_bounded') as map_bounded:
+        report = manager.transfer(names())
+    assert not map_bounded.called
+    assert threads == {threading.current_thread()}
+    assert report.files == 20
+
+
+def test_serial_transfer_reports_failures(manager, destination):
+    destination.connection_pool = None
+    report = manager.transfer(['dir/file1', 'missing'])
+    assert report.files == 1
+    assert list(report.failures) == ['missing']
+
+
+def test_wrapping_storage_is_as_thread_safe_as_wrapped_storage():
+    from siilo.transfer import _is_thread_safe
+    wrapped = mock.Mock(spec=['connection_pool'], connection_pool=None)
+    assert not _is_thread_safe(mock.Mock(spec=['storage'], storage=wrapped))
+    wrapped.connection_pool = mock.Mock()
+    assert _is_thread_safe(mock.Mock(spec=['storage'], storage=wrapped))
+
+
+def test_replicated_storage_is_thread_safe_if_all_replicas_are():
+    from siilo.transfer import _is_thread_safe
+    safe = mock.Mock(spec=['connection_pool'])
+    unsafe = mock.Mock(spec=['connection_pool'], connection_pool=None)
+    replicated = mock.Mock(spec=['storages'], storages=[safe, safe])
+    assert _is_thread_safe(replicated)
+    replicated.storages.append(unsafe)
+    assert not _is_thread_safe(replicated)
+
+
+def test_report_throughput_and_str():
+    from siilo.transfer import TransferReport
+    report = TransferReport(
+        files=3,
+        bytes=5000000,
+        seconds=2.0,
+        retries=1,
+        failures={'foo': Exception()}
+    )
+    assert report.throughput == 2500000.0
+    assert str(report) == (
+        '3 files, 5.0 MB in 2.0 s (2.5 MB/s), 1 retries, 1 failures'
+    )
+
+
+def test_report_throughput_of_instant_transfer():
+    from siilo.transfer import TransferReport
+    report = TransferReport(files=0, bytes=0, seconds=0, retries=0,
+                            failures={})
+    assert report.throughput == 0.0